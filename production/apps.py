@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProductionConfig(AppConfig):
     name = 'production'
+    
+    def ready(self):
+        # キャッシュした ProdUser を消す signal handler を登録する
+        from . import signals
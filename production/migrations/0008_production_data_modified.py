@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0007_production_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='production',
+            name='data_modified',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='データの変更日時'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0008_production_data_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='production',
+            name='atnd_log_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='空欄なら既定の日数、0 なら削除しません', null=True, verbose_name='出欠の変更履歴の保存日数'),
+        ),
+    ]
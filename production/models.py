@@ -7,12 +7,34 @@ class Production(models.Model):
     '''公演
     '''
     name = models.CharField('公演名', max_length=50)
+    # 稽古・シーン・配役・出欠などのデータが変わるたびに増える
+    # (rehearsal.signals で更新し、キャッシュのキーに使う)
+    data_version = models.PositiveIntegerField('データの版', default=0,
+        editable=False)
+    # data_version を最後に進めた日時 (Last-Modified に使う)
+    data_modified = models.DateTimeField('データの変更日時', blank=True,
+        null=True, editable=False)
+    # 出欠の変更履歴を残す日数 (空なら settings.ATND_LOG_RETENTION_DAYS)
+    # (manage.py prune_atnd_logs が、これより古い履歴を削除する)
+    atnd_log_retention_days = models.PositiveIntegerField(
+        '出欠の変更履歴の保存日数', blank=True, null=True,
+        help_text='空欄なら既定の日数、0 なら削除しません')
     
     class Meta:
         verbose_name = verbose_name_plural = '公演'
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        # データの版は rehearsal.cache_func.bump_data_version だけが進める
+        # 読み込んだ時点の古い版で上書きして、版が戻らないようにする
+        if not self._state.adding and not kwargs.get('update_fields'):
+            kwargs['update_fields'] = [field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ('data_version', 'data_modified')]
+        super().save(*args, **kwargs)
 
 
 class ProdUser(models.Model):
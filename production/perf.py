@@ -0,0 +1,165 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, deque
+from django.conf import settings
+from django.db import connection
+
+
+# 保持するリクエストの記録の数 (settings.PERF_MONITOR_BUFFER_SIZE で変更可)
+DEFAULT_BUFFER_SIZE = 1000
+
+# 1リクエストあたりに記録する重複クエリの数
+DUPLICATES_PER_REQUEST = 5
+
+_records = deque(maxlen=getattr(settings, 'PERF_MONITOR_BUFFER_SIZE',
+    DEFAULT_BUFFER_SIZE))
+_records_lock = threading.Lock()
+
+
+def sql_fingerprint(sql):
+    '''SQL からリテラルを除いて、同じ形のクエリが同じ文字列になるようにする
+    '''
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class QueryCollector:
+    '''connection.execute_wrapper に渡して、クエリの数と時間を集める
+    '''
+    
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+    
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[sql_fingerprint(sql)] += 1
+    
+    def duplicates(self):
+        '''2回以上実行された形のクエリの [(fingerprint, 回数)] (多い順)
+        '''
+        return [(sql, count) for sql, count
+            in self.fingerprints.most_common(DUPLICATES_PER_REQUEST)
+            if count > 1]
+
+
+class PerfMiddleware:
+    '''リクエストごとの処理時間、クエリ数、SQL の時間、重複クエリ、
+    レスポンスのサイズを記録するミドルウェア
+    
+    settings.MIDDLEWARE に追加した時だけ動く
+    記録はプロセスごとのリングバッファに残り、PerfReport で集計して表示する
+    '''
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        collector = QueryCollector()
+        start = time.perf_counter()
+        with connection.execute_wrapper(collector):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        
+        # URLconf で名前を付けたビューだけを記録する
+        match = getattr(request, 'resolver_match', None)
+        if match and match.view_name:
+            record_request({
+                'url_name': match.view_name,
+                'status': response.status_code,
+                'ms': elapsed * 1000,
+                'queries': collector.count,
+                'sql_ms': collector.seconds * 1000,
+                'duplicates': collector.duplicates(),
+                'size': None if response.streaming else len(response.content),
+            })
+        
+        return response
+
+
+def record_request(record):
+    '''リクエストの記録をリングバッファに追加する
+    '''
+    with _records_lock:
+        _records.append(record)
+
+
+def percentile(values, rate):
+    '''最近傍順位法による百分位数 (values はソート済み)
+    '''
+    if not values:
+        return None
+    return values[min(max(math.ceil(len(values) * rate), 1), len(values)) - 1]
+
+
+def perf_summary():
+    '''リングバッファの記録を URL 名ごとに集計する
+    
+    Returns
+    -------
+    [
+        {
+            url_name: URL 名,
+            count: リクエスト数,
+            ms: {p50, p95, p99},
+            queries: {p50, p95, p99},
+            sql_ms: {p50, p95, p99},
+            size: レスポンスのサイズの平均 (バイト),
+            duplicates: [(fingerprint, 1リクエストでの最大の回数)]
+        }
+    ]
+    処理時間の p95 が大きい順
+    '''
+    with _records_lock:
+        records = list(_records)
+    
+    url_records = {}
+    for record in records:
+        url_records.setdefault(record['url_name'], []).append(record)
+    
+    summary = []
+    for url_name, records in url_records.items():
+        stats = {'url_name': url_name, 'count': len(records)}
+        for key in ['ms', 'queries', 'sql_ms']:
+            values = sorted(record[key] for record in records)
+            stats[key] = {
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+            }
+        sizes = [record['size'] for record in records
+            if record['size'] is not None]
+        stats['size'] = sum(sizes) / len(sizes) if sizes else None
+        duplicates = {}
+        for record in records:
+            for sql, count in record['duplicates']:
+                duplicates[sql] = max(duplicates.get(sql, 0), count)
+        stats['duplicates'] = sorted(duplicates.items(),
+            key=lambda item: -item[1])[:DUPLICATES_PER_REQUEST]
+        summary.append(stats)
+    
+    summary.sort(key=lambda stats: -stats['ms']['p95'])
+    return summary
+
+
+def perf_enabled():
+    '''PerfMiddleware が有効になっているか
+    '''
+    return 'production.perf.PerfMiddleware' in settings.MIDDLEWARE
+
+
+def clear_records():
+    '''記録を全て消す
+    '''
+    with _records_lock:
+        _records.clear()
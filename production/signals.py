@@ -0,0 +1,13 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import ProdUser
+from .view_func import prod_user_cache_key
+
+
+@receiver(post_save, sender=ProdUser)
+@receiver(post_delete, sender=ProdUser)
+def clear_prod_user_cache(sender, instance, **kwargs):
+    '''公演ユーザの権限が変わったら、キャッシュした ProdUser を消す
+    '''
+    cache.delete(prod_user_cache_key(instance.production_id, instance.user_id))
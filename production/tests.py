@@ -1,3 +1,141 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase,\
+    override_settings
+from django.views import View
+from accounts.models import User
+from .models import Production, ProdUser
+from .perf import QueryCollector, percentile, record_request, clear_records
+from .view_func import accessing_prod_user
 
-# Create your tests here.
+
+class AccessingProdUserTest(TestCase):
+    '''accessing_prod_user のキャッシュのテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member', password='password')
+        cls.prod = Production.objects.create(name='公演')
+        cls.prod_user = ProdUser.objects.create(production=cls.prod,
+            user=cls.user, is_editor=False)
+        cls.other_prod = Production.objects.create(name='他の公演')
+    
+    def setUp(self):
+        cache.clear()
+    
+    def make_view(self):
+        view = View()
+        view.request = RequestFactory().get('/')
+        view.request.user = self.user
+        view.kwargs = {'prod_id': self.prod.id}
+        return view
+    
+    def test_memoized_per_request(self):
+        view = self.make_view()
+        with self.assertNumQueries(2):
+            self.assertEqual(accessing_prod_user(view), self.prod_user)
+            self.assertEqual(accessing_prod_user(view, self.prod.id),
+                self.prod_user)
+            self.assertIsNone(accessing_prod_user(view, self.other_prod.id))
+            self.assertIsNone(accessing_prod_user(view, self.other_prod.id))
+        
+        # 別のリクエストでは取得し直す
+        with self.assertNumQueries(1):
+            accessing_prod_user(self.make_view())
+    
+    @override_settings(PROD_USER_CACHE_TIMEOUT=60)
+    def test_cached_across_requests(self):
+        accessing_prod_user(self.make_view())
+        with self.assertNumQueries(0):
+            prod_user = accessing_prod_user(self.make_view())
+        self.assertFalse(prod_user.is_editor)
+        
+        # ProdUser が変わったらキャッシュを消す
+        self.prod_user.is_editor = True
+        self.prod_user.save()
+        with self.assertNumQueries(1):
+            prod_user = accessing_prod_user(self.make_view())
+        self.assertTrue(prod_user.is_editor)
+        
+        self.prod_user.delete()
+        self.assertIsNone(accessing_prod_user(self.make_view()))
+
+
+class QueryCollectorTest(TestCase):
+    '''QueryCollector による、クエリの数と重複の集計のテスト
+    '''
+    
+    def test_collect(self):
+        collector = QueryCollector()
+        with connection.execute_wrapper(collector):
+            for i in range(3):
+                Production.objects.filter(pk=i).exists()
+            Production.objects.filter(name='公演').exists()
+        self.assertEqual(collector.count, 4)
+        self.assertGreaterEqual(collector.seconds, 0)
+        
+        # リテラルを除いた同じ形のクエリをまとめる
+        duplicates = collector.duplicates()
+        self.assertEqual(len(duplicates), 1)
+        sql, count = duplicates[0]
+        self.assertEqual(count, 3)
+        self.assertIn('?', sql)
+
+
+class PercentileTest(SimpleTestCase):
+    '''percentile のテスト
+    '''
+    
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1.0), 100)
+        self.assertEqual(percentile([3, 7], 0.50), 3)
+        self.assertEqual(percentile([3, 7], 0.95), 7)
+        self.assertEqual(percentile([5], 0.0), 5)
+        self.assertIsNone(percentile([], 0.50))
+
+
+class PerfReportTest(TestCase):
+    '''処理時間のレポートのアクセス権のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner', password='password')
+        prod = Production.objects.create(name='公演')
+        ProdUser.objects.create(production=prod, user=cls.owner,
+            is_owner=True)
+        cls.staff = User.objects.create_user('staff', password='password',
+            is_staff=True)
+        cls.superuser = User.objects.create_superuser('admin',
+            password='password')
+    
+    def setUp(self):
+        clear_records()
+        record_request({'url_name': 'rehearsal:rhsl_list', 'status': 200,
+            'ms': 10.0, 'queries': 3, 'sql_ms': 1.0, 'duplicates': [],
+            'size': 100})
+    
+    def tearDown(self):
+        clear_records()
+    
+    def test_owner_denied(self):
+        # 公演の所有者でも、他の人のリクエストの記録は見られない
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get('/prod/perf/').status_code, 403)
+    
+    def test_anonymous_redirected(self):
+        self.assertEqual(self.client.get('/prod/perf/').status_code, 302)
+    
+    def test_staff_allowed(self):
+        for user in [self.staff, self.superuser]:
+            self.client.force_login(user)
+            response = self.client.get('/prod/perf/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([stats['url_name']
+                    for stats in response.context['summary']],
+                ['rehearsal:rhsl_list'])
@@ -33,4 +33,7 @@ urlpatterns = [
 
     # /prod/prod_join/1/ -> Join to Production via Invitation #1
     path('prod_join/<int:invt_id>/', views.ProdJoin.as_view(), name='prod_join'),
+
+    # /prod/perf/ -> Performance report (PerfMiddleware)
+    path('perf/', views.PerfReport.as_view(), name='perf_report'),
 ]
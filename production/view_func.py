@@ -1,10 +1,26 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from .models import ProdUser
 
 
+# キャッシュにない時の、cache.get の既定値
+_MISSING = object()
+
+
+def prod_user_cache_key(prod_id, user_id):
+    '''ProdUser のキャッシュのキー
+    '''
+    return 'prod_user:{}:{}'.format(prod_id, user_id)
+
+
 def accessing_prod_user(view, prod_id=None):
     '''アクセス情報から対応する ProdUser を取得する
     
+    同じリクエストの中では、公演ごとに1回だけ取得する
+    settings.PROD_USER_CACHE_TIMEOUT を設定すれば、リクエストをまたいでも
+    キャッシュする (ProdUser が変わったら production.signals で消す)
+    
     Parameters
     ----------
     view : View
@@ -14,11 +30,36 @@ def accessing_prod_user(view, prod_id=None):
     '''
     if not prod_id:
         prod_id=view.kwargs['prod_id']
-    prod_users = ProdUser.objects.filter(
-        production__pk=prod_id, user=view.request.user)
-    if len(prod_users) < 1:
-        return None
-    return prod_users[0]
+    request = view.request
+    
+    # リクエストごとの、公演の id -> ProdUser (公演ユーザでなければ None)
+    prod_users = getattr(request, '_prod_users', None)
+    if prod_users is None:
+        prod_users = request._prod_users = {}
+    prod_id = int(prod_id)
+    if prod_id not in prod_users:
+        prod_users[prod_id] = cached_prod_user(prod_id, request.user)
+    return prod_users[prod_id]
+
+
+def cached_prod_user(prod_id, user):
+    '''公演とユーザから ProdUser を取得する (公演ユーザでなければ None)
+    
+    'default' のキャッシュがプロセスごとの場合、他のプロセスでの権限の変更は
+    settings.PROD_USER_CACHE_TIMEOUT 秒だけ遅れて反映される
+    '''
+    timeout = getattr(settings, 'PROD_USER_CACHE_TIMEOUT', 0)
+    if not timeout or not user.is_authenticated:
+        return ProdUser.objects.filter(
+            production__pk=prod_id, user=user).first()
+    
+    key = prod_user_cache_key(prod_id, user.pk)
+    prod_user = cache.get(key, _MISSING)
+    if prod_user is _MISSING:
+        prod_user = ProdUser.objects.filter(
+            production__pk=prod_id, user=user).first()
+        cache.set(key, prod_user, timeout)
+    return prod_user
 
 
 def test_edit_permission(view, prod_id=None):
@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
-from django.views.generic import ListView
+from django.views.generic import ListView, TemplateView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.http import Http404
 from django.urls import reverse_lazy
@@ -12,6 +12,7 @@ from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
 from .view_func import *
 from .models import Production, ProdUser, Invitation
+from .perf import perf_summary, perf_enabled
 
 
 class ProdList(LoginRequiredMixin, ListView):
@@ -76,7 +77,7 @@ class ProdUpdate(LoginRequiredMixin, UpdateView):
     """Production の更新ビュー
     """
     model = Production
-    fields = ('name',)
+    fields = ('name', 'atnd_log_retention_days')
     success_url = reverse_lazy('production:prod_list')
     
     def get(self, request, *args, **kwargs):
@@ -500,3 +501,28 @@ class ProdJoin(LoginRequiredMixin, CreateView):
             raise PermissionDenied
 
         return invt.production
+
+
+class PerfReport(LoginRequiredMixin, TemplateView):
+    """PerfMiddleware の記録を URL 名ごとに集計して表示するビュー
+    
+    サイト全体のリクエストの記録なので、スタッフか管理者だけが見られる
+    """
+    template_name = 'production/perf_report.html'
+    
+    def get(self, request, *args, **kwargs):
+        """表示時のリクエストを受けるハンドラ
+        """
+        # スタッフか管理者でなければアクセス拒否
+        if not (request.user.is_staff or request.user.is_superuser):
+            raise PermissionDenied
+        
+        return super().get(request, *args, **kwargs)
+    
+    def get_context_data(self, **kwargs):
+        """テンプレートに渡すパラメタを改変する
+        """
+        context = super().get_context_data(**kwargs)
+        context['perf_enabled'] = perf_enabled()
+        context['summary'] = perf_summary()
+        return context
@@ -87,6 +87,82 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# リクエストごとの処理時間やクエリ数を記録する (/prod/perf/ で表示)
+# 計測のためのオーバーヘッドがあるので、必要な時だけ有効にする
+if os.environ.get('PERF_MONITOR', 'False') == 'True':
+    MIDDLEWARE.insert(1, 'production.perf.PerfMiddleware')
+    PERF_MONITOR_BUFFER_SIZE = int(
+        os.environ.get('PERF_MONITOR_BUFFER_SIZE', '1000'))
+
+# Cache
+# 'default' はプロセスごとのメモリ
+# 'payloads' は分析系のビューのデータ (公演 id とデータの版をキーにする)
+# PAYLOAD_CACHE_BACKEND で、インスタンス間で共有するバックエンドに切り替えられる
+#   locmem (既定): プロセスごとのメモリ、PAYLOAD_CACHE_MAX_ENTRIES 件を超えたら
+#       最も長く使われていないものから消す (LRU)
+#   file: PAYLOAD_CACHE_LOCATION のディレクトリ (同じマシンのプロセスで共有)
+#   db: データベースのテーブル (要 manage.py createcachetable、全インスタンスで共有)
+#   その他: キャッシュのバックエンドのクラスのパス (redis など)
+PAYLOAD_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+}
+PAYLOAD_CACHE_BACKEND = os.environ.get('PAYLOAD_CACHE_BACKEND', 'locmem')
+PAYLOAD_CACHE_LOCATION = {
+    'locmem': 'pscweb2-payloads',
+    'file': os.path.join(os.environ.get('TMPDIR', '/tmp'), 'pscweb2-payloads'),
+    'db': 'pscweb2_payload_cache',
+}.get(PAYLOAD_CACHE_BACKEND, '')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'payloads': {
+        'BACKEND': PAYLOAD_CACHE_BACKENDS.get(
+            PAYLOAD_CACHE_BACKEND, PAYLOAD_CACHE_BACKEND),
+        'LOCATION': os.environ.get(
+            'PAYLOAD_CACHE_LOCATION', PAYLOAD_CACHE_LOCATION),
+        # キーに版を含めるので古い値は読まれないが、1日で消えるようにする
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.environ.get('PAYLOAD_CACHE_MAX_ENTRIES', '200')),
+        },
+    },
+}
+
+# アクセス中のユーザの公演ごとの権限 (ProdUser) を 'default' のキャッシュに
+# 保持する秒数 (0 ならリクエストごとに取得する)
+PROD_USER_CACHE_TIMEOUT = int(os.environ.get('PROD_USER_CACHE_TIMEOUT', '0'))
+
+# 出欠の変更履歴を残す日数の既定値 (公演ごとに変えられる、0 なら削除しない)
+ATND_LOG_RETENTION_DAYS = int(os.environ.get('ATND_LOG_RETENTION_DAYS', '365'))
+
+# 台本の解析結果をプロセスごとに保持する大きさ (文字数の見積もり)
+# 超えたら最も長く使われていないものから消す
+SCRIPT_CACHE_MAX_SIZE = int(
+    os.environ.get('SCRIPT_CACHE_MAX_SIZE', str(16 * 1024 * 1024)))
+
+# この大きさ (文字数) 以上の台本は、シーンごとのチャンクに分けて
+# プロセスプールで解析する (チャンクごとに解析結果をキャッシュする)
+SCRIPT_CHUNK_MIN_SIZE = int(
+    os.environ.get('SCRIPT_CHUNK_MIN_SIZE', str(1024 * 1024)))
+
+# チャンクを解析するプロセスの数 (0 なら CPU の数、1 ならプロセスプールを
+# 使わない)
+SCRIPT_CHUNK_WORKERS = int(os.environ.get('SCRIPT_CHUNK_WORKERS', '0'))
+
+# この大きさ (文字数) 以上の未解析の台本は、ビューアでは全体の解析を待たずに
+# チャンクごとに解析しながら HTML を送る
+SCRIPT_STREAM_MIN_SIZE = int(
+    os.environ.get('SCRIPT_STREAM_MIN_SIZE', str(64 * 1024)))
+
+# この大きさ (文字数) までのビューアの HTML を、解析結果と一緒にキャッシュする
+SCRIPT_HTML_MEMO_MAX_SIZE = int(
+    os.environ.get('SCRIPT_HTML_MEMO_MAX_SIZE', str(1024 * 1024)))
+
 ROOT_URLCONF = 'pscweb2.urls'
 LOGIN_REDIRECT_URL = '/'
 
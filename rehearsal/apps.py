@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class RehearsalConfig(AppConfig):
     name = 'rehearsal'
+    
+    def ready(self):
+        # 稽古可能性の無効化などの signal handler を登録する
+        from . import signals
@@ -0,0 +1,351 @@
+import datetime
+import json
+from collections import defaultdict
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .models import Rehearsal, Actor, Attendance, AtndChangeLog
+from .cache_func import schedule_data_version_bump
+from .psblty_func import schedule_possibility_update
+from .signals import suppress_data_signals
+
+
+def atnd_cell_strings(rows):
+    '''1人の役者の1コマの参加時間を、出欠表の表示用の文字列のリストにする
+    
+    Parameters
+    ----------
+    rows : list of tuple
+        (from_time, to_time, is_allday, is_absent) のリスト
+    
+    Returns
+    -------
+    ['*'] (全日), ['-'] (欠席), ['HH:MM-HH:MM', ...] (時間帯、開始時刻の順)
+    '''
+    rows = sorted(rows, key=lambda row: row[0] or datetime.time.min)
+    return [
+        # 全日の場合
+        '*' if is_allday
+        # 欠席の場合
+        else '-' if is_absent
+        # さもなくば時間帯
+        else from_time.strftime('%H:%M') + '-' + to_time.strftime('%H:%M')
+        for from_time, to_time, is_allday, is_absent in rows
+    ]
+
+
+def parse_atnd_cell(values):
+    '''出欠表の表示用の文字列のリストを、参加時間のリストにする
+    
+    AtndForm と同じ規則で検査する
+    
+    Returns
+    -------
+    [(from_time, to_time, is_allday, is_absent)] (開始時刻の順)
+    
+    Raises
+    ------
+    ValidationError
+    '''
+    if not isinstance(values, list):
+        raise ValidationError('参加時間はリストで指定してください。')
+    values = [str(value).strip() for value in values]
+    values = [value for value in values if value]
+    
+    # 全日・欠席は単独でのみ指定できる
+    if '*' in values or '-' in values:
+        if len(values) > 1:
+            raise ValidationError(
+                '「全日」「欠席」は他の参加時間と一緒に指定できません。')
+        if values[0] == '*':
+            return [(None, None, True, False)]
+        return [(None, None, False, True)]
+    
+    rows = []
+    for value in values:
+        try:
+            from_str, to_str = value.split('-')
+            from_time = datetime.datetime.strptime(
+                from_str.strip(), '%H:%M').time()
+            to_time = datetime.datetime.strptime(
+                to_str.strip(), '%H:%M').time()
+        except ValueError:
+            raise ValidationError('参加時間の形式が不正です: {}'.format(value))
+        # To が From より遅いこと
+        if to_time <= from_time:
+            raise ValidationError('To は From より遅くしてください: {}'
+                .format(value))
+        rows.append((from_time, to_time, False, False))
+    
+    # 参加時間どうしが重複しないこと (AtndForm と同じく、接していても重複とする)
+    rows.sort()
+    for prev, row in zip(rows[:-1], rows[1:]):
+        if row[0] <= prev[1]:
+            raise ValidationError('重複する参加時間は指定できません。')
+    
+    return rows
+
+
+def save_attendance_grid(prod_user, cells):
+    '''役者×稽古の参加時間をまとめて置き換える
+    
+    指定したセルの参加時間を、既存のものと比べて必要な分だけ
+    bulk_create / bulk_update / 削除し、変更履歴もまとめて保存する
+    全て1つのトランザクションで行い、1つでもエラーがあれば何も保存しない
+    
+    Parameters
+    ----------
+    prod_user : ProdUser
+        変更するユーザ
+        所有権も編集権もなければ、自分の役者の参加時間だけを変更できる
+    cells : list of dict
+        [{'actor': 役者の id, 'rehearsal': 稽古の id,
+            'atnds': 出欠表の表示用の文字列のリスト}]
+        atnds が空なら、そのセルの参加時間を全て削除する
+    
+    Returns
+    -------
+    {'created': 追加数, 'updated': 更新数, 'deleted': 削除数}
+    
+    Raises
+    ------
+    ValidationError
+        セルごとのエラーメッセージのリスト
+    PermissionError
+        変更できない役者が含まれている
+    '''
+    prod_id = prod_user.production_id
+    actors = {actor.id: actor
+        for actor in Actor.objects.filter(production__pk=prod_id)}
+    rehearsals = {rhsl.id: rhsl
+        for rhsl in Rehearsal.objects.filter(production__pk=prod_id)}
+    can_edit_all = prod_user.is_owner or prod_user.is_editor
+    
+    # セルごとに検査し、(役者 id, 稽古 id) -> 参加時間のリストにする
+    errors = []
+    new_cells = {}
+    for cell in cells:
+        try:
+            actor = actors.get(int(cell['actor']))
+            rehearsal = rehearsals.get(int(cell['rehearsal']))
+        except (KeyError, TypeError, ValueError):
+            actor = rehearsal = None
+        if actor is None or rehearsal is None:
+            errors.append('役者または稽古の指定が不正です。')
+            continue
+        if not can_edit_all and actor.prod_user_id != prod_user.id:
+            raise PermissionError
+        try:
+            new_cells[(actor.id, rehearsal.id)] =\
+                parse_atnd_cell(cell.get('atnds', []))
+        except ValidationError as e:
+            errors.extend('{},{}: {}'.format(
+                rehearsal.date.strftime('%m/%d'), actor.get_short_name(),
+                message) for message in e.messages)
+    if errors:
+        raise ValidationError(errors)
+    
+    # 対象のセルの既存の参加時間を一度に読み込む
+    old_atnds = defaultdict(list)
+    atnds = Attendance.objects.filter(
+        actor__pk__in={key[0] for key in new_cells},
+        rehearsal__pk__in={key[1] for key in new_cells}).order_by('id')
+    for atnd in atnds:
+        key = (atnd.actor_id, atnd.rehearsal_id)
+        if key in new_cells:
+            # str() で変更履歴を作る時にクエリが発生しないようにする
+            atnd.actor = actors[atnd.actor_id]
+            atnd.rehearsal = rehearsals[atnd.rehearsal_id]
+            old_atnds[key].append(atnd)
+    
+    # セルごとに、変わらないものは残し、残りは更新・追加・削除する
+    to_create = []
+    to_update = []
+    to_delete = []
+    logs = []
+    for (actor_id, rhsl_id), rows in new_cells.items():
+        olds = old_atnds[(actor_id, rhsl_id)]
+        kept = {(atnd.from_time, atnd.to_time, atnd.is_allday, atnd.is_absent)
+            for atnd in olds} & set(rows)
+        olds = [atnd for atnd in olds if (atnd.from_time, atnd.to_time,
+            atnd.is_allday, atnd.is_absent) not in kept]
+        rows = [row for row in rows if row not in kept]
+        
+        for atnd, row in zip(olds, rows):
+            old_value = str(atnd)
+            atnd.from_time, atnd.to_time, atnd.is_allday, atnd.is_absent =\
+                row
+            to_update.append(atnd)
+            logs.append((old_value, str(atnd)))
+        for row in rows[len(olds):]:
+            atnd = Attendance(actor=actors[actor_id],
+                rehearsal=rehearsals[rhsl_id], from_time=row[0],
+                to_time=row[1], is_allday=row[2], is_absent=row[3])
+            to_create.append(atnd)
+            logs.append(('', str(atnd)))
+        for atnd in olds[len(rows):]:
+            to_delete.append(atnd)
+            logs.append((str(atnd), ''))
+    
+    if logs:
+        # 削除で行ごとに signals が動かないようにする
+        with transaction.atomic(), suppress_data_signals():
+            Attendance.objects.bulk_update(to_update,
+                ['from_time', 'to_time', 'is_allday', 'is_absent'])
+            Attendance.objects.bulk_create(to_create)
+            Attendance.objects.filter(
+                pk__in=[atnd.id for atnd in to_delete]).delete()
+            AtndChangeLog.objects.bulk_create([
+                AtndChangeLog(production_id=prod_id, old_value=old_value,
+                    new_value=new_value, changed_by=prod_user.user,
+                    changed_by_id=prod_user.id)
+                for old_value, new_value in logs])
+            
+            # signals の代わりに、公演のデータの版と稽古可能性の更新を
+            # ここで1回だけ予約する
+            # (版はコミット時に、稽古可能性を更新してから進める)
+            schedule_data_version_bump(pk=prod_id)
+            for rhsl_id in {atnd.rehearsal_id
+                    for atnd in to_create + to_update + to_delete}:
+                schedule_possibility_update(rehearsal_id=rhsl_id)
+    
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'deleted': len(to_delete),
+    }
+
+
+def atnd_log_retention_days(production):
+    '''公演の出欠の変更履歴を残す日数 (0 なら削除しない)
+    '''
+    if production.atnd_log_retention_days is None:
+        return settings.ATND_LOG_RETENTION_DAYS
+    return production.atnd_log_retention_days
+
+
+def atnd_log_dict(log):
+    '''変更履歴を、書き出し用の dict にする
+    '''
+    return {
+        'id': log.id,
+        'production': log.production_id,
+        'create_dt': log.create_dt.isoformat(),
+        'old_value': log.old_value,
+        'new_value': log.new_value,
+        'changed_by': log.changed_by,
+        'changed_by_id': log.changed_by_id,
+    }
+
+
+def expire_atnd_logs(prod_id, before, archive=None, batch_size=1000,
+        dry_run=False):
+    '''指定した日時より古い変更履歴を、古い順に batch_size 件ずつ削除する
+    
+    Parameters
+    ----------
+    archive : file object
+        指定すれば、削除する前に JSON Lines で書き出す (テキストモード)
+    dry_run : bool
+        True なら削除せずに件数だけ返す
+    
+    Returns
+    -------
+    削除した (dry_run なら削除する) 件数
+    '''
+    logs = AtndChangeLog.objects.filter(production__pk=prod_id,
+        create_dt__lt=before)
+    if dry_run:
+        return logs.count()
+    
+    deleted = 0
+    while True:
+        batch = list(logs.order_by('create_dt', 'id')[:batch_size])
+        if not batch:
+            break
+        if archive is not None:
+            for log in batch:
+                archive.write(json.dumps(atnd_log_dict(log),
+                    ensure_ascii=False) + '\n')
+            # 書き出してから削除する
+            archive.flush()
+        AtndChangeLog.objects.filter(
+            pk__in=[log.id for log in batch]).delete()
+        deleted += len(batch)
+    return deleted
+
+
+def atnd_log_chains(prod_id, before, window, batch_size=1000):
+    '''同じ参加時間への一連の変更 (2件以上) を得る
+    
+    変更前が、同じ変更者の window 以内の変更の変更後と同じなら、
+    その続きの変更とみなす (変更履歴の文字列は日付・役者・時間を含む)
+    
+    Returns
+    -------
+    [(id のリスト (古い順), 最初の変更前, 最後の変更後)]
+    '''
+    rows = AtndChangeLog.objects.filter(production__pk=prod_id,
+        create_dt__lt=before).order_by('create_dt', 'id').values_list(
+            'id', 'create_dt', 'old_value', 'new_value', 'changed_by_id')
+    
+    chains = []
+    # (変更者 id, 変更後) -> 続きの変更を待っている一連の変更
+    tips = {}
+    for log_id, create_dt, old_value, new_value, changed_by_id\
+            in rows.iterator(chunk_size=batch_size):
+        chain = tips.pop((changed_by_id, old_value), None)\
+            if old_value else None
+        if chain is None or create_dt - chain['last_dt'] > window:
+            chain = {'ids': [], 'old_value': old_value}
+            chains.append(chain)
+        chain['ids'].append(log_id)
+        chain['last_dt'] = create_dt
+        chain['new_value'] = new_value
+        # 削除された参加時間には、続きの変更はない
+        if new_value:
+            tips[(changed_by_id, new_value)] = chain
+    
+    return [(chain['ids'], chain['old_value'], chain['new_value'])
+        for chain in chains if len(chain['ids']) > 1]
+
+
+def collapse_atnd_logs(prod_id, before, window, batch_size=1000,
+        dry_run=False):
+    '''同じ参加時間への一連の変更を、正味の1件の変更にまとめる
+    
+    一連の変更の最後の1件に最初の変更前を付けて残し、他は削除する
+    変更前と変更後が同じになる (正味の変更がない) なら全て削除する
+    一連の変更ごとに途中で止まらないよう、およそ batch_size 件ずつ
+    1つのトランザクションで保存する
+    
+    Returns
+    -------
+    (残した件数, 削除した件数) (dry_run なら、残す・削除する件数)
+    '''
+    chains = atnd_log_chains(prod_id, before, window, batch_size)
+    
+    kept = deleted = 0
+    to_update = []
+    to_delete = []
+    for idx, (ids, old_value, new_value) in enumerate(chains):
+        if old_value == new_value:
+            to_delete.extend(ids)
+        else:
+            to_delete.extend(ids[:-1])
+            to_update.append(AtndChangeLog(id=ids[-1], old_value=old_value))
+        
+        # 溜まったか、最後なら保存する
+        if len(to_update) + len(to_delete) < batch_size\
+                and idx < len(chains) - 1:
+            continue
+        if not dry_run:
+            with transaction.atomic():
+                AtndChangeLog.objects.bulk_update(to_update, ['old_value'])
+                AtndChangeLog.objects.filter(pk__in=to_delete).delete()
+        kept += len(to_update)
+        deleted += len(to_delete)
+        to_update = []
+        to_delete = []
+    
+    return kept, deleted
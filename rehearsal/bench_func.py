@@ -0,0 +1,139 @@
+import datetime
+import statistics
+import time
+import uuid
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import User
+from .models import Rehearsal, Scene, Actor, Character, Attendance, Appearance
+from .synth_func import create_synthetic_production
+from . import views
+
+
+# 計測する公演の規模 (create_synthetic_production の引数)
+BENCH_SIZES = {
+    'small': {'actors': 10, 'roles': 15, 'scenes': 15, 'rehearsals': 10},
+    'medium': {'actors': 25, 'roles': 40, 'scenes': 40, 'rehearsals': 40},
+    'large': {'actors': 50, 'roles': 80, 'scenes': 60, 'rehearsals': 90},
+}
+
+
+def bench_targets(prod):
+    '''計測するビューの (名前, ビュー, URL 名, URL の引数) のリスト
+    '''
+    rhsl = Rehearsal.objects.filter(production=prod).first()
+    actor = Actor.objects.filter(production=prod).first()
+    return [
+        ('RhslPossibility', views.RhslPossibility, 'rehearsal:rhsl_psblty',
+            {'prod_id': prod.id}),
+        ('RhslPossibilityData', views.RhslPossibilityData,
+            'rehearsal:rhsl_psblty_data', {'prod_id': prod.id}),
+        ('AtndGraph', views.AtndGraph, 'rehearsal:atnd_graph',
+            {'rhsl_id': rhsl.id}),
+        ('AtndTable', views.AtndTable, 'rehearsal:atnd_table',
+            {'prod_id': prod.id}),
+        ('ApprTable', views.ApprTable, 'rehearsal:appr_table',
+            {'prod_id': prod.id}),
+        ('RhslAbsence', views.RhslAbsence, 'rehearsal:rhsl_absence',
+            {'pk': rhsl.id}),
+        ('ActrDetail', views.ActrDetail, 'rehearsal:actr_detail',
+            {'pk': actor.id}),
+    ]
+
+
+def time_view(view, path, user, kwargs):
+    '''ビューを1回呼び出し、(経過時間 (ms), クエリ数) を返す
+    
+    ミドルウェアを通さず、テンプレートのレンダリングまでを計測する
+    '''
+    request = RequestFactory().get(path)
+    request.user = user
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = view.as_view()(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError('{} returned {}'.format(path, response.status_code))
+    return elapsed * 1000, len(queries)
+
+
+def run_benchmarks(sizes=None, repeat=3, seed=0):
+    '''合成した公演で分析系のビューを計測し、レポートを返す
+    
+    公演は計測後にロールバックするので、データベースには何も残らない
+    
+    Parameters
+    ----------
+    sizes : {名前: create_synthetic_production の引数}
+        省略時は BENCH_SIZES
+    repeat : int
+        ビューごとの呼び出し回数
+        1回目 (cold) は稽古可能性の計算・保存などを含む
+    
+    Returns
+    -------
+    {
+        created: 日時,
+        repeat: repeat,
+        sizes: [{
+            name: 名前,
+            params: 引数,
+            counts: {モデル名: レコード数},
+            views: {ビュー名: {
+                cold_ms, cold_queries, warm_ms, warm_min_ms, warm_queries
+            }}
+        }]
+    }
+    '''
+    if sizes is None:
+        sizes = BENCH_SIZES
+    repeat = max(repeat, 2)
+    
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'repeat': repeat,
+        'sizes': [],
+    }
+    with transaction.atomic():
+        user = User.objects.create_user('bench-' + uuid.uuid4().hex[:12])
+        for name, params in sizes.items():
+            prod = create_synthetic_production(owner=user,
+                name='bench-' + name, seed=seed, **params)
+            size_report = {
+                'name': name,
+                'params': params,
+                'counts': {
+                    'actors': Actor.objects.filter(production=prod).count(),
+                    'characters':
+                        Character.objects.filter(production=prod).count(),
+                    'scenes': Scene.objects.filter(production=prod).count(),
+                    'appearances': Appearance.objects.filter(
+                        scene__production=prod).count(),
+                    'rehearsals':
+                        Rehearsal.objects.filter(production=prod).count(),
+                    'attendances': Attendance.objects.filter(
+                        rehearsal__production=prod).count(),
+                },
+                'views': {},
+            }
+            for view_name, view, url_name, kwargs in bench_targets(prod):
+                path = reverse(url_name, kwargs=kwargs)
+                runs = [time_view(view, path, user, kwargs)
+                    for i in range(repeat)]
+                warm = runs[1:]
+                size_report['views'][view_name] = {
+                    'cold_ms': round(runs[0][0], 2),
+                    'cold_queries': runs[0][1],
+                    'warm_ms': round(statistics.median(
+                        [run[0] for run in warm]), 2),
+                    'warm_min_ms': round(min(run[0] for run in warm), 2),
+                    'warm_queries': max(run[1] for run in warm),
+                }
+            report['sizes'].append(size_report)
+        transaction.set_rollback(True)
+    
+    return report
@@ -0,0 +1,172 @@
+import calendar
+import hashlib
+import threading
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from production.models import Production
+from .psblty_func import flush_possibility_updates
+
+
+def data_version(prod_id):
+    '''公演のデータの版を得る (公演がなければ None)
+    '''
+    return Production.objects.filter(pk=prod_id)\
+        .values_list('data_version', flat=True).first()
+
+
+def bump_data_version(*args, **filters):
+    '''条件に合う公演のデータの版を1つ進める
+
+    ex. bump_data_version(pk=prod_id), bump_data_version(rehearsal__pk=rhsl_id)
+    '''
+    Production.objects.filter(*args, **filters)\
+        .update(data_version=F('data_version') + 1,
+            data_modified=timezone.now())
+
+
+# ----------------------------------------------------------------
+# 元データの変更に合わせた版の更新
+# signals から予約され、トランザクションのコミット時にまとめて1回だけ進める
+
+_pending = threading.local()
+
+
+def schedule_data_version_bump(**filters):
+    '''条件に合う公演のデータの版を進めることを予約する
+    
+    同じトランザクションで何件変わっても、コミット時に1回の UPDATE で進める
+    
+    ex. schedule_data_version_bump(rehearsal__pk=rhsl_id)
+    '''
+    pending = getattr(_pending, 'bumps', None)
+    if pending is None:
+        pending = {}
+        _pending.bumps = pending
+    for name, value in filters.items():
+        pending.setdefault(name, set()).add(value)
+    
+    # 最初に実行されたコールバックが予約をまとめて処理し、残りは何もしない
+    transaction.on_commit(flush_data_version_bumps)
+
+
+def flush_data_version_bumps():
+    '''予約された版の更新を実行する
+    
+    稽古可能性の差分更新を先に済ませてから版を進めるので、
+    新しい版で古い稽古可能性がキャッシュされることはない
+    '''
+    pending = getattr(_pending, 'bumps', None)
+    _pending.bumps = None
+    if not pending:
+        return
+    
+    flush_possibility_updates()
+    
+    condition = Q()
+    for name, values in pending.items():
+        condition |= Q(**{name + '__in': values})
+    bump_data_version(condition)
+
+
+# 分析系のビューのデータをキャッシュする settings.CACHES のエイリアス
+PAYLOAD_CACHE_ALIAS = 'payloads'
+
+
+def payload_cache():
+    '''分析系のビューのデータのキャッシュ
+    
+    settings.CACHES に PAYLOAD_CACHE_ALIAS がなければ 'default' を使う
+    '''
+    if PAYLOAD_CACHE_ALIAS in settings.CACHES:
+        return caches[PAYLOAD_CACHE_ALIAS]
+    return caches[DEFAULT_CACHE_ALIAS]
+
+
+def payload_key(name, prod_id, version):
+    '''公演のデータの版ごとのキャッシュのキー
+    
+    name が長ければハッシュにして、バックエンドのキーの長さの制限に収める
+    '''
+    if len(name) > 64:
+        name = hashlib.md5(name.encode()).hexdigest()
+    return 'payload:{}:{}:{}'.format(name, prod_id, version)
+
+
+def versioned_payload(name, prod_id, build):
+    '''公演のデータの版ごとにキャッシュした値を返す
+    
+    キャッシュになければ build() で作ってキャッシュする
+    キーに版を含めるので、データが変われば古い値は使われない
+    (版を読んでからデータを読むので、古いデータを新しい版で保存することはない)
+    
+    Parameters
+    ----------
+    name : str
+        値の種類 (ビューの名前など)
+        同じ公演で値が GET パラメタなどによって変わるなら、それも含める
+    build : callable
+        値を作る関数 (キャッシュに入れるので pickle できる値を返すこと)
+    '''
+    version = data_version(prod_id)
+    if version is None:
+        return build()
+    cache = payload_cache()
+    payload = cache.get(payload_key(name, prod_id, version))
+    if payload is None:
+        payload = build()
+        cache.set(payload_key(name, prod_id, version), payload)
+        # 1つ前の版の値はもう使われないので、空きを作っておく
+        if version > 0:
+            cache.delete(payload_key(name, prod_id, version - 1))
+    return payload
+
+
+def conditional_get(view, prod_id, get, /, *args, **kwargs):
+    '''公演のデータの版による条件付き GET を処理する
+    
+    ETag (If-None-Match) か Last-Modified (If-Modified-Since) で
+    ブラウザの持っている内容が最新と分かれば、get を呼ばずに 304 を返す
+    さもなくば get(view.request, *args, **kwargs) の応答に
+    ETag と Last-Modified をつけて返す
+    
+    アクセス権の検査は呼び出す前に済ませておくこと
+    
+    Parameters
+    ----------
+    view : View
+        ETag にはビューのクラス名、ユーザ、URL (GET パラメタを含む)、
+        今日の日付も含める
+    get : callable
+        応答を作るハンドラ (super().get など)
+    '''
+    request = view.request
+    state = Production.objects.filter(pk=prod_id)\
+        .values_list('data_version', 'data_modified').first()
+    if state is None:
+        return get(request, *args, **kwargs)
+    version, modified = state
+    
+    # 今日以降の稽古を表示するビューもあるので、日付も含める
+    key = '{}:{}:{}:{}:{}:{}'.format(type(view).__name__, prod_id, version,
+        request.user.pk, request.get_full_path(), timezone.localdate())
+    etag = '"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+    last_modified = calendar.timegm(modified.utctimetuple())\
+        if modified else None
+    
+    response = get_conditional_response(request, etag=etag,
+        last_modified=last_modified)
+    if response is None:
+        response = get(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # 毎回問い合わせさせ、古い内容を使わないようにする
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,92 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    '''並び順のキーの値のリストを、URL に使えるカーソルの文字列にする
+    '''
+    # 日時は DjangoJSONEncoder だとミリ秒に丸められるので、そのまま書く
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values]
+    data = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    '''カーソルの文字列を、並び順のキーの値のリストに戻す
+    
+    Parameters
+    ----------
+    fields : list of Field
+        並び順のキーのフィールド (値の型を戻すのに使う)
+    
+    Raises
+    ------
+    ValueError
+        カーソルが不正
+    '''
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError('invalid cursor')
+    try:
+        return [field.to_python(value)
+            for field, value in zip(fields, values)]
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def keyset_page(queryset, ordering, cursor=None, size=100):
+    '''カーソルの次から size 件を、OFFSET を使わずに得る
+    
+    Parameters
+    ----------
+    queryset : QuerySet
+    ordering : list of str
+        並び順のキー (降順は '-' を付ける)
+        最後のキーで一意に決まること (ex. ['sortkey', 'id'])
+    cursor : str
+        前のページの next_cursor (None なら最初のページ)
+    size : int
+        1ページの件数
+    
+    Returns
+    -------
+    (オブジェクトのリスト, 次のページのカーソル (なければ None))
+    
+    Raises
+    ------
+    ValueError
+        カーソルが不正
+    '''
+    names = [key.lstrip('-') for key in ordering]
+    fields = [queryset.model._meta.get_field(name) for name in names]
+    
+    if cursor:
+        values = decode_cursor(cursor, fields)
+        # (k1, k2, ...) > (v1, v2, ...) を、先頭から等しい部分と
+        # 次のキーの大小の組み合わせで表す
+        conditions = []
+        for idx, key in enumerate(ordering):
+            lookup = '__lt' if key.startswith('-') else '__gt'
+            condition = {name: value for name, value
+                in zip(names[:idx], values[:idx])}
+            condition[names[idx] + lookup] = values[idx]
+            conditions.append(Q(**condition))
+        queryset = queryset.filter(reduce(or_, conditions))
+    
+    # 1件多く読んで、次のページがあるかを調べる
+    objects = list(queryset.order_by(*ordering)[:size + 1])
+    next_cursor = None
+    if len(objects) > size:
+        objects = objects[:size]
+        last = objects[-1]
+        next_cursor = encode_cursor([getattr(last, field.attname)
+            for field in fields])
+    return objects, next_cursor
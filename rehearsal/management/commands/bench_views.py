@@ -0,0 +1,43 @@
+import json
+from django.core.management.base import BaseCommand
+from rehearsal.bench_func import BENCH_SIZES, run_benchmarks
+
+
+class Command(BaseCommand):
+    '''合成した公演で分析系のビューの処理時間とクエリ数を計測する
+    
+    公演は計測後にロールバックするので、データベースには何も残らない
+    
+    ex. python manage.py bench_views --sizes small large --output bench.json
+    '''
+    help = '分析系のビューの処理時間とクエリ数を計測します。'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=list(BENCH_SIZES),
+            default=list(BENCH_SIZES), help='計測する公演の規模')
+        parser.add_argument('--repeat', type=int, default=3,
+            help='ビューごとの呼び出し回数 (2以上)')
+        parser.add_argument('--seed', type=int, default=0,
+            help='乱数の種')
+        parser.add_argument('--output', help='JSON のレポートの出力先')
+    
+    def handle(self, *args, **options):
+        sizes = {name: BENCH_SIZES[name] for name in options['sizes']}
+        report = run_benchmarks(sizes=sizes, repeat=options['repeat'],
+            seed=options['seed'])
+        
+        for size_report in report['sizes']:
+            self.stdout.write('[{}] {}'.format(size_report['name'],
+                ', '.join('{}: {}'.format(model, count)
+                    for model, count in size_report['counts'].items())))
+            for view_name, result in size_report['views'].items():
+                self.stdout.write(
+                    '  {:<20} cold {:>9.2f} ms {:>4} queries,'
+                    ' warm {:>9.2f} ms {:>4} queries'.format(view_name,
+                        result['cold_ms'], result['cold_queries'],
+                        result['warm_ms'], result['warm_queries']))
+        
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write('{} に書き出しました。'.format(options['output']))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import User
+from rehearsal.synth_func import create_synthetic_production
+
+
+class Command(BaseCommand):
+    '''計測用の公演を、指定した規模で乱数から作る
+    
+    ex. python manage.py make_synth_prod --owner admin --actors 40 --scenes 60
+    '''
+    help = '計測用の公演を、指定した規模で乱数から作ります。'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', help='所有者にするユーザ名')
+        parser.add_argument('--name', default='合成公演', help='公演名')
+        parser.add_argument('--actors', type=int, default=20,
+            help='役者の数')
+        parser.add_argument('--roles', type=int, default=30,
+            help='役の数')
+        parser.add_argument('--double-cast', type=float, default=0.2,
+            help='ダブルキャストにする役の割合')
+        parser.add_argument('--scenes', type=int, default=40,
+            help='シーンの数 (ダブルキャストで分かれる前)')
+        parser.add_argument('--appearances', type=int, default=5,
+            help='1シーンあたりの出番の数の上限')
+        parser.add_argument('--rehearsals', type=int, default=30,
+            help='稽古のコマの数')
+        parser.add_argument('--density', type=float, default=0.8,
+            help='出欠が登録されている割合')
+        parser.add_argument('--seed', type=int, default=0,
+            help='乱数の種')
+    
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            owner = User.objects.filter(username=options['owner']).first()
+            if not owner:
+                raise CommandError(
+                    'ユーザ {} がありません。'.format(options['owner']))
+        
+        prod = create_synthetic_production(owner=owner,
+            name=options['name'], actors=options['actors'],
+            roles=options['roles'], double_cast=options['double_cast'],
+            scenes=options['scenes'], appearances=options['appearances'],
+            rehearsals=options['rehearsals'], density=options['density'],
+            seed=options['seed'])
+        self.stdout.write('公演 {} (id: {}) を作りました。'.format(
+            prod, prod.id))
@@ -0,0 +1,53 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from production.models import Production
+from rehearsal.plan_func import plan_for_production
+
+
+class Command(BaseCommand):
+    '''今日以降の稽古について、稽古プランを提案する
+    
+    ex. python manage.py propose_plan 1 --unit-minutes 2 --time-limit 5
+    '''
+    help = '今日以降の稽古について、稽古するシーンを提案します。'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('prod_id', type=int, help='対象の公演の id')
+        parser.add_argument('--unit-minutes', type=float, default=1,
+            help='シーンの長さ 1 あたりの稽古時間 (分)')
+        parser.add_argument('--step', type=int, default=5,
+            help='時間枠の刻み (分)')
+        parser.add_argument('--time-limit', type=float, default=2.0,
+            help='改善に使う時間の上限 (秒)')
+        parser.add_argument('--json', action='store_true',
+            help='JSON で出力する')
+    
+    def handle(self, *args, **options):
+        prod_id = options['prod_id']
+        production = Production.objects.filter(pk=prod_id).first()
+        if not production:
+            raise CommandError('公演 {} がありません。'.format(prod_id))
+        
+        rhsl_plans = plan_for_production(prod_id,
+            unit_minutes=options['unit_minutes'], step=options['step'],
+            time_limit=options['time_limit'])
+        
+        if options['json']:
+            self.stdout.write(json.dumps([{
+                'rehearsal_id': rhsl_plan['rehearsal'].id,
+                'slots': [{
+                    'scene_id': slot['scene'].id,
+                    'from_time': slot['from_time'].strftime('%H:%M'),
+                    'to_time': slot['to_time'].strftime('%H:%M'),
+                    'coverage': round(slot['coverage'], 3),
+                } for slot in rhsl_plan['slots']]
+            } for rhsl_plan in rhsl_plans], ensure_ascii=False, indent=2))
+            return
+        
+        for rhsl_plan in rhsl_plans:
+            self.stdout.write(str(rhsl_plan['rehearsal']))
+            for slot in rhsl_plan['slots']:
+                self.stdout.write('  {}-{} {} ({:.2f})'.format(
+                    slot['from_time'].strftime('%H:%M'),
+                    slot['to_time'].strftime('%H:%M'),
+                    slot['scene'], slot['coverage']))
@@ -0,0 +1,85 @@
+import datetime
+import gzip
+import os
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from production.models import Production
+from rehearsal.atnd_func import atnd_log_retention_days, expire_atnd_logs,\
+    collapse_atnd_logs
+
+
+class Command(BaseCommand):
+    '''出欠の変更履歴を、公演ごとの保存日数に従って整理する
+    
+    1. 保存日数より古い履歴を削除する (--archive-dir があれば書き出してから)
+    2. 残りのうち --settle-hours より古い履歴で、同じ参加時間への一連の
+       変更を正味の1件にまとめる
+    
+    ex. python manage.py prune_atnd_logs --archive-dir /var/backups 1 2
+    '''
+    help = '出欠の変更履歴の古いものを削除し、一連の変更をまとめます。'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('prod_ids', nargs='*', type=int,
+            help='対象の公演の id (省略時は全公演)')
+        parser.add_argument('--archive-dir',
+            help='削除する履歴を書き出すディレクトリ (JSON Lines, gzip)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='一度に削除・更新する件数')
+        parser.add_argument('--collapse-window', type=int, default=30,
+            help='一連の変更とみなす間隔 (分、0 ならまとめない)')
+        parser.add_argument('--settle-hours', type=int, default=24,
+            help='これより新しい履歴はまとめない (時間)')
+        parser.add_argument('--dry-run', action='store_true',
+            help='変更せずに件数だけ表示する')
+    
+    def handle(self, *args, **options):
+        productions = Production.objects.all()
+        if options['prod_ids']:
+            productions = productions.filter(pk__in=options['prod_ids'])
+        
+        now = timezone.now()
+        batch_size = max(options['batch_size'], 1)
+        dry_run = options['dry_run']
+        
+        for production in productions:
+            # 保存日数より古い履歴を削除する
+            expired = 0
+            days = atnd_log_retention_days(production)
+            if days > 0:
+                before = now - datetime.timedelta(days=days)
+                expired = self.expire(production, before, options)
+            
+            # 一連の変更をまとめる
+            kept = collapsed = 0
+            if options['collapse_window'] > 0:
+                kept, collapsed = collapse_atnd_logs(production.id,
+                    now - datetime.timedelta(hours=options['settle_hours']),
+                    datetime.timedelta(minutes=options['collapse_window']),
+                    batch_size=batch_size, dry_run=dry_run)
+            
+            self.stdout.write('{}: {} 件の古い履歴を削除、{} 件の一連の変更を'
+                '{} 件にまとめました。{}'.format(production, expired,
+                    kept + collapsed, kept, ' (dry run)' if dry_run else ''))
+    
+    def expire(self, production, before, options):
+        '''保存日数より古い履歴を、必要なら書き出してから削除する
+        '''
+        batch_size = max(options['batch_size'], 1)
+        if options['dry_run'] or not options['archive_dir']:
+            return expire_atnd_logs(production.id, before,
+                batch_size=batch_size, dry_run=options['dry_run'])
+        
+        # 書き出す履歴がなければ、ファイルを作らない
+        if expire_atnd_logs(production.id, before, dry_run=True) == 0:
+            return 0
+        
+        os.makedirs(options['archive_dir'], exist_ok=True)
+        path = os.path.join(options['archive_dir'],
+            'atndchangelog-{}-{}.jsonl.gz'.format(production.id,
+                timezone.now().strftime('%Y%m%d%H%M%S')))
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            expired = expire_atnd_logs(production.id, before,
+                archive=archive, batch_size=batch_size)
+        self.stdout.write('{} に書き出しました。'.format(path))
+        return expired
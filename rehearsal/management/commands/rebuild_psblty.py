@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from production.models import Production
+from rehearsal.cache_func import bump_data_version
+from rehearsal.psblty_func import update_possibility
+
+
+class Command(BaseCommand):
+    '''保存済みの稽古可能性を全て計算し直す (修復用)
+    
+    ex. python manage.py rebuild_psblty 1 2
+    '''
+    help = '保存済みの稽古可能性を全て計算し直します。'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('prod_ids', nargs='*', type=int,
+            help='対象の公演の id (省略時は全公演)')
+    
+    def handle(self, *args, **options):
+        productions = Production.objects.all()
+        if options['prod_ids']:
+            productions = productions.filter(pk__in=options['prod_ids'])
+        
+        for production in productions:
+            update_possibility(production.id)
+            # 壊れた稽古可能性から作ったキャッシュや ETag を使わないよう、
+            # 計算し直してから版を進める
+            bump_data_version(pk=production.id)
+            self.stdout.write('{} の稽古可能性を計算し直しました。'.format(
+                production))
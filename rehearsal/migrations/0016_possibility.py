@@ -0,0 +1,31 @@
+# Generated by Django 5.0.14 on 2026-10-17 09:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0006_auto_20200607_0201'),
+        ('rehearsal', '0015_auto_20200607_0201'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Possibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.IntegerField(choices=[(1, '登場人物'), (2, '役者'), (3, 'セリフ数')], verbose_name='指標')),
+                ('value', models.FloatField(verbose_name='稽古可能性')),
+                ('production', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='production.production', verbose_name='公演')),
+                ('rehearsal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rehearsal.rehearsal', verbose_name='稽古のコマ')),
+                ('scene', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rehearsal.scene', verbose_name='シーン')),
+            ],
+            options={
+                'verbose_name': '稽古可能性',
+                'verbose_name_plural': '稽古可能性',
+                'constraints': [models.UniqueConstraint(fields=('rehearsal', 'scene', 'metric'), name='unique_possibility')],
+            },
+        ),
+    ]
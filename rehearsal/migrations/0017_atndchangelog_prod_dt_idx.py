@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rehearsal', '0016_possibility'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='atndchangelog',
+            index=models.Index(fields=['production', 'create_dt'], name='atndchangelog_prod_dt_idx'),
+        ),
+    ]
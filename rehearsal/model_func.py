@@ -1,131 +1,139 @@
+from collections import defaultdict
 from .models import *
+from .presence_func import rehearsal_presences
+
+
+def index_by_id(objs):
+    '''モデルのインスタンスのリストから、id -> リスト内のインデックスの辞書を作る
+    
+    list.index() の代わりに、配役などのインデックスを定数時間で引くのに使う
+    '''
+    return {obj.id: idx for idx, obj in enumerate(objs)}
+
 
 def time_slots_for_rehearsal(rehearsal, actors=None, scenes=None):
     '''稽古を指定して、全シーンの時間スロットのリストを得る
+    
+    time_slots_for_rehearsals() を1コマ分だけ呼ぶラッパー
     '''
+    rhsls_scns_slots = time_slots_for_rehearsals(
+        [rehearsal], actors=actors, scenes=scenes)
+    return rhsls_scns_slots[rehearsal.id]
+
+
+def time_slots_for_rehearsals(rehearsals, actors=None, scenes=None):
+    '''複数の稽古について、全シーンの時間スロットのリストをまとめて得る
+    
+    役者、登場人物、出番、参加時間は公演単位で一度に取得するので、
+    稽古やシーンの数によらずクエリ数は一定になる
+    時間スロットは、シーンに出ている役者の出席のビット列 (RhslPresence) が
+    変わる時刻で区切る
     
-    def actor_info_in_scene(actor, scene):
-        '''指定した役者の、あるシーンでの役とセリフ数をリストにして返す
-        
-        Returns
-        -------
-        [
+    Parameters
+    ----------
+    rehearsals : iterable of Rehearsal
+        同じ公演の稽古のコマ
+    actors : iterable of Actor
+        時間スロットの計算に使う役者 (省略時は公演の全役者)
+    scenes : iterable of Scene
+        時間スロットを作るシーン (省略時は公演の全シーン)
+    
+    Returns
+    -------
+    {
+        rehearsal.id: [
             {
-                actor: actor,
-                apearances: [{
-                    character: character,
-                    lines_num: lines_num
+                scene_id: scene.id,
+                scene: scene,
+                time_slots: [{
+                    from_time: from_time,
+                    to_time: to_time,
+                    attendee: [{
+                        actor: actor,
+                        appearances: [{
+                            character: character,
+                            lines_num: lines_num
+                        }]
+                    }]
                 }]
             }
         ]
-        '''
-        # この役者が演じている役
-        chrs = actor.character_set.all()
-        
-        # それらの役の、このシーンでの出番
-        apprs = []
-        for chr in chrs:
-            apprs.extend(list(chr.appearance_set.filter(scene=scene)))
-        
-        average_lines_num = Appearance.average_lines_num(apprs)
-        
-        return {
-            'actor': actor,
-            'appearances': [{
-                'character': appr.character,
-                'lines_num': average_lines_num if appr.lines_auto
-                                else appr.lines_num
-            } for appr in apprs]
-        }
-    
-    # ここからメインルーチン
-    prod_id = rehearsal.production.id
+    }
+    '''
+    rehearsals = list(rehearsals)
+    if not rehearsals:
+        return {}
+    prod_id = rehearsals[0].production_id
     
     if not actors:
         actors = Actor.objects.filter(production__pk=prod_id)
+    actors = list(actors)
     
     if not scenes:
         scenes = Scene.objects.filter(production__pk=prod_id)
+    scenes = list(scenes)
+    
+    # 登場人物と出番を公演単位で取得する
+    chr_by_id = {chr.id: chr for chr in
+        Character.objects.filter(production__pk=prod_id)}
+    appearances = Appearance.objects.filter(scene__production__pk=prod_id)\
+        .order_by('id')
     
-    # この稽古の、全役者の in/out 時刻のリスト
-    time_borders = []
+    # シーンごとの、役者 id -> その役者が演じる役の出番のリスト
+    scn_actr_apprs = defaultdict(lambda: defaultdict(list))
+    for appr in appearances:
+        chr = chr_by_id.get(appr.character_id)
+        if not chr or chr.cast_id is None:
+            continue
+        # appr.character を参照してもクエリが発生しないようにする
+        appr.character = chr
+        scn_actr_apprs[appr.scene_id][chr.cast_id].append(appr)
+    # 役の順番 (sortkey) に揃える
+    chr_order = index_by_id(chr_by_id.values())
+    for actr_apprs in scn_actr_apprs.values():
+        for apprs in actr_apprs.values():
+            apprs.sort(key=lambda appr: chr_order[appr.character_id])
+    
+    # (役者 id, シーン id) ごとの、役とセリフ数の情報
+    actr_infos = {}
     for actr in actors:
-        atnds = actr.attendance_set.filter(rehearsal=rehearsal)
-        for atnd in atnds:
-            # 欠席なら除外
-            if atnd.is_absent:
+        for scene in scenes:
+            apprs = scn_actr_apprs[scene.id].get(actr.id)
+            if apprs is None:
                 continue
-            # in 時刻 - 稽古の開始時刻～終了時刻に収まるよう補正する
-            from_time = rehearsal.start_time if atnd.is_allday\
-                else min(max(atnd.from_time, rehearsal.start_time),
-                    rehearsal.end_time)
-            time_borders.append({
-                'time': from_time,
-                'actor': actr,
-                'move': 'in'
-            })
-            # out 時刻 - 稽古の開始時刻～終了時刻に収まるよう補正する
-            to_time = rehearsal.end_time if atnd.is_allday\
-                else min(max(atnd.to_time, rehearsal.start_time),
-                    rehearsal.end_time)
-            time_borders.append({
-                'time': to_time,
+            average_lines_num = Appearance.average_lines_num(apprs)
+            actr_infos[(actr.id, scene.id)] = {
                 'actor': actr,
-                'move': 'out'
-             })
+                'appearances': [{
+                    'character': appr.character,
+                    'lines_num': average_lines_num if appr.lines_auto
+                                    else appr.lines_num
+                } for appr in apprs]
+            }
+    
+    # シーンごとの、出ている役者の id のリスト (actors の順)
+    actr_idx = index_by_id(actors)
+    scn_actr_ids = [
+        sorted((actr_id for actr_id in scn_actr_apprs[scene.id]
+            if actr_id in actr_idx), key=actr_idx.get)
+        for scene in scenes]
     
-    # シーンごとの時間スロット
-    scns_time_slots = []
-    for scene in scenes:
-        # このシーンの出番のリスト
-        scn_apprs = [appr for appr in scene.appearance_set.all()]
-        # このシーンの役者のリスト
-        scn_actrs = [appr.character.cast for appr in scn_apprs]
-        # 重複を削除
-        scn_actrs = list(set(scn_actrs))
-        
-        # このシーンに出ている役者の時間スロットの境界のリスト
-        scn_time_borders = [
-            border for border in time_borders
-            if border['actor'] in scn_actrs]
-        
-        # scn_time_borders から、このシーンの時間スロットを作る
-        # time でソート (in -> out の順序は保たれる)
-        scn_time_borders = sorted(scn_time_borders, key=lambda x:x['time'])
-        
-        time = rehearsal.start_time
-        slots = []
-        attendee = set()
-        for border in scn_time_borders:
-            # 次の時間ならスロット追加
-            if border['time'] > time:
-                slots.append({
-                    'from_time': time,
-                    'to_time': border['time'],
-                    'attendee': [actor_info_in_scene(actr, scene) for actr in attendee]
-                })
-                # 次のスロット開始
-                time = border['time']
-            
-            if border['move'] == 'in':
-                attendee.add(border['actor'])
-            if border['move'] == 'out':
-                attendee.discard(border['actor'])
-        
-        # 稽古の終了時刻に達していなかったらスロット追加
-        if rehearsal.end_time > time:
-            slots.append({
-                'from_time': time,
-                'to_time': rehearsal.end_time,
-                'attendee': [actor_info_in_scene(actr, scene) for actr in attendee]
-            })
-        
-        # シーンごとのデータとしてリストに追加
-        scns_time_slots.append({
+    # 全稽古の出席のビット列を一度に取得し、
+    # シーンに出ている役者の誰かが出入りする時刻でスロットに区切る
+    presences = rehearsal_presences(rehearsals)
+    rhsls_scns_slots = {}
+    for rehearsal in rehearsals:
+        presence = presences[rehearsal.id]
+        rhsls_scns_slots[rehearsal.id] = [{
             'scene_id': scene.id,
             'scene': scene,
-            # 'chrs_num': chrs_num,
-            'time_slots': slots
-        })
+            'time_slots': [{
+                'from_time': from_time,
+                'to_time': to_time,
+                'attendee': [actr_infos[(actr_id, scene.id)]
+                    for actr_id in attendee]
+            } for from_time, to_time, attendee
+                in presence.segments(scn_actr_ids[scn_idx])]
+        } for scn_idx, scene in enumerate(scenes)]
     
-    return scns_time_slots
+    return rhsls_scns_slots
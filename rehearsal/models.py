@@ -254,3 +254,41 @@ class AtndChangeLog(models.Model):
 
     class Meta:
         verbose_name = verbose_name_plural = '出欠の変更履歴'
+        # 公演ごとの新しい順のリストと、古い履歴の削除に使う
+        indexes = [
+            models.Index(fields=['production', 'create_dt'],
+                name='atndchangelog_prod_dt_idx'),
+        ]
+
+
+class Possibility(models.Model):
+    '''稽古可能性の計算結果
+    
+    稽古のコマとシーンの組ごとに、指標別の稽古可能性を保持する
+    元データが変更されると signals で影響する行・列だけが計算し直される
+    '''
+    production = models.ForeignKey(Production, verbose_name='公演',
+        on_delete=models.CASCADE)
+    rehearsal = models.ForeignKey(Rehearsal, verbose_name='稽古のコマ',
+        on_delete=models.CASCADE)
+    scene = models.ForeignKey(Scene, verbose_name='シーン',
+        on_delete=models.CASCADE)
+    METRIC_CHOICES = (
+        (1, '登場人物'),
+        (2, '役者'),
+        (3, 'セリフ数'),
+    )
+    metric = models.IntegerField('指標', choices=METRIC_CHOICES)
+    value = models.FloatField('稽古可能性')
+    
+    class Meta:
+        verbose_name = verbose_name_plural = '稽古可能性'
+        constraints = [
+            models.UniqueConstraint(fields=['rehearsal', 'scene', 'metric'],
+                name='unique_possibility'),
+        ]
+    
+    def __str__(self):
+        # ex. '08/30,○○公民館,会議室1,シーン1,役者'
+        return '{},{},{}'.format(
+            self.rehearsal, self.scene, self.get_metric_display())
@@ -0,0 +1,382 @@
+import math
+import random
+import time
+import numpy as np
+from django.utils import timezone
+from .models import Rehearsal, Scene, Actor, Character, Appearance
+from .presence_func import time_to_minutes, minutes_to_time,\
+    rehearsal_presences
+from .psblty_func import presence_arrays, scene_matrices
+
+
+# 同じシーンを2回目以降に稽古する時の価値の減衰率
+REPEAT_DECAY = 0.5
+
+# 局所探索で、プラン全体の価値がこの割合以上増える手だけを改善とみなす
+# (ごくわずかな改善を繰り返して、探索が長引かないようにする)
+IMPROVE_TOLERANCE = 1e-5
+
+
+def scene_weight(scene):
+    '''シーンの優先度と完成度から、稽古する価値の重みを決める
+    
+    優先度が高く (数字が小さく)、完成度が低いほど重い
+    完成度 100% のシーンも、空き時間を埋められるよう少しだけ重みを持つ
+    '''
+    return (6 - scene.priority) * max(1 - scene.progress / 100, 0.05)
+
+
+class RhslPlanner:
+    '''稽古プランを提案するソルバ
+    
+    各稽古の時間枠を step 分刻みの小枠に分け、シーンを割り当てる
+    シーンを稽古できる度合いは、その小枠に出席している役者のセリフ数の割合
+    (セリフ数ベースの稽古可能性) とし、シーンの重みを掛けた合計を最大化する
+    
+    同じ日の時間が重なる稽古では、同じ役者が出ているシーンを同じ時刻に
+    割り当てない (役者が同時に2か所で稽古することはない)
+    
+    貪欲法で初期解を作り、改善できなくなるまで局所探索で改善する
+    '''
+    
+    def __init__(self, rehearsals, scenes, actors, characters, appearances,
+            presences, unit_minutes=1, step=5):
+        '''
+        Parameters
+        ----------
+        presences : {rehearsal.id: RhslPresence}
+            rehearsal_presences() の戻り値
+        unit_minutes : float
+            シーンの長さ 1 あたりの稽古時間 (分)
+        step : int
+            小枠の刻み (分)
+        '''
+        self.rehearsals = list(rehearsals)
+        self.scenes = list(scenes)
+        self.step = step
+        
+        # 稽古ごとの長さ (分)
+        self.starts = [time_to_minutes(rhsl.start_time)
+            for rhsl in self.rehearsals]
+        self.lengths = [
+            max(time_to_minutes(rhsl.end_time) - start, 0)
+            for rhsl, start in zip(self.rehearsals, self.starts)]
+        
+        # シーンごとの稽古時間 (step の倍数に切り上げ) と重み
+        self.durations = np.array([
+            max(math.ceil(scn.length * unit_minutes / step), 1) * step
+            for scn in self.scenes], dtype=np.int64)
+        self.weights = np.array([scene_weight(scn) for scn in self.scenes])
+        
+        # 稽古ごとの、シーン×分のセリフ数ベースの出席率の累積和
+        # 任意の小枠の出席率の合計が、差を取るだけで求まる
+        presence, offsets = presence_arrays(
+            self.rehearsals, actors, presences)
+        weights, denoms = scene_matrices(
+            self.scenes, actors, characters, appearances)
+        lines_w = weights['lines'] / np.where(
+            denoms['lines'] > 0, denoms['lines'], 1)
+        self.cumsums = []
+        for r, length in enumerate(self.lengths):
+            rhsl_presence = presence[:, offsets[r]:offsets[r] + length]
+            coverage = lines_w.T @ rhsl_presence
+            cumsum = np.zeros((len(self.scenes), length + 1))
+            np.cumsum(coverage, axis=1, out=cumsum[:, 1:])
+            self.cumsums.append(cumsum)
+        
+        # 稽古ごとの、同時に行われる (同じ日で時間が重なる) 稽古
+        date_rhsls = {}
+        for r, rhsl in enumerate(self.rehearsals):
+            date_rhsls.setdefault(rhsl.date, []).append(r)
+        self.concurrent = [[r2 for r2 in date_rhsls[rhsl.date] if r2 != r
+                and self.starts[r2] < self.starts[r] + self.lengths[r]
+                and self.starts[r] < self.starts[r2] + self.lengths[r2]]
+            for r, rhsl in enumerate(self.rehearsals)]
+        
+        # シーン×シーンの、同じ役者が出ているか
+        self.conflicts = (weights['actrs'].T @ weights['actrs']) > 0
+    
+    # ----------------------------------------------------------------
+    # 解の評価
+    
+    def score(self, placements):
+        '''プラン全体の価値
+        
+        同じシーンを複数回稽古した場合は、出席率の高い順に減衰させて加算する
+        '''
+        scn_covs = self.scene_coverages(placements)
+        return sum(self.scene_value(s, covs.values())
+            for s, covs in scn_covs.items())
+    
+    def scene_coverages(self, placements):
+        '''シーンごとの、稽古ごとの出席率 {s: {r: cov}}
+        
+        同じ稽古で同じシーンは1回までなので、稽古をキーにできる
+        '''
+        scn_covs = {}
+        for r, slots in enumerate(placements):
+            for s, _, cov in slots:
+                scn_covs.setdefault(s, {})[r] = cov
+        return scn_covs
+    
+    def scene_value(self, s, covs):
+        '''シーン s を、出席率 covs で稽古する価値
+        '''
+        covs = sorted(covs, reverse=True)
+        return self.weights[s] * sum(
+            cov * REPEAT_DECAY ** k for k, cov in enumerate(covs))
+    
+    # ----------------------------------------------------------------
+    # 貪欲法
+    
+    def free_intervals(self, r, slots):
+        '''稽古 r の、シーンが割り当てられていない時間帯のリスト
+        '''
+        intervals = []
+        pos = 0
+        for s, start, _ in sorted(slots, key=lambda x: x[1]):
+            if start > pos:
+                intervals.append((pos, start))
+            pos = start + self.durations[s]
+        if self.lengths[r] > pos:
+            intervals.append((pos, self.lengths[r]))
+        return intervals
+    
+    def best_slots(self, r, intervals, placements):
+        '''全シーンについて、稽古 r の空き時間に入れる時の
+        最も出席率が高い開始時刻をまとめて求める
+        
+        同時に行われる稽古で、同じ役者が出ているシーンと重なる時刻は除く
+        
+        Returns
+        -------
+        covs : ndarray (シーン数,)
+            最良の開始時刻での出席率 (入らなければ -1)
+        starts : ndarray (シーン数,)
+            最良の開始時刻 (分)
+        '''
+        # 空き時間の中の開始時刻の候補と、その空き時間の終わり
+        starts = [np.arange(a, b, self.step) for a, b in intervals]
+        if not starts:
+            return np.full(len(self.scenes), -1.0),\
+                np.zeros(len(self.scenes), dtype=np.int64)
+        ends = np.concatenate([np.full(len(st), b)
+            for st, (a, b) in zip(starts, intervals)])
+        starts = np.concatenate(starts)
+        
+        # シーン×開始時刻の平均出席率 (空き時間に収まらなければ -1)
+        cumsum = self.cumsums[r]
+        end_idxs = starts[None, :] + self.durations[:, None]
+        fits = end_idxs <= ends[None, :]
+        end_idxs = np.minimum(end_idxs, self.lengths[r])
+        covs = (np.take_along_axis(cumsum, end_idxs, axis=1)
+            - cumsum[:, starts]) / self.durations[:, None]
+        covs[~fits] = -1.0
+        
+        for r2 in self.concurrent[r]:
+            offset = self.starts[r2] - self.starts[r]
+            for s2, start2, _ in placements[r2]:
+                begin = offset + start2
+                overlaps = (starts[None, :] < begin + self.durations[s2])\
+                    & (starts[None, :] + self.durations[:, None] > begin)
+                covs[overlaps & self.conflicts[:, s2, None]] = -1.0
+        
+        idxs = np.argmax(covs, axis=1)
+        scn_idxs = np.arange(len(self.scenes))
+        return covs[scn_idxs, idxs], starts[idxs]
+    
+    def fill(self, placements, counts, rhsl_idxs, excluded=()):
+        '''指定した稽古の空き時間を、時間あたりの価値が高い順に貪欲に埋める
+        
+        excluded のシーンを入れずに埋めてから、残りの空き時間を
+        excluded のシーンも含めて埋める
+        placements, counts は直接更新する
+        '''
+        # シーン×指定した稽古ごとの、最良の開始時刻とその出席率
+        rhsl_idxs = list(rhsl_idxs)
+        cols = {r: c for c, r in enumerate(rhsl_idxs)}
+        best_covs = np.full((len(self.scenes), len(rhsl_idxs)), -1.0)
+        best_starts = np.zeros(best_covs.shape, dtype=np.int64)
+        
+        def update(r):
+            intervals = self.free_intervals(r, placements[r])
+            covs, starts = self.best_slots(r, intervals, placements)
+            # 同じ稽古で同じシーンは1回まで
+            for slot in placements[r]:
+                covs[slot[0]] = -1.0
+            best_covs[:, cols[r]] = covs
+            best_starts[:, cols[r]] = starts
+        
+        for r in rhsl_idxs:
+            update(r)
+        
+        masks = [list(excluded), []] if excluded else [[]]
+        while masks:
+            # 時間あたりの価値の増分
+            gains = best_covs * (self.weights * REPEAT_DECAY ** counts
+                / self.durations)[:, None]
+            gains[best_covs < 0] = 0
+            gains[masks[0]] = 0
+            s, c = np.unravel_index(np.argmax(gains), gains.shape)
+            if gains[s, c] <= 0:
+                masks.pop(0)
+                continue
+            r = rhsl_idxs[c]
+            placements[r].append(
+                (int(s), int(best_starts[s, c]), float(best_covs[s, c])))
+            counts[s] += 1
+            update(r)
+            # 同時に行われる稽古は、使えない時刻が変わる
+            for r2 in self.concurrent[r]:
+                if r2 in cols:
+                    update(r2)
+    
+    # ----------------------------------------------------------------
+    # 局所探索
+    
+    def moves(self, slots):
+        '''稽古の割り当てを改善する手の候補
+        
+        Returns
+        -------
+        [(外す割り当てのリスト, 埋め直す時に一旦除外するシーンの集合)]
+            割り当てを1つずつ外すものと、全部外すものがある
+            外したシーンを除外すると、同じシーンが同じ所に戻らない
+        '''
+        moves = [([slot], {slot[0]}) for slot in slots]
+        if len(slots) > 1:
+            moves.append((list(slots), {slot[0] for slot in slots}))
+        if slots:
+            moves.append((list(slots), set()))
+        return moves
+    
+    def solve(self, time_limit=2.0, seed=0):
+        '''稽古プランを作る
+        
+        稽古ごとに moves() の手を順に試し、良くなる手があればそれを採る
+        全ての稽古を一巡しても良くならなければ終える
+        
+        Parameters
+        ----------
+        time_limit : float
+            局所探索に使う時間の上限 (秒)
+            ふつうは、これより前に改善できなくなって終わる
+        seed : int
+            稽古を試す順番の乱数の種
+        
+        Returns
+        -------
+        placements : list
+            稽古ごとの [(シーンのインデックス, 開始 (分), 出席率)]
+        '''
+        rnd = random.Random(seed)
+        
+        placements = [[] for _ in self.rehearsals]
+        counts = np.zeros(len(self.scenes), dtype=np.int64)
+        self.fill(placements, counts, range(len(self.rehearsals)))
+        scn_covs = self.scene_coverages(placements)
+        total = sum(self.scene_value(s, covs.values())
+            for s, covs in scn_covs.items())
+        
+        deadline = time.monotonic() + time_limit
+        rhsl_idxs = [r for r, length in enumerate(self.lengths) if length > 0]
+        improved = bool(self.scenes)
+        while improved and time.monotonic() < deadline:
+            improved = False
+            rnd.shuffle(rhsl_idxs)
+            for r in rhsl_idxs:
+                old_slots = placements[r]
+                for removed, excluded in self.moves(old_slots):
+                    # 割り当てを外して、埋め直す
+                    new_counts = counts.copy()
+                    for s, _, _ in removed:
+                        new_counts[s] -= 1
+                    placements[r] = [slot for slot in old_slots
+                        if slot not in removed]
+                    self.fill(placements, new_counts, [r], excluded)
+                    
+                    # 出席率が変わったシーンの価値だけを比べる
+                    old_covs = {s: cov for s, _, cov in old_slots}
+                    new_covs = {s: cov for s, _, cov in placements[r]}
+                    gain = 0.0
+                    changes = {}
+                    for s in old_covs.keys() | new_covs.keys():
+                        cov = new_covs.get(s)
+                        if cov == old_covs.get(s):
+                            continue
+                        covs = scn_covs.get(s, {})
+                        changes[s] = dict(covs)
+                        if cov is None:
+                            del changes[s][r]
+                        else:
+                            changes[s][r] = cov
+                        gain += self.scene_value(s, changes[s].values())\
+                            - self.scene_value(s, covs.values())
+                    if gain > total * IMPROVE_TOLERANCE:
+                        total += gain
+                        scn_covs.update(changes)
+                        counts = new_counts
+                        improved = True
+                        break
+                    placements[r] = old_slots
+                if time.monotonic() >= deadline:
+                    break
+        
+        return placements
+    
+    def plan(self, time_limit=2.0, seed=0):
+        '''稽古プランを、稽古のコマとシーンのインスタンスで返す
+        
+        Returns
+        -------
+        [
+            {
+                rehearsal: rehearsal,
+                slots: [{
+                    scene: scene,
+                    from_time: from_time,
+                    to_time: to_time,
+                    coverage: coverage
+                }]
+            }
+        ]
+        '''
+        placements = self.solve(time_limit=time_limit, seed=seed)
+        rhsl_plans = []
+        for r, rhsl in enumerate(self.rehearsals):
+            slots = []
+            for s, start, cov in sorted(placements[r], key=lambda x: x[1]):
+                from_min = self.starts[r] + start
+                slots.append({
+                    'scene': self.scenes[s],
+                    'from_time': minutes_to_time(from_min),
+                    'to_time': minutes_to_time(from_min + self.durations[s]),
+                    'coverage': cov,
+                })
+            rhsl_plans.append({
+                'rehearsal': rhsl,
+                'slots': slots,
+            })
+        return rhsl_plans
+
+
+def plan_for_production(prod_id, rehearsals=None, unit_minutes=1, step=5,
+        time_limit=2.0):
+    '''公演の稽古プランを提案する
+    
+    rehearsals を省略すると、今日以降の全ての稽古が対象になる
+    '''
+    if rehearsals is None:
+        rehearsals = Rehearsal.objects.filter(production__pk=prod_id,
+            date__gte=timezone.localdate()).select_related('place')
+    rehearsals = list(rehearsals)
+    scenes = list(Scene.objects.filter(production__pk=prod_id))
+    actors = list(Actor.objects.filter(production__pk=prod_id))
+    characters = list(Character.objects.filter(production__pk=prod_id))
+    appearances = list(
+        Appearance.objects.filter(scene__production__pk=prod_id))
+    
+    planner = RhslPlanner(rehearsals, scenes, actors, characters,
+        appearances, rehearsal_presences(rehearsals),
+        unit_minutes=unit_minutes, step=step)
+    return planner.plan(time_limit=time_limit)
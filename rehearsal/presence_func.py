@@ -0,0 +1,197 @@
+import datetime
+import threading
+from collections import OrderedDict, defaultdict
+import numpy as np
+from .models import Attendance
+
+
+# プロセス内に保持する RhslPresence の数の上限
+PRESENCE_CACHE_SIZE = 256
+
+
+def time_to_minutes(time):
+    '''datetime.time を 0:00 からの分数にする
+    '''
+    return time.hour * 60 + time.minute
+
+
+def minutes_to_time(minutes):
+    '''0:00 からの分数を datetime.time にする
+    '''
+    minutes = min(max(int(minutes), 0), 24 * 60 - 1)
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+class RhslPresence:
+    '''1コマの稽古の、役者ごとの分単位の出席のビット列
+    
+    稽古の開始時刻～終了時刻の各分について、役者が出席していれば True とする
+    全日なら全ての分、欠席なら出席なしとし、参加時間は稽古の時間に収まるよう補正する
+    シーンに出ている役者が揃うか (AND) や、何人いるか (popcount) は
+    このビット列の演算で求まる
+    '''
+    
+    def __init__(self, rehearsal, rows):
+        '''
+        Parameters
+        ----------
+        rehearsal : Rehearsal
+        rows : list of tuple
+            この稽古の参加時間の
+            (actor_id, from_time, to_time, is_allday, is_absent) のリスト
+        '''
+        self.start_time = rehearsal.start_time
+        self.end_time = rehearsal.end_time
+        self.start = time_to_minutes(rehearsal.start_time)
+        self.length = max(time_to_minutes(rehearsal.end_time) - self.start, 0)
+        
+        # 参加時間のある役者の id -> bits の行
+        self.actor_ids = sorted({row[0] for row in rows})
+        self.actr_idx = {actr_id: idx
+            for idx, actr_id in enumerate(self.actor_ids)}
+        # 最後の行は、参加時間のない役者のための空の行
+        self.bits = np.zeros((len(self.actor_ids) + 1, self.length),
+            dtype=np.bool_)
+        
+        # 欠席の役者の id と、部分参加の役者の id -> [(from_time, to_time)]
+        self.absent_ids = set()
+        self.partial_times = defaultdict(list)
+        
+        for actor_id, from_time, to_time, is_allday, is_absent in rows:
+            if is_absent:
+                self.absent_ids.add(actor_id)
+                continue
+            if is_allday:
+                from_min, to_min = 0, self.length
+            elif from_time and to_time:
+                self.partial_times[actor_id].append((from_time, to_time))
+                # 稽古の開始時刻～終了時刻に収まるよう補正する
+                from_min = min(max(
+                    time_to_minutes(from_time) - self.start, 0), self.length)
+                to_min = min(max(
+                    time_to_minutes(to_time) - self.start, 0), self.length)
+            else:
+                continue
+            if to_min > from_min:
+                self.bits[self.actr_idx[actor_id], from_min:to_min] = True
+        
+        for times in self.partial_times.values():
+            times.sort()
+    
+    def bits_for(self, actor_ids):
+        '''指定した役者の順に並べたビット列 (役者数, 稽古の分数)
+        '''
+        empty = len(self.actor_ids)
+        return self.bits[[self.actr_idx.get(actr_id, empty)
+            for actr_id in actor_ids]]
+    
+    def all_present(self, actor_ids):
+        '''指定した役者が全員出席している分 (AND)
+        '''
+        return self.bits_for(actor_ids).all(axis=0)
+    
+    def present_count(self, actor_ids):
+        '''分ごとの、指定した役者のうち出席している人数 (popcount)
+        '''
+        return self.bits_for(actor_ids).sum(axis=0)
+    
+    def is_undecided(self, actor_id):
+        '''参加時間が1つも登録されていないか
+        '''
+        return actor_id not in self.actr_idx
+    
+    def time_at(self, minutes):
+        '''稽古の開始から minutes 分の時刻
+        '''
+        if minutes <= 0:
+            return self.start_time
+        if minutes >= self.length:
+            return self.end_time
+        return minutes_to_time(self.start + minutes)
+    
+    def segments(self, actor_ids):
+        '''指定した役者の誰かが出入りする時刻で、稽古の時間を区切る
+        
+        Returns
+        -------
+        [(from_time, to_time, [出席している役者の id])]
+        '''
+        if self.length <= 0:
+            return []
+        sub = self.bits_for(actor_ids)
+        changes = np.flatnonzero((sub[:, 1:] != sub[:, :-1]).any(axis=0)) + 1
+        borders = [0] + changes.tolist() + [self.length]
+        return [(
+            self.time_at(from_min),
+            self.time_at(to_min),
+            [actor_ids[idx] for idx in np.flatnonzero(sub[:, from_min])]
+        ) for from_min, to_min in zip(borders[:-1], borders[1:])]
+
+
+# 稽古の id -> (キャッシュのキー, RhslPresence)
+# キーには稽古の時間と参加時間の内容を含めるので、
+# 別のプロセスでデータが変わっても古いビット列を返すことはない
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def rehearsal_presences(rehearsals):
+    '''複数の稽古の RhslPresence を、1回のクエリでまとめて得る
+    
+    参加時間が変わっていない稽古は、キャッシュしたビット列を使う
+    
+    Returns
+    -------
+    {rehearsal.id: RhslPresence}
+    '''
+    rehearsals = list(rehearsals)
+    rhsl_rows = defaultdict(list)
+    rows = Attendance.objects.filter(
+        rehearsal__pk__in=[rhsl.id for rhsl in rehearsals]).order_by('id')\
+        .values_list('rehearsal_id', 'actor_id', 'from_time', 'to_time',
+            'is_allday', 'is_absent')
+    for row in rows:
+        rhsl_rows[row[0]].append(row[1:])
+    
+    return presences_from_rows(rehearsals, rhsl_rows)
+
+
+def presences_from_rows(rehearsals, rhsl_rows):
+    '''読み込み済みの参加時間から、複数の稽古の RhslPresence を得る
+    
+    Parameters
+    ----------
+    rhsl_rows : {rehearsal.id: list of tuple}
+        稽古ごとの (actor_id, from_time, to_time, is_allday, is_absent) の
+        リスト (id 順)
+    
+    Returns
+    -------
+    {rehearsal.id: RhslPresence}
+    '''
+    presences = {}
+    for rhsl in rehearsals:
+        rows = rhsl_rows.get(rhsl.id, [])
+        key = (rhsl.start_time, rhsl.end_time, tuple(rows))
+        with _cache_lock:
+            cached = _cache.get(rhsl.id)
+            if cached and cached[0] == key:
+                _cache.move_to_end(rhsl.id)
+                presences[rhsl.id] = cached[1]
+                continue
+        
+        presence = RhslPresence(rhsl, rows)
+        presences[rhsl.id] = presence
+        with _cache_lock:
+            _cache[rhsl.id] = (key, presence)
+            _cache.move_to_end(rhsl.id)
+            while len(_cache) > PRESENCE_CACHE_SIZE:
+                _cache.popitem(last=False)
+    
+    return presences
+
+
+def rehearsal_presence(rehearsal):
+    '''1コマの稽古の RhslPresence を得る
+    '''
+    return rehearsal_presences([rehearsal])[rehearsal.id]
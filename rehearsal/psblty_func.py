@@ -0,0 +1,343 @@
+import threading
+import numpy as np
+from django.db import transaction
+from .models import Rehearsal, Scene, Actor, Character, Appearance, Possibility
+from .presence_func import rehearsal_presences
+
+
+# Possibility.metric の値と指標の対応
+METRICS = {
+    'chrs': 1,
+    'actrs': 2,
+    'lines': 3,
+}
+
+
+def presence_arrays(rehearsals, actors, presences):
+    '''役者ごとの、全稽古を通した分単位の出席の配列を作る
+    
+    各稽古の RhslPresence のビット列を1本の時間軸につなげる
+    
+    Parameters
+    ----------
+    presences : {rehearsal.id: RhslPresence}
+        rehearsal_presences() の戻り値
+    
+    Returns
+    -------
+    presence : ndarray (役者数, 全稽古の分数) of bool
+    offsets : ndarray (稽古数,) of int
+        各稽古の時間軸上の開始位置
+    '''
+    actor_ids = [actr.id for actr in actors]
+    lengths = np.array([presences[rhsl.id].length for rhsl in rehearsals],
+        dtype=np.int64)
+    offsets = np.zeros(len(rehearsals), dtype=np.int64)
+    if len(rehearsals) > 1:
+        offsets[1:] = np.cumsum(lengths)[:-1]
+    
+    presence = np.zeros((len(actors), int(lengths.sum())), dtype=np.bool_)
+    for r, rhsl in enumerate(rehearsals):
+        presence[:, offsets[r]:offsets[r] + lengths[r]] =\
+            presences[rhsl.id].bits_for(actor_ids)
+    
+    return presence, offsets
+
+
+def scene_matrices(scenes, actors, characters, appearances):
+    '''役者×シーンの重み行列と、シーンごとの正規化のための分母を作る
+    
+    Returns
+    -------
+    weights : {metric: ndarray (役者数, シーン数)}
+        'chrs': 役者がそのシーンで演じる役の数
+        'actrs': 役者がそのシーンに出ていれば 1
+        'lines': 役者がそのシーンで演じる役のセリフ数の合計
+    denoms : {metric: ndarray (シーン数,)}
+        'chrs': シーンの登場人物数
+        'actrs': シーンに出ている役者の数 (配役なしも1人と数える)
+        'lines': シーンのセリフ数
+    '''
+    scn_idx = {scn.id: idx for idx, scn in enumerate(scenes)}
+    actr_idx = {actr.id: idx for idx, actr in enumerate(actors)}
+    cast_by_chr = {chr.id: chr.cast_id for chr in characters}
+    
+    # シーンごとの出番のリスト
+    scn_apprs = [[] for scn in scenes]
+    for appr in appearances:
+        s = scn_idx.get(appr.scene_id)
+        if s is not None:
+            scn_apprs[s].append(appr)
+    
+    shape = (len(actors), len(scenes))
+    chrs_w = np.zeros(shape)
+    lines_w = np.zeros(shape)
+    chrs_num = np.zeros(len(scenes))
+    actrs_num = np.zeros(len(scenes))
+    lines_num = np.zeros(len(scenes))
+    for s, apprs in enumerate(scn_apprs):
+        chrs_num[s] = len(apprs)
+        actrs_num[s] = len({cast_by_chr.get(appr.character_id)
+            for appr in apprs})
+        # シーンのセリフ数 (自動ならシーン全体の平均値)
+        average_lines_num = Appearance.average_lines_num(apprs)
+        lines_num[s] = sum(average_lines_num if appr.lines_auto
+            else appr.lines_num for appr in apprs)
+        
+        # 役者ごとの出番
+        actr_apprs = {}
+        for appr in apprs:
+            a = actr_idx.get(cast_by_chr.get(appr.character_id))
+            if a is not None:
+                actr_apprs.setdefault(a, []).append(appr)
+        for a, apprs in actr_apprs.items():
+            chrs_w[a, s] = len(apprs)
+            # 役者のセリフ数 (自動ならその役者の出番の平均値)
+            average_lines_num = Appearance.average_lines_num(apprs)
+            lines_w[a, s] = sum(average_lines_num if appr.lines_auto
+                else appr.lines_num for appr in apprs)
+    
+    weights = {
+        'chrs': chrs_w,
+        'actrs': (chrs_w > 0).astype(np.float64),
+        'lines': lines_w,
+    }
+    denoms = {
+        'chrs': chrs_num,
+        'actrs': actrs_num,
+        'lines': lines_num,
+    }
+    return weights, denoms
+
+
+def possibility_matrices(rehearsals, scenes, actors, characters,
+        appearances, presences):
+    '''稽古×シーンの稽古可能性を、3つの指標についてまとめて計算する
+    
+    可能性の指標 = Σ(時間 * 出席する役者の重み) / 分母 / シーンの長さ
+    
+    Returns
+    -------
+    {metric: ndarray (稽古数, シーン数)}
+        metric は 'chrs', 'actrs', 'lines'
+    '''
+    presence, offsets = presence_arrays(rehearsals, actors, presences)
+    weights, denoms = scene_matrices(scenes, actors, characters, appearances)
+    
+    # 役者×稽古の出席時間 (分) を累積和の差で求める
+    cumsum = np.zeros((presence.shape[0], presence.shape[1] + 1))
+    np.cumsum(presence, axis=1, out=cumsum[:, 1:])
+    ends = np.append(offsets, presence.shape[1])[1:]
+    atnd_minutes = cumsum[:, ends] - cumsum[:, offsets]
+    
+    # TODO: length_auto に対応すること
+    scn_lens = np.array([scn.length for scn in scenes], dtype=np.float64)
+    
+    psblty = {}
+    for metric, weight in weights.items():
+        # 稽古×シーンの「時間 * 出席する役者の重み」の合計
+        total = atnd_minutes.T @ weight
+        denom = denoms[metric] * scn_lens
+        # 分母が 0 のシーン (出番なしなど) は可能性 0 とする
+        psblty[metric] = np.divide(total, denom,
+            out=np.zeros_like(total), where=denom > 0)
+    return psblty
+
+
+def possibility_for_production(prod_id, rehearsals=None, scenes=None,
+        snapshot=None):
+    '''公演の稽古可能性を、固定のクエリ数で取得して計算する
+    
+    rehearsals, scenes を指定すると、その範囲の参加時間と出番だけを読み込む
+    snapshot (ProductionSnapshot) を指定すると、役者・登場人物・出番・
+    参加時間はそこから取り、データベースを読まない
+    '''
+    if snapshot is not None:
+        rehearsals = snapshot.rehearsals if rehearsals is None\
+            else list(rehearsals)
+        scenes = snapshot.scenes if scenes is None else list(scenes)
+        return possibility_matrices(rehearsals, scenes, snapshot.actors,
+            snapshot.characters, snapshot.appearances,
+            snapshot.presences(rehearsals))
+    
+    if rehearsals is None:
+        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)
+    rehearsals = list(rehearsals)
+    
+    appearances = Appearance.objects.filter(scene__production__pk=prod_id)
+    if scenes is None:
+        scenes = Scene.objects.filter(production__pk=prod_id)
+    else:
+        scenes = list(scenes)
+        appearances = appearances.filter(
+            scene__pk__in=[scn.id for scn in scenes])
+    scenes = list(scenes)
+    
+    actors = list(Actor.objects.filter(production__pk=prod_id))
+    characters = list(Character.objects.filter(production__pk=prod_id))
+    
+    return possibility_matrices(rehearsals, scenes, actors, characters,
+        list(appearances), rehearsal_presences(rehearsals))
+
+
+def stored_possibility(prod_id, rehearsals=None, scenes=None,
+        snapshot=None):
+    '''保存済みの稽古可能性を読み込む
+    
+    rehearsals, scenes を指定すると、その範囲のレコードだけを読み込む
+    足りない組があれば、その範囲だけ計算し直して保存する
+    (snapshot を指定すると、計算し直す時の元データはそこから取る)
+    
+    Returns
+    -------
+    {metric: ndarray (稽古数, シーン数)}
+        metric は 'chrs', 'actrs', 'lines'
+    '''
+    rows = Possibility.objects.filter(production__pk=prod_id)
+    if rehearsals is None:
+        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)
+    else:
+        rehearsals = list(rehearsals)
+        rows = rows.filter(rehearsal__in=[rhsl.id for rhsl in rehearsals])
+    rehearsals = list(rehearsals)
+    if scenes is None:
+        scenes = Scene.objects.filter(production__pk=prod_id)
+    else:
+        scenes = list(scenes)
+        rows = rows.filter(scene__in=[scn.id for scn in scenes])
+    scenes = list(scenes)
+    
+    rhsl_idx = {rhsl.id: idx for idx, rhsl in enumerate(rehearsals)}
+    scn_idx = {scn.id: idx for idx, scn in enumerate(scenes)}
+    metric_names = {value: name for name, value in METRICS.items()}
+    
+    # 保存済みの稽古可能性を一度に読み込む
+    psblty = {name: np.zeros((len(rehearsals), len(scenes)))
+        for name in METRICS}
+    found = np.zeros((len(rehearsals), len(scenes)), dtype=np.int64)
+    rows = rows.values_list('rehearsal_id', 'scene_id', 'metric', 'value')
+    for rhsl_id, scn_id, metric, value in rows:
+        r = rhsl_idx.get(rhsl_id)
+        s = scn_idx.get(scn_id)
+        if r is None or s is None or metric not in metric_names:
+            continue
+        psblty[metric_names[metric]][r, s] = value
+        found[r, s] += 1
+    
+    # 全ての組が揃っていればそのまま返す
+    if (found == len(METRICS)).all():
+        return psblty
+    
+    # 足りなければ計算し直して保存する
+    psblty = possibility_for_production(
+        prod_id, rehearsals=rehearsals, scenes=scenes, snapshot=snapshot)
+    store_possibility(prod_id, rehearsals, scenes, psblty)
+    return psblty
+
+
+def store_possibility(prod_id, rehearsals, scenes, psblty):
+    '''計算した稽古可能性を保存する
+    
+    指定した稽古×シーンの範囲の既存のレコードは置き換える
+    '''
+    records = [
+        Possibility(production_id=prod_id, rehearsal_id=rhsl.id,
+            scene_id=scn.id, metric=metric, value=float(psblty[name][r, s]))
+        for name, metric in METRICS.items()
+        for r, rhsl in enumerate(rehearsals)
+        for s, scn in enumerate(scenes)
+    ]
+    with transaction.atomic():
+        Possibility.objects.filter(production__pk=prod_id,
+            rehearsal__in=[rhsl.id for rhsl in rehearsals],
+            scene__in=[scn.id for scn in scenes]).delete()
+        # 同時に計算した他のリクエストと衝突しても良いようにする
+        Possibility.objects.bulk_create(records, ignore_conflicts=True)
+
+
+def update_possibility(prod_id, rehearsals=None, scenes=None):
+    '''指定した稽古 (行) やシーン (列) の稽古可能性だけを計算し直して保存する
+    
+    省略した方は公演の全ての稽古・シーンが対象になる
+    '''
+    if rehearsals is None:
+        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)
+    rehearsals = list(rehearsals)
+    if scenes is None:
+        scenes = Scene.objects.filter(production__pk=prod_id)
+    scenes = list(scenes)
+    if not rehearsals or not scenes:
+        return
+    
+    psblty = possibility_for_production(
+        prod_id, rehearsals=rehearsals, scenes=scenes)
+    store_possibility(prod_id, rehearsals, scenes, psblty)
+
+
+# ----------------------------------------------------------------
+# 元データの変更に合わせた稽古可能性の差分更新
+# signals から予約され、トランザクションのコミット時にまとめて実行する
+
+_pending = threading.local()
+
+
+def schedule_possibility_update(rehearsal_id=None, scene_id=None,
+        prod_id=None):
+    '''稽古可能性の差分更新を予約する
+    
+    Parameters
+    ----------
+    rehearsal_id : int
+        参加時間などが変わった稽古 (その行を計算し直す)
+    scene_id : int
+        配役や出番などが変わったシーン (その列を計算し直す)
+    prod_id : int
+        公演全体の稽古可能性を無効にする (次の表示時に計算し直す)
+    '''
+    pending = getattr(_pending, 'updates', None)
+    if pending is None:
+        pending = {'rhsls': set(), 'scns': set(), 'prods': set()}
+        _pending.updates = pending
+    
+    if rehearsal_id is not None:
+        pending['rhsls'].add(rehearsal_id)
+    if scene_id is not None:
+        pending['scns'].add(scene_id)
+    if prod_id is not None:
+        pending['prods'].add(prod_id)
+    
+    # 最初に実行されたコールバックが予約をまとめて処理し、残りは何もしない
+    # (ロールバックで残った予約は、次のコミット時に一緒に処理される)
+    transaction.on_commit(flush_possibility_updates)
+
+
+def flush_possibility_updates():
+    '''予約された稽古可能性の差分更新を実行する
+    '''
+    pending = getattr(_pending, 'updates', None)
+    _pending.updates = None
+    if pending is None:
+        return
+    
+    # 公演全体を無効にするものは、レコードを削除するだけ
+    for prod_id in pending['prods']:
+        Possibility.objects.filter(production__pk=prod_id).delete()
+    
+    # 削除済みの稽古・シーンは対象外にしつつ、公演ごとにまとめる
+    prod_rhsls = {}
+    for rhsl in Rehearsal.objects.filter(pk__in=pending['rhsls']):
+        prod_rhsls.setdefault(rhsl.production_id, []).append(rhsl)
+    prod_scns = {}
+    for scn in Scene.objects.filter(pk__in=pending['scns']):
+        prod_scns.setdefault(scn.production_id, []).append(scn)
+    
+    for prod_id in set(prod_rhsls) | set(prod_scns):
+        if prod_id in pending['prods']:
+            continue
+        # まだ一度も表示されていない公演は、表示時にまとめて計算する
+        if not Possibility.objects.filter(production__pk=prod_id).exists():
+            continue
+        if prod_id in prod_rhsls:
+            update_possibility(prod_id, rehearsals=prod_rhsls[prod_id])
+        if prod_id in prod_scns:
+            update_possibility(prod_id, scenes=prod_scns[prod_id])
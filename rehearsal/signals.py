@@ -0,0 +1,163 @@
+import threading
+from contextlib import contextmanager
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Facility, Place, Rehearsal, Scene, Actor, Character,\
+    Attendance, Appearance
+from .psblty_func import schedule_possibility_update
+from .cache_func import schedule_data_version_bump
+
+
+# ----------------------------------------------------------------
+# 一括処理中の signal handler の停止
+# bulk の書き込みやクエリセットの削除では、行ごとに handler が呼ばれるので、
+# 止めておいて、呼び出し側で版の更新などを1回だけ行う
+
+_suppressed = threading.local()
+
+
+@contextmanager
+def suppress_data_signals():
+    '''このスレッドで、以下の signal handler を何もしないようにする
+    
+    呼び出し側で schedule_data_version_bump や schedule_possibility_update を
+    まとめて呼ぶこと
+    
+    ex. with suppress_data_signals():
+            Scene.objects.filter(production=prod).delete()
+        schedule_data_version_bump(pk=prod.id)
+    '''
+    _suppressed.depth = getattr(_suppressed, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _suppressed.depth -= 1
+
+
+def data_signals_suppressed():
+    '''suppress_data_signals の中か
+    '''
+    return getattr(_suppressed, 'depth', 0) > 0
+
+
+# ----------------------------------------------------------------
+# 稽古可能性の差分更新
+# 元データが変わったら、影響する稽古 (行) やシーン (列) だけを計算し直す
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def update_psblty_for_attendance(sender, instance, **kwargs):
+    '''参加時間が変わったら、その稽古の稽古可能性を計算し直す
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_possibility_update(rehearsal_id=instance.rehearsal_id)
+
+
+@receiver(post_save, sender=Rehearsal)
+def update_psblty_for_rehearsal(sender, instance, **kwargs):
+    '''稽古の時間が変わったら、その稽古の稽古可能性を計算し直す
+    
+    稽古の削除時はカスケードで削除される
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_possibility_update(rehearsal_id=instance.id)
+
+
+@receiver(post_save, sender=Scene)
+def update_psblty_for_scene(sender, instance, **kwargs):
+    '''シーンの長さなどが変わったら、そのシーンの稽古可能性を計算し直す
+    
+    シーンの削除時はカスケードで削除される
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_possibility_update(scene_id=instance.id)
+
+
+@receiver(post_save, sender=Appearance)
+@receiver(post_delete, sender=Appearance)
+def update_psblty_for_appearance(sender, instance, **kwargs):
+    '''出番が変わったら、そのシーンの稽古可能性を計算し直す
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_possibility_update(scene_id=instance.scene_id)
+
+
+@receiver(post_save, sender=Character)
+def update_psblty_for_character(sender, instance, **kwargs):
+    '''配役が変わったら、その登場人物が出ているシーンの稽古可能性を計算し直す
+    
+    登場人物の削除時は、出番の削除に合わせて計算し直される
+    '''
+    if data_signals_suppressed():
+        return
+    for scn_id in instance.appearance_set.values_list('scene_id', flat=True):
+        schedule_possibility_update(scene_id=scn_id)
+
+
+@receiver(post_delete, sender=Actor)
+def update_psblty_for_actor(sender, instance, **kwargs):
+    '''役者が削除されたら、その公演の稽古可能性を無効にする
+    
+    配役の SET_NULL は Character の signal を発生させないため
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_possibility_update(prod_id=instance.production_id)
+
+
+# ----------------------------------------------------------------
+# 公演のデータの版
+# 稽古・シーン・配役・出欠などが変わったら、その公演の版を進める
+# (版をキーにしたキャッシュが使われなくなる)
+# 版の更新はコミット時に、トランザクションごとに1回にまとめる
+
+@receiver(post_save, sender=Rehearsal)
+@receiver(post_delete, sender=Rehearsal)
+@receiver(post_save, sender=Scene)
+@receiver(post_delete, sender=Scene)
+@receiver(post_save, sender=Actor)
+@receiver(post_delete, sender=Actor)
+@receiver(post_save, sender=Character)
+@receiver(post_delete, sender=Character)
+@receiver(post_save, sender=Facility)
+@receiver(post_delete, sender=Facility)
+def bump_version_for_prod_record(sender, instance, **kwargs):
+    '''公演に直接属するレコードが変わったら、その公演の版を進める
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_data_version_bump(pk=instance.production_id)
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def bump_version_for_attendance(sender, instance, **kwargs):
+    '''参加時間が変わったら、その稽古の公演の版を進める
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_data_version_bump(rehearsal__pk=instance.rehearsal_id)
+
+
+@receiver(post_save, sender=Appearance)
+@receiver(post_delete, sender=Appearance)
+def bump_version_for_appearance(sender, instance, **kwargs):
+    '''出番が変わったら、そのシーンの公演の版を進める
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_data_version_bump(scene__pk=instance.scene_id)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def bump_version_for_place(sender, instance, **kwargs):
+    '''稽古場が変わったら、その施設の公演の版を進める
+    '''
+    if data_signals_suppressed():
+        return
+    schedule_data_version_bump(facility__pk=instance.facility_id)
@@ -0,0 +1,130 @@
+from collections import defaultdict
+import numpy as np
+from .models import Rehearsal, Scene, Actor, Character, Attendance, Appearance
+from .model_func import index_by_id
+from .presence_func import presences_from_rows
+from .cache_func import versioned_payload
+
+
+class ProductionSnapshot:
+    '''公演の稽古に関わるデータを、固定のクエリ数でまとめて読み込んだもの
+    
+    分析系のビュー (出欠表、香盤表、出欠グラフ、稽古可能性など) は
+    これを共有し、稽古・シーン・役者・登場人物・出番・参加時間を
+    それぞれ取得し直さない
+    
+    Attributes
+    ----------
+    rehearsals : list of Rehearsal
+        稽古のコマ (日付・開始時刻の順、稽古場と施設も読み込み済み)
+    scenes : list of Scene
+        シーン (sortkey の順)
+    actors : list of Actor
+        役者 (名前の順)
+    characters : list of Character
+        登場人物 (sortkey の順)
+    appearances : list of Appearance
+        公演の全ての出番 (id 順)
+    rhsl_idx, scn_idx, actr_idx, chr_idx : {id: インデックス}
+        各リストの id -> インデックス
+    scn_apprs : list of list of Appearance
+        シーンのインデックスごとの出番のリスト (id 順)
+    scn_avg_lines : ndarray (シーン数,)
+        シーンごとの有効なセリフ数の平均値 (セリフ数が自動の出番に使う)
+    chr_cast : ndarray (登場人物数,) of int
+        登場人物ごとの配役の役者のインデックス (配役がなければ -1)
+    appr : ndarray (シーン数, 登場人物数) of bool
+        登場人物がそのシーンに出ていれば True
+    lines : ndarray (シーン数, 登場人物数)
+        そのシーンでの登場人物の (最初の出番の) セリフ数
+        自動ならシーンの平均値、出番がなければ 0
+    '''
+    
+    def __init__(self, prod_id):
+        self.prod_id = prod_id
+        
+        self.rehearsals = list(Rehearsal.objects.filter(
+            production__pk=prod_id).select_related('place__facility'))
+        self.scenes = list(Scene.objects.filter(production__pk=prod_id))
+        self.actors = list(Actor.objects.filter(production__pk=prod_id)
+            .order_by('name'))
+        self.characters = list(
+            Character.objects.filter(production__pk=prod_id))
+        self.appearances = list(Appearance.objects.filter(
+            scene__production__pk=prod_id).order_by('id'))
+        
+        # 稽古ごとの参加時間 (RhslPresence の元データ)
+        self.rhsl_rows = defaultdict(list)
+        rows = Attendance.objects.filter(rehearsal__production__pk=prod_id)\
+            .order_by('id').values_list('rehearsal_id', 'actor_id',
+                'from_time', 'to_time', 'is_allday', 'is_absent')
+        for row in rows:
+            self.rhsl_rows[row[0]].append(row[1:])
+        
+        self.rhsl_idx = index_by_id(self.rehearsals)
+        self.scn_idx = index_by_id(self.scenes)
+        self.actr_idx = index_by_id(self.actors)
+        self.chr_idx = index_by_id(self.characters)
+        
+        self.scn_apprs = [[] for scn in self.scenes]
+        for appr in self.appearances:
+            s = self.scn_idx.get(appr.scene_id)
+            if s is not None:
+                self.scn_apprs[s].append(appr)
+        self.scn_avg_lines = np.array([Appearance.average_lines_num(apprs)
+            for apprs in self.scn_apprs], dtype=np.float64)
+        
+        self.chr_cast = np.array([self.actr_idx.get(chr.cast_id, -1)
+            for chr in self.characters], dtype=np.int64)
+        
+        shape = (len(self.scenes), len(self.characters))
+        self.appr = np.zeros(shape, dtype=np.bool_)
+        self.lines = np.zeros(shape, dtype=np.float64)
+        for s, apprs in enumerate(self.scn_apprs):
+            for appr in apprs:
+                c = self.chr_idx.get(appr.character_id)
+                # 同じ登場人物の出番が複数あれば、最初のものを使う
+                if c is None or self.appr[s, c]:
+                    continue
+                self.appr[s, c] = True
+                self.lines[s, c] = self.scn_avg_lines[s] if appr.lines_auto\
+                    else appr.lines_num
+    
+    def cast_matrix(self):
+        '''登場人物×役者の配役の行列 (配役なら 1)
+        '''
+        cast = np.zeros((len(self.characters), len(self.actors)))
+        has_cast = self.chr_cast >= 0
+        cast[np.flatnonzero(has_cast), self.chr_cast[has_cast]] = 1
+        return cast
+    
+    def presences(self, rehearsals=None):
+        '''稽古ごとの RhslPresence を、読み込み済みの参加時間から得る
+        
+        Returns
+        -------
+        {rehearsal.id: RhslPresence}
+        '''
+        if rehearsals is None:
+            rehearsals = self.rehearsals
+        return presences_from_rows(rehearsals, self.rhsl_rows)
+    
+    def presence(self, rehearsal):
+        '''1コマの稽古の RhslPresence を得る
+        '''
+        return self.presences([rehearsal])[rehearsal.id]
+
+
+def production_snapshot(request, prod_id):
+    '''公演の ProductionSnapshot を得る
+    
+    同じリクエストの中では同じものを返し、リクエストをまたいでは
+    公演のデータの版ごとにキャッシュする
+    '''
+    snapshots = getattr(request, '_production_snapshots', None)
+    if snapshots is None:
+        snapshots = request._production_snapshots = {}
+    if prod_id not in snapshots:
+        snapshots[prod_id] = versioned_payload('snapshot', prod_id,
+            lambda: ProductionSnapshot(prod_id))
+    return snapshots[prod_id]
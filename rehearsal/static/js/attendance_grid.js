@@ -0,0 +1,123 @@
+// 以下のクラスの style が定義されていること
+// .top_left_cell
+// .header_cell
+// .name_cell
+// .data_cell
+
+// 以下のデータを View から受け取ること
+var data_url;           // 参加時間データ (JSON) の URL
+var csrf_token;         // POST 用の CSRF トークン
+
+// 以下のデータは data_url から読み込む
+var rhsls;              // 稽古のコマのデータのリスト
+var actrs;              // 役者のリスト
+var actr_atnds;         // 役者ごとの出欠の、稽古の配列に対応するリスト
+
+// HTML に埋め込む文字列をエスケープする
+function escape_html(str){
+    return str.replace(/&/g, "&amp;").replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+// データを読み込み、テーブルを描画
+function load(){
+    fetch(data_url, {credentials: 'same-origin'})
+        .then((response) => response.json())
+        .then((data) => {
+            rhsls = data['rhsls'];
+            actrs = data['actrs'];
+            actr_atnds = data['actr_atnds'];
+            draw();
+        });
+}
+
+// テーブルを描画
+function draw(){
+    // thead
+    var thead = "<tr><th class=\"top_left_cell\"></th>";
+    
+    rhsls.forEach((rhsl) => {
+        // 日付を整形
+        var d = new Date(rhsl['date']);
+        var dateStr = `
+            ${(d.getMonth()+1).toString().padStart(2, '0')}/
+            ${d.getDate().toString().padStart(2, '0')}(
+            ${dowChars.charAt(d.getDay())})
+        `.replace(/[\n\r]+\s*/g, '');
+        
+        thead += "<th class=\"header_cell\">" + dateStr + "<br>"
+            + escape_html(rhsl['place']) + "<br>"
+            + rhsl['start_time'] + "-" + rhsl['end_time'] + "</th>";
+    });
+    
+    thead += "</tr>";
+    
+    document.getElementById("t_header").innerHTML = thead;
+    
+    // tbody (セルごとに入力欄を置き、元の値を data 属性に持つ)
+    var tbody = "";
+    
+    actrs.forEach((actr, actr_idx) => {
+        tbody += "<tr><td class=\"name_cell\">"
+            + escape_html(actr['short_name']) + "</td>";
+        
+        rhsls.forEach((rhsl, rhsl_idx) => {
+            var value = escape_html(actr_atnds[actr_idx][rhsl_idx].join(","));
+            tbody += "<td class=\"data_cell\"><input type=\"text\""
+                + ` data-actr="${actr['id']}" data-rhsl="${rhsl['id']}"`
+                + ` data-orig="${value}" value="${value}"`
+                + (actr['editable'] ? "" : " disabled")
+                + " onChange=\"mark_changed(this);\"></td>";
+        });
+        
+        tbody += "</tr>";
+    });
+    
+    document.getElementById("t_data").innerHTML = tbody;
+    document.getElementById("message").textContent = "";
+}
+
+// 値が変わったセルに印を付ける
+function mark_changed(input){
+    input.classList.toggle("changed", input.value != input.dataset.orig);
+}
+
+// 変更したセルをまとめて保存
+function save(){
+    var cells = [];
+    document.querySelectorAll("#t_data input.changed").forEach((input) => {
+        cells.push({
+            'actor': Number(input.dataset.actr),
+            'rehearsal': Number(input.dataset.rhsl),
+            'atnds': input.value.split(",").map((s) => s.trim())
+                .filter((s) => s)
+        });
+    });
+    if (cells.length == 0)
+        return;
+    
+    var message = document.getElementById("message");
+    document.getElementById("save_button").disabled = true;
+    
+    fetch(data_url, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrf_token},
+        body: JSON.stringify({'cells': cells})
+    })
+        .then((response) => response.json().then((data) => [response, data]))
+        .then(([response, data]) => {
+            document.getElementById("save_button").disabled = false;
+            if (!response.ok){
+                // エラーなら何も保存されていないので、入力はそのまま残す
+                message.textContent = (data['errors'] || ["保存できませんでした。"])
+                    .join(" ");
+                return;
+            }
+            load();
+        })
+        .catch(() => {
+            document.getElementById("save_button").disabled = false;
+            message.textContent = "保存できませんでした。";
+        });
+}
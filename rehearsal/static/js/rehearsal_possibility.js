@@ -3,11 +3,17 @@
 // .data_cell
 
 // 以下のデータを View から受け取ること
+var data_url;           // 稽古可能性データ (JSON) の URL
+var window_days;        // 一度に読み込む日数
+
+// 以下のデータは data_url から期間ごとに読み込む
 var rhsls;              // 稽古のリスト
 var scns;               // シーンのリスト
 var psblty_in_chrs;     // 登場人物ベースの稽古可能性データ
 var psblty_in_actrs;    // 役者ベースの稽古可能性データ
 var psblty_in_lines;    // セリフ数ベースの稽古可能性データ
+var prev_to;            // 前の稽古の日付 (なければ null)
+var next_from;          // 次の稽古の日付 (なければ null)
 
 // 出席率を色に変換
 function color_for_rate(rate){
@@ -31,6 +37,50 @@ function color_for_rate(rate){
     return `rgb(${r}, ${g}, ${b})`;
 }
 
+// 期間を指定してデータを読み込み、テーブルを描画
+// params は from, to, scns (シーンの id のカンマ区切り) など
+function load(params){
+    var query = new URLSearchParams(params);
+    query.set('days', window_days);
+    
+    fetch(data_url + '?' + query.toString(), {credentials: 'same-origin'})
+        .then((response) => response.json())
+        .then((data) => {
+            rhsls = data['rhsls'];
+            scns = data['scns'];
+            psblty_in_chrs = data['psblty_in_chrs'];
+            psblty_in_actrs = data['psblty_in_actrs'];
+            psblty_in_lines = data['psblty_in_lines'];
+            prev_to = data['prev_to'];
+            next_from = data['next_from'];
+            
+            // 期間とページ送りのボタン
+            document.getElementById("period").textContent =
+                data['from'] + " - " + data['to'];
+            document.getElementById("prev_button").disabled = !prev_to;
+            document.getElementById("next_button").disabled = !next_from;
+            
+            // 最初のデータを読み込むまで、適用ボタンは押せない
+            document.getElementById("apply_button").disabled = false;
+            
+            draw();
+        });
+}
+
+// 前の期間を読み込む
+function load_prev(){
+    if (prev_to){
+        load({'to': prev_to});
+    }
+}
+
+// 次の期間を読み込む
+function load_next(){
+    if (next_from){
+        load({'from': next_from});
+    }
+}
+
 // テーブルを描画
 function draw(){
     // モードを取得
@@ -0,0 +1,142 @@
+import datetime
+import random
+from django.db import transaction
+from production.models import Production, ProdUser
+from .models import Rehearsal, Scene, Actor, Character, Attendance, Appearance
+
+
+def create_synthetic_production(owner=None, name='合成公演', actors=20,
+        roles=30, double_cast=0.2, scenes=40, appearances=5, rehearsals=30,
+        density=0.8, seed=0):
+    '''計測用に、指定した規模の公演を乱数で作る
+    
+    レコードは bulk_create で作るので、signals (稽古可能性の更新) は動かない
+    
+    Parameters
+    ----------
+    owner : User
+        所有者にするユーザ (省略時は所有者なし)
+    actors : int
+        役者の数
+    roles : int
+        役の数
+    double_cast : float
+        ダブルキャストにする役の割合
+        ダブルキャストの役は配役ごとに登場人物を登録し、
+        その役が出るシーンも配役 (A/B) ごとに登録する
+    scenes : int
+        シーンの数 (ダブルキャストで分かれる前)
+    appearances : int
+        1シーンあたりの出番の数 (の上限)
+    rehearsals : int
+        稽古のコマの数
+    density : float
+        役者×稽古のうち、出欠が登録されている割合
+        登録されていれば、全日・欠席・部分参加のいずれかになる
+    '''
+    rnd = random.Random(seed)
+    
+    with transaction.atomic():
+        prod = Production.objects.create(name=name)
+        if owner:
+            ProdUser.objects.create(production=prod, user=owner,
+                is_owner=True)
+        
+        # 役者
+        actr_list = Actor.objects.bulk_create([
+            Actor(production=prod, name='役者{:03}'.format(i))
+            for i in range(actors)])
+        
+        # 登場人物 (ダブルキャストの役は A/B の2人)
+        # 役 -> [登場人物] (シングルキャストなら1つ)
+        role_chrs = []
+        chr_list = []
+        for role in range(roles):
+            teams = ['A', 'B'] if actr_list and rnd.random() < double_cast\
+                else ['']
+            casts = rnd.sample(actr_list, min(len(teams), len(actr_list)))\
+                if actr_list else []
+            chrs = []
+            for team_idx, team in enumerate(teams):
+                chr = Character(production=prod,
+                    name='役{:03}{}'.format(role, team), sortkey=role,
+                    cast=casts[team_idx] if team_idx < len(casts) else None)
+                chr.team = team
+                chrs.append(chr)
+            role_chrs.append(chrs)
+            chr_list.extend(chrs)
+        Character.objects.bulk_create(chr_list)
+        
+        # シーンと出番
+        # ダブルキャストの役が出るシーンは、配役 (A/B) ごとに登録する
+        scn_list = []
+        scn_roles = []
+        for scn_idx in range(scenes):
+            roles_in_scn = rnd.sample(range(roles),
+                rnd.randint(1, min(appearances, roles))) if roles else []
+            double = any(len(role_chrs[role]) > 1 for role in roles_in_scn)
+            for team in (['A', 'B'] if double else ['']):
+                scn_list.append(Scene(production=prod,
+                    name='シーン{:03}{}'.format(scn_idx, team),
+                    sortkey=len(scn_list), length=rnd.randint(1, 30),
+                    progress=rnd.choice([0, 0, 20, 50, 80, 100]),
+                    priority=rnd.randint(1, 5)))
+                scn_roles.append((roles_in_scn, team))
+        Scene.objects.bulk_create(scn_list)
+        
+        appr_list = []
+        for scene, (roles_in_scn, team) in zip(scn_list, scn_roles):
+            for role in roles_in_scn:
+                chrs = role_chrs[role]
+                chr = chrs[0] if len(chrs) == 1\
+                    else [chr for chr in chrs if chr.team == (team or 'A')][0]
+                lines_auto = rnd.random() < 0.2
+                appr_list.append(Appearance(scene=scene, character=chr,
+                    lines_num=0 if lines_auto else rnd.randint(1, 40),
+                    lines_auto=lines_auto))
+        Appearance.objects.bulk_create(appr_list)
+        
+        # 稽古のコマと出欠
+        rhsl_list = []
+        first_date = datetime.date.today()
+        for day in range(rehearsals):
+            start = rnd.randint(9, 14)
+            rhsl_list.append(Rehearsal(production=prod,
+                date=first_date + datetime.timedelta(days=day),
+                start_time=datetime.time(start),
+                end_time=datetime.time(start + rnd.randint(3, 8))))
+        Rehearsal.objects.bulk_create(rhsl_list)
+        
+        atnd_list = []
+        for rhsl in rhsl_list:
+            for actor in actr_list:
+                # 未定
+                if rnd.random() >= density:
+                    continue
+                x = rnd.random()
+                if x < 0.15:
+                    atnd_list.append(Attendance(rehearsal=rhsl, actor=actor,
+                        is_absent=True))
+                elif x < 0.5:
+                    atnd_list.append(Attendance(rehearsal=rhsl, actor=actor,
+                        is_allday=True))
+                else:
+                    # 15分単位の部分参加を1～2回
+                    start = rhsl.start_time.hour * 4
+                    end = rhsl.end_time.hour * 4
+                    time = rnd.randint(start - 2, end - 2)
+                    for _ in range(rnd.randint(1, 2)):
+                        to_time = min(time + rnd.randint(2, 12), 24 * 4 - 1)
+                        if to_time <= time:
+                            break
+                        atnd_list.append(Attendance(rehearsal=rhsl,
+                            actor=actor,
+                            from_time=datetime.time(time // 4, time % 4 * 15),
+                            to_time=datetime.time(
+                                to_time // 4, to_time % 4 * 15)))
+                        time = to_time + rnd.randint(2, 8)
+                        if time >= 24 * 4 - 1:
+                            break
+        Attendance.objects.bulk_create(atnd_list)
+    
+    return prod
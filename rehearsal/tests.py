@@ -1,3 +1,1137 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from accounts.models import User
+from production.models import Production, ProdUser
+from rehearsal.models import Rehearsal, Scene, Actor, Character, Attendance,\
+    Appearance, AtndChangeLog, Possibility
+from rehearsal.atnd_func import save_attendance_grid
+from rehearsal.model_func import time_slots_for_rehearsals
+from rehearsal.presence_func import RhslPresence
+from rehearsal.psblty_func import possibility_for_production,\
+    stored_possibility
+from rehearsal.bench_func import run_benchmarks
+from rehearsal.plan_func import plan_for_production
+from rehearsal.cache_func import payload_cache, payload_key,\
+    versioned_payload, bump_data_version, flush_data_version_bumps
+from rehearsal.snapshot_func import ProductionSnapshot, production_snapshot
+from rehearsal.signals import suppress_data_signals
 
-# Create your tests here.
+
+def create_production(owner, size):
+    '''size に比例した数の役者、登場人物、シーン、稽古を持つ公演を作る
+    '''
+    prod = Production.objects.create(name='公演{}'.format(size))
+    ProdUser.objects.create(production=prod, user=owner, is_owner=True)
+    
+    actors = [Actor.objects.create(production=prod, name='役者{}'.format(i))
+        for i in range(size)]
+    characters = [Character.objects.create(production=prod,
+            name='人物{}'.format(i), sortkey=i, cast=actors[i % size])
+        for i in range(size * 2)]
+    scenes = [Scene.objects.create(production=prod,
+            name='シーン{}'.format(i), sortkey=i, length=10)
+        for i in range(size)]
+    for scn_idx, scene in enumerate(scenes):
+        for chr_idx in range(3):
+            character = characters[(scn_idx + chr_idx) % len(characters)]
+            Appearance.objects.create(scene=scene, character=character,
+                lines_num=chr_idx + 1, lines_auto=(chr_idx == 2))
+    for day in range(size):
+        rehearsal = Rehearsal.objects.create(production=prod,
+            date=datetime.date(2024, 1, 1) + datetime.timedelta(days=day),
+            start_time=datetime.time(10), end_time=datetime.time(17))
+        for actr_idx, actor in enumerate(actors):
+            if actr_idx % 3 == 0:
+                Attendance.objects.create(rehearsal=rehearsal, actor=actor,
+                    is_allday=True)
+            elif actr_idx % 3 == 1:
+                Attendance.objects.create(rehearsal=rehearsal, actor=actor,
+                    from_time=datetime.time(11), to_time=datetime.time(13))
+                Attendance.objects.create(rehearsal=rehearsal, actor=actor,
+                    from_time=datetime.time(14), to_time=datetime.time(16))
+            else:
+                Attendance.objects.create(rehearsal=rehearsal, actor=actor,
+                    is_absent=True)
+    return prod
+
+
+def create_small_production(owner):
+    '''稽古可能性などを手で計算できる小さな公演を作る
+    
+    稽古1 (10:00-12:00): 役者A 全日、役者B 11:00-12:30、役者C 欠席
+    稽古2 (13:00-14:00): 役者A 13:00-13:30、役者B 未定、役者C 全日
+    シーン1 (長さ10): 人物1 (役者A、セリフ6)、人物2 (役者B、セリフ2)
+    シーン2 (長さ20): 人物3 (役者C、セリフ4)、人物4 (役者A、セリフ4)、
+        人物5 (配役なし、セリフ0)
+    シーン3 (長さ10): 出番なし
+    '''
+    prod = Production.objects.create(name='小さな公演')
+    ProdUser.objects.create(production=prod, user=owner, is_owner=True)
+    actor_a, actor_b, actor_c = [
+        Actor.objects.create(production=prod, name='役者' + name)
+        for name in 'ABC']
+    characters = [Character.objects.create(production=prod,
+            name='人物{}'.format(i + 1), sortkey=i, cast=cast)
+        for i, cast in enumerate([actor_a, actor_b, actor_c, actor_a, None])]
+    scenes = [Scene.objects.create(production=prod,
+            name='シーン{}'.format(i + 1), sortkey=i, length=length)
+        for i, length in enumerate([10, 20, 10])]
+    for scn_idx, chr_idx, lines_num in [(0, 0, 6), (0, 1, 2), (1, 2, 4),
+            (1, 3, 4), (1, 4, 0)]:
+        Appearance.objects.create(scene=scenes[scn_idx],
+            character=characters[chr_idx], lines_num=lines_num)
+    
+    date = datetime.date(2024, 1, 1)
+    rhsl1 = Rehearsal.objects.create(production=prod, date=date,
+        start_time=datetime.time(10), end_time=datetime.time(12))
+    rhsl2 = Rehearsal.objects.create(production=prod, date=date,
+        start_time=datetime.time(13), end_time=datetime.time(14))
+    Attendance.objects.create(rehearsal=rhsl1, actor=actor_a, is_allday=True)
+    Attendance.objects.create(rehearsal=rhsl1, actor=actor_b,
+        from_time=datetime.time(11), to_time=datetime.time(12, 30))
+    Attendance.objects.create(rehearsal=rhsl1, actor=actor_c, is_absent=True)
+    Attendance.objects.create(rehearsal=rhsl2, actor=actor_a,
+        from_time=datetime.time(13), to_time=datetime.time(13, 30))
+    Attendance.objects.create(rehearsal=rhsl2, actor=actor_c, is_allday=True)
+    return prod
+
+
+class RhslPresenceTest(SimpleTestCase):
+    '''RhslPresence のビット列と時刻での区切りのテスト
+    '''
+    
+    def presence(self, start_time, end_time, rows):
+        return RhslPresence(Rehearsal(start_time=start_time,
+            end_time=end_time), rows)
+    
+    def test_touching_intervals(self):
+        t = datetime.time
+        presence = self.presence(t(10), t(14), [
+            (1, t(11), t(12), False, False),
+            (1, t(12), t(13), False, False),
+            (2, t(13), t(14), False, False),
+        ])
+        # 同じ役者の接する参加時間は、1つの区間になる
+        self.assertEqual(presence.segments([1]), [
+            (t(10), t(11), []),
+            (t(11), t(13), [1]),
+            (t(13), t(14), []),
+        ])
+        # 役者が入れ替わる時刻では区切るが、空の区間はできない
+        self.assertEqual(presence.segments([1, 2]), [
+            (t(10), t(11), []),
+            (t(11), t(13), [1]),
+            (t(13), t(14), [2]),
+        ])
+        self.assertEqual(presence.present_count([1, 2]).tolist(),
+            [0] * 60 + [1] * 180)
+    
+    def test_outside_rehearsal(self):
+        t = datetime.time
+        presence = self.presence(t(10), t(14), [
+            (1, t(9), t(10, 30), False, False),
+            (2, t(15), t(16), False, False),
+            (3, t(8), t(18), False, False),
+            (4, t(13, 30), t(15), False, False),
+            (5, None, None, False, True),
+        ])
+        # 稽古の時間に収まるよう補正する
+        self.assertEqual(presence.segments([1]), [
+            (t(10), t(10, 30), [1]),
+            (t(10, 30), t(14), []),
+        ])
+        self.assertEqual(presence.segments([2]), [(t(10), t(14), [])])
+        self.assertEqual(presence.segments([3]), [(t(10), t(14), [3])])
+        self.assertEqual(presence.segments([4]), [
+            (t(10), t(13, 30), []),
+            (t(13, 30), t(14), [4]),
+        ])
+        # 欠席の役者と、参加時間のない役者
+        self.assertEqual(presence.segments([5, 6]), [(t(10), t(14), [])])
+        self.assertFalse(presence.is_undecided(2))
+        self.assertTrue(presence.is_undecided(6))
+    
+    def test_empty_rehearsal(self):
+        t = datetime.time
+        presence = self.presence(t(14), t(13), [
+            (1, t(13), t(14), False, False),
+        ])
+        self.assertEqual(presence.length, 0)
+        self.assertEqual(presence.segments([1]), [])
+
+
+class TimeSlotsTest(TestCase):
+    '''time_slots_for_rehearsals のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_small_production(cls.user)
+        cls.rehearsals = list(Rehearsal.objects.filter(production=cls.prod))
+    
+    def slots(self, scn_slots):
+        '''シーン名 -> [(from_time, to_time, [(役者名, [(役名, セリフ数)])])]
+        '''
+        return {scn['scene'].name: [(slot['from_time'], slot['to_time'], [
+                (atnd['actor'].name, [(appr['character'].name,
+                    appr['lines_num']) for appr in atnd['appearances']])
+                for atnd in slot['attendee']])
+            for slot in scn['time_slots']]
+            for scn in scn_slots}
+    
+    def test_time_slots(self):
+        rhsls_scns_slots = time_slots_for_rehearsals(self.rehearsals)
+        t = datetime.time
+        self.assertEqual(self.slots(rhsls_scns_slots[self.rehearsals[0].id]), {
+            'シーン1': [
+                (t(10), t(11), [('役者A', [('人物1', 6)])]),
+                (t(11), t(12), [('役者A', [('人物1', 6)]),
+                    ('役者B', [('人物2', 2)])]),
+            ],
+            'シーン2': [
+                (t(10), t(12), [('役者A', [('人物4', 4)])]),
+            ],
+            'シーン3': [
+                (t(10), t(12), []),
+            ],
+        })
+        self.assertEqual(self.slots(rhsls_scns_slots[self.rehearsals[1].id]), {
+            'シーン1': [
+                (t(13), t(13, 30), [('役者A', [('人物1', 6)])]),
+                (t(13, 30), t(14), []),
+            ],
+            'シーン2': [
+                (t(13), t(13, 30), [('役者A', [('人物4', 4)]),
+                    ('役者C', [('人物3', 4)])]),
+                (t(13, 30), t(14), [('役者C', [('人物3', 4)])]),
+            ],
+            'シーン3': [
+                (t(13), t(14), []),
+            ],
+        })
+    
+    def test_queries_independent_of_rehearsals(self):
+        with CaptureQueriesContext(connection) as one:
+            time_slots_for_rehearsals(self.rehearsals[:1])
+        with CaptureQueriesContext(connection) as both:
+            time_slots_for_rehearsals(self.rehearsals)
+        self.assertEqual(len(both), len(one))
+
+
+# create_small_production の公演の稽古×シーンの稽古可能性
+# 可能性 = Σ(出席時間 * 役者の重み) / 分母 / シーンの長さ
+# (稽古1 の出席時間は A 120分、B 60分、稽古2 は A 30分、C 60分)
+SMALL_POSSIBILITY = {
+    # 分母はシーンの登場人物数 (2, 3)
+    'chrs': [[(120 + 60) / 2 / 10, 120 / 3 / 20, 0],
+        [30 / 2 / 10, (30 + 60) / 3 / 20, 0]],
+    # 分母はシーンの役者数で、配役なしも1人と数える (2, 3)
+    'actrs': [[(120 + 60) / 2 / 10, 120 / 3 / 20, 0],
+        [30 / 2 / 10, (30 + 60) / 3 / 20, 0]],
+    # 分母はシーンのセリフ数 (8, 8)
+    'lines': [[(120 * 6 + 60 * 2) / 8 / 10, 120 * 4 / 8 / 20, 0],
+        [30 * 6 / 8 / 10, (30 * 4 + 60 * 4) / 8 / 20, 0]],
+}
+
+
+class PossibilityMatricesTest(TestCase):
+    '''possibility_matrices による稽古可能性の計算のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_small_production(cls.user)
+    
+    def assertPossibility(self, psblty, expected):
+        self.assertEqual(set(psblty), set(expected))
+        for metric, values in expected.items():
+            np.testing.assert_allclose(psblty[metric], values,
+                err_msg=metric)
+    
+    def test_hand_computed(self):
+        self.assertPossibility(possibility_for_production(self.prod.id),
+            SMALL_POSSIBILITY)
+    
+    def test_snapshot(self):
+        snapshot = ProductionSnapshot(self.prod.id)
+        self.assertPossibility(possibility_for_production(self.prod.id,
+            snapshot=snapshot), SMALL_POSSIBILITY)
+    
+    def test_subset(self):
+        # 一部の稽古・シーンだけでも、同じ値になる
+        rehearsals = list(Rehearsal.objects.filter(production=self.prod))
+        scenes = list(Scene.objects.filter(production=self.prod))
+        psblty = possibility_for_production(self.prod.id,
+            rehearsals=rehearsals[1:], scenes=scenes[:2])
+        self.assertPossibility(psblty, {metric: [values[1][:2]]
+            for metric, values in SMALL_POSSIBILITY.items()})
+
+
+class StoredPossibilityTest(TestCase):
+    '''Possibility に保存した稽古可能性のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_small_production(cls.user)
+    
+    def writes(self, context):
+        return [query for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'DELETE'))]
+    
+    def test_stored_once(self):
+        with CaptureQueriesContext(connection) as context:
+            psblty = stored_possibility(self.prod.id)
+        self.assertTrue(self.writes(context))
+        # 稽古2つ×シーン3つ×指標3つ
+        self.assertEqual(Possibility.objects.filter(production=self.prod)
+            .count(), 18)
+        for metric, values in SMALL_POSSIBILITY.items():
+            np.testing.assert_allclose(psblty[metric], values)
+        
+        # 2回目は保存した値を読むだけ
+        with CaptureQueriesContext(connection) as context:
+            stored = stored_possibility(self.prod.id)
+        self.assertFalse(self.writes(context))
+        for metric, values in SMALL_POSSIBILITY.items():
+            np.testing.assert_allclose(stored[metric], values)
+    
+    def test_missing_rows(self):
+        stored_possibility(self.prod.id)
+        scene = Scene.objects.filter(production=self.prod).first()
+        Possibility.objects.filter(scene=scene, metric=3).delete()
+        
+        # 足りない組を含む範囲だけ計算し直して保存する
+        psblty = stored_possibility(self.prod.id, scenes=[scene])
+        for metric, values in SMALL_POSSIBILITY.items():
+            np.testing.assert_allclose(psblty[metric],
+                [[row[0]] for row in values])
+        self.assertEqual(Possibility.objects.filter(production=self.prod)
+            .count(), 18)
+
+
+class PossibilityUpdateTest(TestCase):
+    '''元データの変更に合わせた稽古可能性の差分更新のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_small_production(cls.user)
+        cls.rehearsals = list(Rehearsal.objects.filter(production=cls.prod))
+        cls.scenes = list(Scene.objects.filter(production=cls.prod))
+    
+    def setUp(self):
+        # 前のテストの予約が残っていると、余分に計算し直すので済ませておく
+        flush_data_version_bumps()
+        stored_possibility(self.prod.id)
+        self.before = self.rows()
+    
+    def rows(self):
+        '''(稽古の id, シーンの id, 指標) -> (レコードの id, 稽古可能性)
+        '''
+        return {(rhsl_id, scn_id, metric): (pk, value)
+            for pk, rhsl_id, scn_id, metric, value
+            in Possibility.objects.filter(production=self.prod).values_list(
+                'pk', 'rehearsal_id', 'scene_id', 'metric', 'value')}
+    
+    def assertUpdated(self, updated):
+        '''updated (稽古の id, シーンの id) の組だけが保存し直され、
+        全ての値が計算し直した値と一致する
+        '''
+        after = self.rows()
+        self.assertEqual(set(after), set(self.before))
+        for key, (pk, value) in after.items():
+            if key[:2] in updated:
+                self.assertNotEqual(pk, self.before[key][0])
+            else:
+                self.assertEqual((pk, value), self.before[key])
+        psblty = possibility_for_production(self.prod.id)
+        for r, rhsl in enumerate(self.rehearsals):
+            for s, scn in enumerate(self.scenes):
+                for name, metric in [('chrs', 1), ('actrs', 2), ('lines', 3)]:
+                    self.assertAlmostEqual(after[(rhsl.id, scn.id, metric)][1],
+                        psblty[name][r, s])
+    
+    def test_attendance(self):
+        # 稽古1 の役者B を全日にすると、稽古1 の行だけが変わる
+        rhsl = self.rehearsals[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            attendance = Attendance.objects.get(rehearsal=rhsl,
+                actor__name='役者B')
+            attendance.is_allday = True
+            attendance.from_time = attendance.to_time = None
+            attendance.save()
+        self.assertUpdated({(rhsl.id, scn.id) for scn in self.scenes})
+        self.assertAlmostEqual(
+            self.rows()[(rhsl.id, self.scenes[0].id, 1)][1],
+            (120 + 120) / 2 / 10)
+    
+    def test_appearance(self):
+        # シーン1 の人物1 のセリフ数を変えると、シーン1 の列だけが変わる
+        scene = self.scenes[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            appearance = Appearance.objects.get(scene=scene,
+                character__name='人物1')
+            appearance.lines_num = 2
+            appearance.save()
+        self.assertUpdated({(rhsl.id, scene.id) for rhsl in self.rehearsals})
+        self.assertAlmostEqual(
+            self.rows()[(self.rehearsals[0].id, scene.id, 3)][1],
+            (120 * 2 + 60 * 2) / 4 / 10)
+
+
+class RebuildPsbltyTest(TestCase):
+    '''保存済みの稽古可能性を計算し直すコマンドのテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_small_production(cls.user)
+    
+    def setUp(self):
+        payload_cache().clear()
+        flush_data_version_bumps()
+        self.client.force_login(self.user)
+        self.url = '/rhsl/rhsl_psblty_data/{}/?from=2024-01-01&to=2024-01-01'\
+            .format(self.prod.id)
+    
+    def test_rebuild(self):
+        # 壊れた稽古可能性から作ったデータがキャッシュされている
+        stored_possibility(self.prod.id)
+        Possibility.objects.filter(production=self.prod).update(value=99)
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['psblty_in_chrs'][0][0], 99)
+        
+        call_command('rebuild_psblty', self.prod.id, stdout=io.StringIO())
+        self.assertEqual(
+            Possibility.objects.filter(production=self.prod, value=99)
+                .count(), 0)
+        
+        # キャッシュや ETag は使われず、計算し直した値を返す
+        response = self.client.get(self.url,
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['psblty_in_chrs'],
+            SMALL_POSSIBILITY['chrs'])
+
+
+class AnalysisViewQueryCountTest(TestCase):
+    '''分析系のビューのクエリ数が、公演の規模によらず一定であることのテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.small = create_production(cls.user, 3)
+        cls.large = create_production(cls.user, 12)
+    
+    def setUp(self):
+        payload_cache().clear()
+        self.client.force_login(self.user)
+    
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+    
+    def assert_constant_queries(self, url_for_prod):
+        small_count = self.count_queries(url_for_prod(self.small))
+        large_count = self.count_queries(url_for_prod(self.large))
+        self.assertEqual(small_count, large_count)
+    
+    def test_atnd_graph(self):
+        self.assert_constant_queries(lambda prod: '/rhsl/atnd_graph/{}/'
+            .format(Rehearsal.objects.filter(production=prod).first().id))
+    
+    def test_atnd_table(self):
+        self.assert_constant_queries(
+            lambda prod: '/rhsl/atnd_table/{}/'.format(prod.id))
+    
+    def test_appr_table(self):
+        self.assert_constant_queries(
+            lambda prod: '/rhsl/appr_table/{}/'.format(prod.id))
+
+
+class ProductionSnapshotTest(TestCase):
+    '''ProductionSnapshot の内容とキャッシュのテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_production(cls.user, 4)
+    
+    def setUp(self):
+        payload_cache().clear()
+    
+    def test_constant_queries(self):
+        with self.assertNumQueries(6):
+            ProductionSnapshot(self.prod.id)
+    
+    def test_matrices(self):
+        snapshot = ProductionSnapshot(self.prod.id)
+        self.assertEqual(snapshot.appr.shape, (4, 8))
+        self.assertEqual(snapshot.appr.sum(), 12)
+        for scn_idx, apprs in enumerate(snapshot.scn_apprs):
+            for appr in apprs:
+                chr_idx = snapshot.chr_idx[appr.character_id]
+                # セリフ数が自動なら、シーンの他の出番の平均値 (1, 2 -> 1.5)
+                self.assertEqual(snapshot.lines[scn_idx, chr_idx],
+                    1.5 if appr.lines_auto else appr.lines_num)
+        # 登場人物は全員配役されている
+        self.assertTrue((snapshot.cast_matrix().sum(axis=1) == 1).all())
+        for chr_idx, character in enumerate(snapshot.characters):
+            self.assertEqual(
+                snapshot.actors[snapshot.chr_cast[chr_idx]].id,
+                character.cast_id)
+    
+    def test_memoized_by_version(self):
+        request = RequestFactory().get('/')
+        snapshot = production_snapshot(request, self.prod.id)
+        self.assertIs(production_snapshot(request, self.prod.id), snapshot)
+        
+        # 別のリクエストでは、キャッシュから版を読むだけ
+        with CaptureQueriesContext(connection) as context:
+            production_snapshot(RequestFactory().get('/'), self.prod.id)
+        self.assertEqual(len(context), 1)
+        
+        # データが変われば (コミット時に版が進み) 読み込み直す
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.filter(rehearsal__production=self.prod,
+                is_absent=True).delete()
+        snapshot = production_snapshot(RequestFactory().get('/'),
+            self.prod.id)
+        self.assertFalse(any(row[4] for rows in snapshot.rhsl_rows.values()
+            for row in rows))
+
+
+class PayloadCacheTest(TestCase):
+    '''公演のデータの版ごとのキャッシュのテスト
+    '''
+    
+    def setUp(self):
+        payload_cache().clear()
+        self.prod = Production.objects.create(name='公演')
+        self.builds = 0
+    
+    def build(self):
+        self.builds += 1
+        return {'builds': self.builds}
+    
+    def test_versioned_payload(self):
+        self.assertEqual(versioned_payload('test', self.prod.id, self.build),
+            {'builds': 1})
+        self.assertEqual(versioned_payload('test', self.prod.id, self.build),
+            {'builds': 1})
+        
+        # 版が進めば作り直し、古い版の値は消す
+        bump_data_version(pk=self.prod.id)
+        self.assertEqual(versioned_payload('test', self.prod.id, self.build),
+            {'builds': 2})
+        self.assertIsNone(
+            payload_cache().get(payload_key('test', self.prod.id, 0)))
+    
+    def test_long_name(self):
+        key = payload_key('x' * 1000, self.prod.id, 0)
+        self.assertLess(len(key), 100)
+
+
+class ConditionalGetTest(TestCase):
+    '''公演のデータの版による ETag / 304 のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_production(cls.user, 3)
+    
+    def setUp(self):
+        payload_cache().clear()
+        self.client.force_login(self.user)
+    
+    def urls(self):
+        rehearsal = Rehearsal.objects.filter(production=self.prod).first()
+        return [
+            '/rhsl/atnd_table/{}/'.format(self.prod.id),
+            '/rhsl/appr_table/{}/'.format(self.prod.id),
+            '/rhsl/atnd_graph/{}/'.format(rehearsal.id),
+            '/rhsl/rhsl_absence/{}/'.format(rehearsal.id),
+            '/rhsl/rhsl_psblty_data/{}/?from=2024-01-01'.format(self.prod.id),
+        ]
+    
+    def test_not_modified(self):
+        for url in self.urls():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.headers['ETag'], etag)
+    
+    def test_modified(self):
+        url = '/rhsl/atnd_table/{}/'.format(self.prod.id)
+        etag = self.client.get(url).headers['ETag']
+        
+        Attendance.objects.filter(rehearsal__production=self.prod,
+            is_absent=True).update(is_absent=False, is_allday=True)
+        # update() では版が進まない
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        attendance = Attendance.objects.filter(
+            rehearsal__production=self.prod).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            attendance.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('Last-Modified', response.headers)
+    
+    def test_version_not_overwritten(self):
+        # 読み込んだ後に版が進んでも、公演の保存で版が戻らない
+        prod = Production.objects.get(pk=self.prod.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.filter(rehearsal__production=self.prod)\
+                .first().save()
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        prod.name = '改名'
+        prod.save()
+        prod = Production.objects.get(pk=self.prod.pk)
+        self.assertEqual(prod.name, '改名')
+        self.assertEqual(prod.data_version, version)
+
+
+class DataVersionTest(TestCase):
+    '''signals による公演のデータの版の更新のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_production(cls.user, 3)
+        cls.other = create_production(cls.user, 2)
+    
+    def version(self, prod):
+        return Production.objects.get(pk=prod.pk).data_version
+    
+    def setUp(self):
+        # 前のテストの予約が残っていると、版が余分に進むので済ませておく
+        flush_data_version_bumps()
+    
+    def test_bumped_once_per_transaction(self):
+        version = self.version(self.prod)
+        other_version = self.version(self.other)
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks(execute=True):
+                for attendance in Attendance.objects.filter(
+                        rehearsal__production=self.prod):
+                    attendance.save()
+                for appearance in Appearance.objects.filter(
+                        scene__production=self.prod):
+                    appearance.save()
+                Scene.objects.filter(production=self.prod).first().save()
+        updates = [query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "production_production"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.version(self.prod), version + 1)
+        self.assertEqual(self.version(self.other), other_version)
+    
+    def test_bumped_on_commit(self):
+        version = self.version(self.prod)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Attendance.objects.filter(rehearsal__production=self.prod)\
+                .first().save()
+        self.assertEqual(self.version(self.prod), version)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.version(self.prod), version + 1)
+    
+    def test_cascade_delete(self):
+        version = self.version(self.prod)
+        with self.captureOnCommitCallbacks(execute=True):
+            Rehearsal.objects.filter(production=self.prod).first().delete()
+        self.assertEqual(self.version(self.prod), version + 1)
+    
+    def test_suppressed(self):
+        version = self.version(self.prod)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with suppress_data_signals():
+                Attendance.objects.filter(
+                    rehearsal__production=self.prod).delete()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.version(self.prod), version)
+
+
+class AtndTableCacheTest(TestCase):
+    '''出欠表のデータのキャッシュのテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_production(cls.user, 3)
+    
+    def setUp(self):
+        payload_cache().clear()
+        self.client.force_login(self.user)
+        self.url = '/rhsl/atnd_table/{}/'.format(self.prod.id)
+    
+    def get_table(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.context['actr_atnds']), len(context)
+    
+    def test_cached_by_version(self):
+        table, first_count = self.get_table()
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        self.assertIsNotNone(payload_cache().get(
+            payload_key('atnd_table', self.prod.id, version)))
+        
+        # 2回目はキャッシュから作る
+        cached_table, cached_count = self.get_table()
+        self.assertEqual(cached_table, table)
+        self.assertLess(cached_count, first_count)
+        
+        # 役者 (名前の順) の稽古ごとのセル: 全日、2つの時間帯、欠席
+        actors = list(Actor.objects.filter(production=self.prod)
+            .order_by('name'))
+        self.assertEqual(len(table), len(actors))
+        self.assertTrue(all(len(row) == 3 for row in table))
+        self.assertEqual(len(table[1][0]), 2)
+        
+        # 参加時間が変われば作り直す
+        with self.captureOnCommitCallbacks(execute=True):
+            Attendance.objects.filter(actor=actors[1]).delete()
+        table, _ = self.get_table()
+        self.assertEqual(table[1], [[], [], []])
+
+
+class AtndGridTest(TestCase):
+    '''参加時間の一括入力のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.member = User.objects.create_user('member', password='password')
+        cls.prod = create_production(cls.user, 3)
+        member = ProdUser.objects.create(production=cls.prod, user=cls.member)
+        cls.actors = list(Actor.objects.filter(production=cls.prod)
+            .order_by('name'))
+        cls.actors[0].prod_user = member
+        cls.actors[0].save()
+        cls.rehearsal = Rehearsal.objects.filter(production=cls.prod).first()
+    
+    def setUp(self):
+        payload_cache().clear()
+        self.client.force_login(self.user)
+    
+    def url(self):
+        return '/rhsl/atnd_grid_data/{}/'.format(self.prod.id)
+    
+    def post(self, cells):
+        return self.client.post(self.url(), {'cells': cells},
+            content_type='application/json')
+    
+    def cell_values(self, actor):
+        atnds = Attendance.objects.filter(actor=actor,
+            rehearsal=self.rehearsal)
+        return sorted((atnd.from_time, atnd.to_time, atnd.is_allday,
+            atnd.is_absent) for atnd in atnds)
+    
+    def test_get(self):
+        data = self.client.get(self.url()).json()
+        self.assertEqual(data['actr_atnds'][0][0], ['*'])
+        self.assertEqual(data['actr_atnds'][1][0],
+            ['11:00-13:00', '14:00-16:00'])
+        self.assertEqual(data['actr_atnds'][2][0], ['-'])
+        self.assertTrue(all(actr['editable'] for actr in data['actrs']))
+    
+    def test_save(self):
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([
+                # 全日 -> 時間帯 (更新)
+                {'actor': self.actors[0].id, 'rehearsal': self.rehearsal.id,
+                    'atnds': ['10:00-12:00']},
+                # 2つの時間帯 -> 1つは残し、1つは削除
+                {'actor': self.actors[1].id, 'rehearsal': self.rehearsal.id,
+                    'atnds': ['11:00-13:00']},
+                # 欠席 -> 2つの時間帯 (更新と追加)
+                {'actor': self.actors[2].id, 'rehearsal': self.rehearsal.id,
+                    'atnds': ['10:00-11:00', '15:00-16:00']},
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+            {'created': 1, 'updated': 2, 'deleted': 1})
+        self.assertEqual(self.cell_values(self.actors[0]),
+            [(datetime.time(10), datetime.time(12), False, False)])
+        self.assertEqual(self.cell_values(self.actors[1]),
+            [(datetime.time(11), datetime.time(13), False, False)])
+        self.assertEqual(len(self.cell_values(self.actors[2])), 2)
+        self.assertEqual(AtndChangeLog.objects.filter(
+            production=self.prod).count(), 4)
+        self.assertGreater(Production.objects.get(pk=self.prod.pk)
+            .data_version, version)
+        
+        # 一括入力の後の表示は、保存した内容になる
+        data = self.client.get(self.url()).json()
+        self.assertEqual(data['actr_atnds'][2][0],
+            ['10:00-11:00', '15:00-16:00'])
+    
+    def test_invalid(self):
+        # 1つでもエラーがあれば何も保存しない
+        response = self.post([
+            {'actor': self.actors[0].id, 'rehearsal': self.rehearsal.id,
+                'atnds': ['-']},
+            {'actor': self.actors[1].id, 'rehearsal': self.rehearsal.id,
+                'atnds': ['10:00-12:00', '12:00-13:00']},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 1)
+        self.assertEqual(self.cell_values(self.actors[0]),
+            [(None, None, True, False)])
+        self.assertFalse(AtndChangeLog.objects.exists())
+    
+    def test_permission(self):
+        # 編集権のないメンバーは、自分の役者だけ変更できる
+        self.client.force_login(self.member)
+        response = self.post([{'actor': self.actors[0].id,
+            'rehearsal': self.rehearsal.id, 'atnds': []}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cell_values(self.actors[0]), [])
+        
+        response = self.post([{'actor': self.actors[1].id,
+            'rehearsal': self.rehearsal.id, 'atnds': []}])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.cell_values(self.actors[1])), 2)
+    
+    def test_clear_many(self):
+        # 多くのセルを空にしても、削除した数によらずクエリ数は一定
+        prod_user = ProdUser.objects.get(production=self.prod, user=self.user)
+        cells = [{'actor': actor.id, 'rehearsal': rehearsal.id, 'atnds': []}
+            for actor in self.actors
+            for rehearsal in Rehearsal.objects.filter(production=self.prod)]
+        # 前の処理の予約が残っていると、クエリ数が変わるので済ませておく
+        flush_data_version_bumps()
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        # コミット時の稽古可能性の更新を含めて、版の UPDATE は1回だけ
+        with self.assertNumQueries(12):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = save_attendance_grid(prod_user, cells)
+        self.assertEqual(result['deleted'], 12)
+        self.assertFalse(Attendance.objects.filter(
+            rehearsal__production=self.prod).exists())
+        self.assertEqual(Production.objects.get(pk=self.prod.pk)
+            .data_version, version + 1)
+    
+    def test_bump_after_possibility(self):
+        # 版は、稽古可能性を保存し直してからコミット時に進める
+        # (途中で読んだ古い稽古可能性が、新しい版でキャッシュされないように)
+        prod_user = ProdUser.objects.get(production=self.prod, user=self.user)
+        # 前の処理の予約が残っていると、保存した稽古可能性が消えるので済ませておく
+        flush_data_version_bumps()
+        stored_possibility(self.prod.id)
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks() as callbacks:
+                save_attendance_grid(prod_user, [{'actor': self.actors[0].id,
+                    'rehearsal': self.rehearsal.id, 'atnds': []}])
+                self.assertEqual(Production.objects.get(pk=self.prod.pk)
+                    .data_version, version)
+            for callback in callbacks:
+                callback()
+        sqls = [query['sql'] for query in context.captured_queries]
+        bumps = [idx for idx, sql in enumerate(sqls)
+            if sql.startswith('UPDATE "production_production"')]
+        inserts = [idx for idx, sql in enumerate(sqls)
+            if sql.startswith('INSERT') and '"rehearsal_possibility"' in sql]
+        self.assertEqual(len(bumps), 1)
+        self.assertTrue(inserts)
+        self.assertLess(max(inserts), bumps[0])
+        self.assertEqual(Production.objects.get(pk=self.prod.pk)
+            .data_version, version + 1)
+
+
+class AtndLogPruneTest(TestCase):
+    '''出欠の変更履歴の整理 (prune_atnd_logs) のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.prod = Production.objects.create(name='公演')
+    
+    def add_log(self, minutes_ago, old_value, new_value, changed_by_id=1):
+        log = AtndChangeLog.objects.create(production=self.prod,
+            old_value=old_value, new_value=new_value, changed_by='user',
+            changed_by_id=changed_by_id)
+        create_dt = timezone.now() - datetime.timedelta(minutes=minutes_ago)
+        AtndChangeLog.objects.filter(pk=log.pk).update(create_dt=create_dt)
+        return log
+    
+    def values(self):
+        return list(AtndChangeLog.objects.order_by('create_dt', 'id')
+            .values_list('old_value', 'new_value'))
+    
+    def prune(self, *args):
+        call_command('prune_atnd_logs', *args, stdout=io.StringIO())
+    
+    def test_collapse(self):
+        day = 60 * 24
+        # 一連の変更は1件にまとめる
+        self.add_log(day * 2 + 3, '', 'a')
+        self.add_log(day * 2 + 2, 'a', 'b')
+        self.add_log(day * 2 + 1, 'b', 'c')
+        # 正味の変更がなければ削除する
+        self.add_log(day * 2 + 3, 'x', 'y')
+        self.add_log(day * 2 + 2, 'y', 'x')
+        # 変更者が違う、間隔が空いている、新しいものはまとめない
+        self.add_log(day * 2 + 3, 'p', 'q')
+        self.add_log(day * 2 + 2, 'q', 'r', changed_by_id=2)
+        self.add_log(day * 3, 's', 't')
+        self.add_log(day * 2, 't', 'u')
+        self.add_log(2, 'v', 'w')
+        self.add_log(1, 'w', 'z')
+        
+        self.prune('--dry-run')
+        self.assertEqual(AtndChangeLog.objects.count(), 11)
+        
+        self.prune()
+        self.assertEqual(sorted(self.values()), sorted([('', 'c'),
+            ('p', 'q'), ('q', 'r'), ('s', 't'), ('t', 'u'), ('v', 'w'),
+            ('w', 'z')]))
+    
+    def test_expire(self):
+        self.prod.atnd_log_retention_days = 10
+        self.prod.save()
+        for day in range(15):
+            self.add_log(60 * 24 * day + 1, str(day), '')
+        
+        with tempfile.TemporaryDirectory() as archive_dir:
+            self.prune('--archive-dir', archive_dir, '--batch-size', '2')
+            paths = os.listdir(archive_dir)
+            self.assertEqual(len(paths), 1)
+            with gzip.open(os.path.join(archive_dir, paths[0]), 'rt',
+                    encoding='utf-8') as archive:
+                archived = [json.loads(line) for line in archive]
+        
+        self.assertEqual([log['old_value'] for log in archived],
+            ['14', '13', '12', '11', '10'])
+        self.assertEqual(AtndChangeLog.objects.count(), 10)
+        
+        # 0 なら削除しない
+        self.prod.atnd_log_retention_days = 0
+        self.prod.save()
+        self.add_log(60 * 24 * 100, 'old', '')
+        self.prune()
+        self.assertEqual(AtndChangeLog.objects.count(), 11)
+
+
+class KeysetPaginationTest(TestCase):
+    '''公演ごとのリストのページ分けのテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = create_production(cls.user, 3)
+        # 記録日時が同じものも含めて、ページをまたぐ件数の履歴を作る
+        for idx in range(250):
+            AtndChangeLog.objects.create(production=cls.prod,
+                old_value=str(idx), new_value='', changed_by='owner',
+                changed_by_id=1)
+        create_dt = timezone.now()
+        AtndChangeLog.objects.filter(id__lte=AtndChangeLog.objects
+            .order_by('id')[150].id).update(create_dt=create_dt)
+    
+    def setUp(self):
+        self.client.force_login(self.user)
+    
+    def fetch_all(self, url):
+        items = []
+        cursor = None
+        while True:
+            params = {'format': 'json'}
+            if cursor:
+                params['after'] = cursor
+            data = self.client.get(url, params).json()
+            items.extend(data['objects'])
+            cursor = data['next_cursor']
+            if not cursor:
+                return items
+    
+    def test_change_list(self):
+        url = '/rhsl/atnd_change_list/{}/'.format(self.prod.id)
+        logs = self.fetch_all(url)
+        expected = list(AtndChangeLog.objects.filter(production=self.prod)
+            .order_by('-create_dt', '-id').values_list('id', flat=True))
+        self.assertEqual([log['id'] for log in logs], expected)
+        
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['object_list']), 100)
+        self.assertIsNotNone(response.context['next_cursor'])
+    
+    def test_lists(self):
+        for name, model in [('rhsl_list', Rehearsal), ('actr_list', Actor),
+                ('chr_list', Character), ('scn_list', Scene)]:
+            url = '/rhsl/{}/{}/'.format(name, self.prod.id)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            items = self.fetch_all(url)
+            self.assertEqual(len(items),
+                model.objects.filter(production=self.prod).count())
+    
+    def test_invalid_cursor(self):
+        url = '/rhsl/atnd_change_list/{}/'.format(self.prod.id)
+        response = self.client.get(url, {'after': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RhslPlanTest(TestCase):
+    '''稽古プランの提案のテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.prod = Production.objects.create(name='公演')
+        ProdUser.objects.create(production=cls.prod, user=cls.user,
+            is_owner=True)
+        actors = [Actor.objects.create(production=cls.prod,
+                name='役者{}'.format(i))
+            for i in range(4)]
+        characters = [Character.objects.create(production=cls.prod,
+                name='人物{}'.format(i), sortkey=i, cast=actor)
+            for i, actor in enumerate(actors)]
+        # 役者を2人ずつ使う、長さの違うシーン
+        for i in range(8):
+            scene = Scene.objects.create(production=cls.prod,
+                name='シーン{}'.format(i), sortkey=i, length=20 + i * 5,
+                priority=i % 5 + 1)
+            for j in range(2):
+                Appearance.objects.create(scene=scene,
+                    character=characters[(i + j) % len(characters)],
+                    lines_num=j + 1)
+        # 同じ日の時間が重なる2つの稽古と、別の日の稽古
+        date = timezone.localdate() + datetime.timedelta(days=1)
+        cls.rehearsals = [
+            Rehearsal.objects.create(production=cls.prod, date=date,
+                start_time=datetime.time(10), end_time=datetime.time(13)),
+            Rehearsal.objects.create(production=cls.prod, date=date,
+                start_time=datetime.time(11), end_time=datetime.time(14)),
+            Rehearsal.objects.create(production=cls.prod,
+                date=date + datetime.timedelta(days=1),
+                start_time=datetime.time(10), end_time=datetime.time(12)),
+        ]
+        for rehearsal in cls.rehearsals:
+            for actor in actors:
+                Attendance.objects.create(rehearsal=rehearsal, actor=actor,
+                    is_allday=True)
+        cls.casts = {scene.id: {appearance.character.cast_id
+                for appearance in scene.appearance_set.all()}
+            for scene in Scene.objects.filter(production=cls.prod)}
+    
+    def slots(self, rhsl_plans):
+        '''(稽古の id, シーンの id, 開始時刻, 終了時刻) のリスト
+        '''
+        return [(rhsl_plan['rehearsal'].id, slot['scene'].id,
+                slot['from_time'], slot['to_time'])
+            for rhsl_plan in rhsl_plans for slot in rhsl_plan['slots']]
+    
+    def test_feasible(self):
+        rhsl_plans = plan_for_production(self.prod.id)
+        self.assertEqual([rhsl_plan['rehearsal'] for rhsl_plan in rhsl_plans],
+            self.rehearsals)
+        slots = self.slots(rhsl_plans)
+        self.assertTrue(slots)
+        
+        # 稽古の時間内に収まり、同じ稽古の中で重ならない
+        for rhsl_plan in rhsl_plans:
+            rehearsal = rhsl_plan['rehearsal']
+            end_time = rehearsal.start_time
+            for slot in rhsl_plan['slots']:
+                self.assertGreaterEqual(slot['from_time'], end_time)
+                self.assertLess(slot['from_time'], slot['to_time'])
+                end_time = slot['to_time']
+            self.assertLessEqual(end_time, rehearsal.end_time)
+        
+        # 時間が重なる稽古で、同じ役者が同時に2か所にいない
+        dates = {rehearsal.id: rehearsal.date for rehearsal in self.rehearsals}
+        for rhsl_id, scn_id, from_time, to_time in slots:
+            for rhsl_id2, scn_id2, from_time2, to_time2 in slots:
+                if rhsl_id2 == rhsl_id or dates[rhsl_id2] != dates[rhsl_id]\
+                        or to_time2 <= from_time or to_time <= from_time2:
+                    continue
+                self.assertFalse(self.casts[scn_id] & self.casts[scn_id2])
+    
+    def test_deterministic(self):
+        # 改善できなくなれば、時間の上限を待たずに終わる
+        started = time.monotonic()
+        rhsl_plans = plan_for_production(self.prod.id, time_limit=30)
+        self.assertLess(time.monotonic() - started, 30)
+        self.assertEqual(self.slots(rhsl_plans),
+            self.slots(plan_for_production(self.prod.id, time_limit=30)))
+    
+    def test_cached_by_version(self):
+        payload_cache().clear()
+        self.client.force_login(self.user)
+        url = '/rhsl/rhsl_plan/{}/'.format(self.prod.id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        name = 'rhsl_plan:1.0:{}'.format(timezone.localdate())
+        self.assertIsNotNone(payload_cache().get(
+            payload_key(name, self.prod.id, version)))
+        
+        # 2回目はキャッシュから作るので、シーンなどを読み直さない
+        with CaptureQueriesContext(connection) as context:
+            cached = self.client.get(url)
+        self.assertFalse(any('rehearsal_scene' in query['sql']
+            for query in context.captured_queries))
+        self.assertEqual(self.slots(cached.context['rhsl_plans']),
+            self.slots(response.context['rhsl_plans']))
+    
+    def test_invalid_unit(self):
+        self.client.force_login(self.user)
+        url = '/rhsl/rhsl_plan/{}/'.format(self.prod.id)
+        for unit in ['nan', 'inf', '-inf', 'abc']:
+            response = self.client.get(url, {'unit': unit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['unit_minutes'], 1)
+
+
+class BenchmarkTest(TestCase):
+    '''計測スイートが全てのビューを計測できることのテスト
+    '''
+    
+    def test_run_benchmarks(self):
+        sizes = {'tiny': {'actors': 3, 'roles': 4, 'scenes': 3,
+            'rehearsals': 2}}
+        report = run_benchmarks(sizes=sizes, repeat=2)
+        self.assertEqual(len(report['sizes']), 1)
+        views = report['sizes'][0]['views']
+        for view_name in ['RhslPossibility', 'AtndGraph', 'AtndTable',
+                'ApprTable', 'RhslAbsence', 'ActrDetail']:
+            self.assertIn(view_name, views)
+            self.assertGreater(views[view_name]['warm_queries'], 0)
+        # 計測に使った公演は残らない
+        self.assertFalse(Production.objects.filter(
+            name__startswith='bench-').exists())
@@ -172,6 +172,16 @@ urlpatterns = [
     path('atnd_table/<int:prod_id>/', views.AtndTable.as_view(),
         name='atnd_table'),
 
+    # 出欠の一括入力
+
+    # /rhsl/atnd_grid/1/ -> Attendance grid editor for Production #1
+    path('atnd_grid/<int:prod_id>/', views.AtndGrid.as_view(),
+        name='atnd_grid'),
+
+    # /rhsl/atnd_grid_data/1/ -> Attendance grid data (JSON) for Production #1
+    path('atnd_grid_data/<int:prod_id>/', views.AtndGridData.as_view(),
+        name='atnd_grid_data'),
+
     # 出席率グラフ (稽古ごとの出席率)
 
     # /rhsl/atnd_graph/1/ -> Attendance graph for Rehearsal #1
@@ -184,6 +194,17 @@ urlpatterns = [
     path('rhsl_psblty/<int:prod_id>/', views.RhslPossibility.as_view(),
         name='rhsl_psblty'),
 
+    # /rhsl/rhsl_psblty_data/1/?from=2024-01-01&to=2024-01-14
+    #   -> Rehearsal possibility data (JSON) for Production #1
+    path('rhsl_psblty_data/<int:prod_id>/',
+        views.RhslPossibilityData.as_view(), name='rhsl_psblty_data'),
+
+    # 稽古プランの提案
+
+    # /rhsl/rhsl_plan/1/ -> Rehearsal plan for Production #1
+    path('rhsl_plan/<int:prod_id>/', views.RhslPlan.as_view(),
+        name='rhsl_plan'),
+
     # ----------------------------------------------------------------
     # 出欠変更履歴
 
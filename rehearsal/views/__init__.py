@@ -1,5 +1,7 @@
 from .views import *
 from .appr_table import *
 from .atnd_table import *
+from .atnd_grid import *
 from .atnd_graph import *
 from .rhsl_psblty import *
+from .rhsl_plan import *
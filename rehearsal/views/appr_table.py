@@ -1,8 +1,10 @@
 import json
+import numpy as np
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView
 from django.core.exceptions import PermissionDenied
-from rehearsal.models import Scene, Character, Actor, Appearance
+from rehearsal.snapshot_func import production_snapshot
+from rehearsal.cache_func import versioned_payload, conditional_get
 from production.view_func import *
 
 
@@ -19,7 +21,9 @@ class ApprTable(LoginRequiredMixin, TemplateView):
         if not prod_user:
             raise PermissionDenied
         
-        return super().get(request, *args, **kwargs)
+        # 公演のデータが変わっていなければ 304 を返す
+        return conditional_get(self, self.kwargs['prod_id'], super().get,
+            *args, **kwargs)
     
     def get_context_data(self, **kwargs):
         '''テンプレートに渡すパラメタを改変する
@@ -30,74 +34,43 @@ class ApprTable(LoginRequiredMixin, TemplateView):
         prod_id = self.kwargs['prod_id']
         context['prod_id'] = prod_id
         
-        # シーン名リスト
-        scenes = Scene.objects.filter(production__pk=prod_id)
-        context['scenes'] = json.dumps([scn.name for scn in scenes])
+        # 表のデータは公演のデータの版ごとにキャッシュする
+        context.update(versioned_payload('appr_table', prod_id,
+            lambda: self.build_table_data(prod_id)))
         
-        # 登場人物名リスト
-        characters = Character.objects.filter(production__pk=prod_id)
-        context['characters'] = json.dumps([chr.get_short_name() for chr in characters])
+        return context
+    
+    def build_table_data(self, prod_id):
+        '''香盤表のデータ (JSON 文字列の dict) を作る
+        '''
+        context = {}
         
-        # 役者名リスト
-        actors = Actor.objects.filter(production__pk=prod_id)
-        context['cast'] = json.dumps([actr.get_short_name() for actr in actors])
+        # 公演のデータをまとめて読み込んだもの
+        snapshot = production_snapshot(self.request, prod_id)
         
-        # 各シーンの登場人物ごとの出番 (セリフ数) のリスト
-        appearances = Appearance.objects.filter(scene__production__pk=prod_id)
-        scenes_chr_apprs = []
-        for scene in scenes:
-            # シーン単品での出番のリスト
-            scene_apprs = [appr for appr in appearances if appr.scene == scene]
-            # 有効なセリフ数の平均値
-            avrg_lines_num = Appearance.average_lines_num(scene_apprs)
-            # そのシーンの、登場人物全員分のセリフ数のリスト
-            chr_apprs = []
-            for character in characters:
-                apprs = [appr for appr in scene_apprs if appr.character == character]
-                if len(apprs) > 0:
-                    # セリフ数 (自動なら平均値)
-                    chr_apprs.append(
-                        avrg_lines_num if apprs[0].lines_auto else apprs[0].lines_num)
-                else:
-                    # 出番がないなら -1 を入れる
-                    chr_apprs.append(-1)
-            scenes_chr_apprs.append(chr_apprs)
+        # シーン名リスト
+        context['scenes'] = json.dumps([scn.name for scn in snapshot.scenes])
         
-        context['chr_apprs'] = json.dumps(scenes_chr_apprs)
+        # 登場人物名リスト
+        context['characters'] = json.dumps(
+            [chr.get_short_name() for chr in snapshot.characters])
         
-        # 各シーンの役者の出番 (セリフ数) のリスト
-        cast_for_chrs = []
-        # まず、各登場人物の配役が actors の何番目にあるかのリストを作る
-        for character in characters:
-            if character.cast in actors:
-                actr_idx = list(actors).index(character.cast)
-            else:
-                # 配役がなければ -1
-                actr_idx = -1
-            cast_for_chrs.append(actr_idx)
+        # 役者名リスト (登録順)
+        actr_order = sorted(range(len(snapshot.actors)),
+            key=lambda a: snapshot.actors[a].id)
+        context['cast'] = json.dumps(
+            [snapshot.actors[a].get_short_name() for a in actr_order])
         
-        scenes_cast_apprs = []
-        # シーンごとに見ていく
-        for chr_apprs in scenes_chr_apprs:
-            actr_apprs = []
-            # 役者ごとに演じる人物のセリフ数を足していく
-            for actr_idx, actr in enumerate(actors):
-                lines_num = 0
-                appearing = False
-                # 登場人物ごとにキャストのインデックスを見ていく
-                for chr_idx, cast in enumerate(cast_for_chrs):
-                    # インデックスが外側のループと等しければ、そのセリフ数を足す
-                    if cast == actr_idx:
-                        if chr_apprs[chr_idx] >= 0:
-                            lines_num += chr_apprs[chr_idx]
-                            appearing = True
-                if appearing:
-                    actr_apprs.append(lines_num)
-                # その役者の出番がなかったら、-1 を入れる
-                else:
-                    actr_apprs.append(-1)
-            scenes_cast_apprs.append(actr_apprs)
+        # 各シーンの登場人物ごとの出番 (セリフ数) の行列
+        # (自動なら平均値、出番がないなら -1)
+        chr_apprs = np.where(snapshot.appr, snapshot.lines, -1)
+        context['chr_apprs'] = json.dumps(chr_apprs.tolist())
         
-        context['cast_apprs'] = json.dumps(scenes_cast_apprs)
+        # 各シーンの役者の出番 (役者が演じる登場人物のセリフ数の合計) の行列
+        # (その役者の出番がなかったら -1)
+        cast = snapshot.cast_matrix()[:, actr_order]
+        cast_apprs = np.where(snapshot.appr @ cast > 0,
+            snapshot.lines @ cast, -1)
+        context['cast_apprs'] = json.dumps(cast_apprs.tolist())
         
         return context
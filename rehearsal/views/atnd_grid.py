@@ -0,0 +1,126 @@
+import json
+from collections import defaultdict
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.views.generic import TemplateView, View
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import JsonResponse
+from rehearsal.atnd_func import atnd_cell_strings, save_attendance_grid
+from rehearsal.snapshot_func import production_snapshot
+from rehearsal.cache_func import conditional_get
+from production.view_func import *
+
+
+class AtndGrid(LoginRequiredMixin, TemplateView):
+    '''役者×稽古の参加時間をまとめて編集するビュー
+    
+    データは AtndGridData から読み込み、変更したセルをまとめて保存する
+    '''
+    template_name = 'rehearsal/attendance_grid.html'
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けたハンドラ
+        '''
+        # アクセス情報から公演ユーザを取得しアクセス権を検査する
+        prod_user = accessing_prod_user(self)
+        if not prod_user:
+            raise PermissionDenied
+        
+        return super().get(request, *args, **kwargs)
+    
+    def get_context_data(self, **kwargs):
+        '''テンプレートに渡すパラメタを改変する
+        '''
+        context = super().get_context_data(**kwargs)
+        
+        # 戻るボタン用に、prod_id を渡す
+        context['prod_id'] = self.kwargs['prod_id']
+        
+        return context
+
+
+class AtndGridData(LoginRequiredMixin, View):
+    '''役者×稽古の参加時間の JSON のビュー
+    
+    GET で全てのセルを返し、POST で指定したセルをまとめて置き換える
+    
+    POST の本体 (JSON)
+    ----------
+    cells : list of dict
+        [{'actor': 役者の id, 'rehearsal': 稽古の id,
+            'atnds': ['*'|'-'|'HH:MM-HH:MM', ...]}]
+    '''
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けたハンドラ
+        '''
+        # アクセス情報から公演ユーザを取得しアクセス権を検査する
+        prod_user = accessing_prod_user(self)
+        if not prod_user:
+            raise PermissionDenied
+        
+        # 公演のデータが変わっていなければ 304 を返す
+        return conditional_get(self, self.kwargs['prod_id'], self.get_data,
+            *args, **kwargs)
+    
+    def get_data(self, request, *args, **kwargs):
+        '''参加時間のデータの JSON を返す
+        '''
+        prod_id = self.kwargs['prod_id']
+        prod_user = accessing_prod_user(self)
+        can_edit_all = prod_user.is_owner or prod_user.is_editor
+        
+        # 公演のデータをまとめて読み込んだもの
+        snapshot = production_snapshot(request, prod_id)
+        
+        # (役者 id, 稽古 id) ごとの表示用の文字列
+        cells = defaultdict(list)
+        for rhsl_id, rows in snapshot.rhsl_rows.items():
+            for row in rows:
+                cells[(row[0], rhsl_id)].append(row[1:])
+        
+        return JsonResponse({
+            'rhsls': [{
+                'id': rhsl.id,
+                'place': str(rhsl.place),
+                'date': rhsl.date.strftime('%Y-%m-%d'),
+                'start_time': rhsl.start_time.strftime('%H:%M'),
+                'end_time': rhsl.end_time.strftime('%H:%M')
+            } for rhsl in snapshot.rehearsals],
+            'actrs': [{
+                'id': actr.id,
+                'name': actr.name,
+                'short_name': actr.get_short_name(),
+                # 所有権も編集権もなければ、自分の役者だけ編集できる
+                'editable': can_edit_all or actr.prod_user_id == prod_user.id
+            } for actr in snapshot.actors],
+            # 役者ごとの、稽古リストに対応する参加時間のリスト
+            'actr_atnds': [[atnd_cell_strings(cells.get((actr.id, rhsl.id), []))
+                for rhsl in snapshot.rehearsals] for actr in snapshot.actors],
+        })
+    
+    def post(self, request, *args, **kwargs):
+        '''変更したセルを受けて、まとめて保存するハンドラ
+        '''
+        # アクセス情報から公演ユーザを取得しアクセス権を検査する
+        prod_user = accessing_prod_user(self)
+        if not prod_user:
+            raise PermissionDenied
+        
+        try:
+            cells = json.loads(request.body)['cells']
+            if not isinstance(cells, list)\
+                    or not all(isinstance(cell, dict) for cell in cells):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'errors': ['データの形式が不正です。']},
+                status=400)
+        
+        # 全てのセルを検査し、1つのトランザクションで保存する
+        try:
+            counts = save_attendance_grid(prod_user, cells)
+        except PermissionError:
+            raise PermissionDenied
+        except ValidationError as e:
+            return JsonResponse({'errors': e.messages}, status=400)
+        
+        return JsonResponse(counts)
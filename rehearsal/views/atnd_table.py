@@ -1,9 +1,12 @@
 import json
-from operator import attrgetter
+from collections import defaultdict
+import numpy as np
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView
 from django.core.exceptions import PermissionDenied
-from rehearsal.models import Rehearsal, Actor, Attendance, Character, Scene, Appearance
+from rehearsal.cache_func import versioned_payload, conditional_get
+from rehearsal.snapshot_func import production_snapshot
+from rehearsal.atnd_func import atnd_cell_strings
 from production.view_func import *
 
 
@@ -20,7 +23,9 @@ class AtndTable(LoginRequiredMixin, TemplateView):
         if not prod_user:
             raise PermissionDenied
         
-        return super().get(request, *args, **kwargs)
+        # 公演のデータが変わっていなければ 304 を返す
+        return conditional_get(self, self.kwargs['prod_id'], super().get,
+            *args, **kwargs)
     
     def get_context_data(self, **kwargs):
         '''テンプレートに渡すパラメタを改変する
@@ -31,99 +36,76 @@ class AtndTable(LoginRequiredMixin, TemplateView):
         prod_id = self.kwargs['prod_id']
         context['prod_id'] = prod_id
         
+        # 表のデータは公演のデータの版ごとにキャッシュする
+        context.update(versioned_payload('atnd_table', prod_id,
+            lambda: self.build_table_data(prod_id)))
+        
+        return context
+    
+    def build_table_data(self, prod_id):
+        '''出欠表のデータ (JSON 文字列の dict) を作る
+        '''
+        context = {}
+        
+        # 公演のデータをまとめて読み込んだもの
+        snapshot = production_snapshot(self.request, prod_id)
+        
         # 稽古リスト
-        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)
         rhsl_list = [{
             'id': rhsl.id,
             'place': str(rhsl.place),
             'date': rhsl.date.strftime('%Y-%m-%d'),
             'start_time': rhsl.start_time.strftime('%H:%M'),
             'end_time': rhsl.end_time.strftime('%H:%M')
-        } for rhsl in rehearsals]
+        } for rhsl in snapshot.rehearsals]
         context['rhsls'] = json.dumps(rhsl_list)
         
-        # 役者リスト
-        actr_list = list(
-            Actor.objects.filter(production__pk=prod_id).order_by('name'))
-
+        # 役者リスト (名前の順)
         actrs = [{
             'name': actr.name,
             'short_name': actr.get_short_name()
-        } for actr in actr_list]
+        } for actr in snapshot.actors]
         
         context['actrs'] = json.dumps(actrs)
         
+        # 稽古ごとの参加時間を、(役者 id, 稽古 id) ごとの
+        # 開始時刻の順の表示用の文字列にする
+        actr_rhsl_atnds = {}
+        for rhsl in snapshot.rehearsals:
+            actr_rows = defaultdict(list)
+            for row in snapshot.rhsl_rows.get(rhsl.id, []):
+                actr_rows[row[0]].append(row[1:])
+            for actr_id, rows in actr_rows.items():
+                actr_rhsl_atnds[(actr_id, rhsl.id)] = atnd_cell_strings(rows)
+        
         # 役者ごとの出欠の、稽古リストに対応するリスト (3次元配列)
-        attendances = Attendance.objects.filter(actor__production__pk=prod_id)
-        actrs_rhsl_atnds = []
-        for actor in actr_list:
-            # その役者の出欠
-            actor_atnds = [atnd for atnd in attendances if atnd.actor == actor]
-            rhsl_attnds = []
-            for rehearsal in rehearsals:
-                # その稽古の出欠
-                slots = sorted(
-                    [atnd for atnd in actor_atnds if atnd.rehearsal == rehearsal],
-                    key=attrgetter('from_time')
-                )
-                atnds = []
-                for slot in slots:
-                    atnds.append(
-                        # 全日の場合
-                        '*' if slot.is_allday
-                        # 欠席の場合
-                        else '-' if slot.is_absent
-                        # さもなくば時間帯
-                        else slot.from_time.strftime('%H:%M') + '-'
-                            + slot.to_time.strftime('%H:%M')
-                    )
-                rhsl_attnds.append(atnds)
-            actrs_rhsl_atnds.append(rhsl_attnds)
+        actrs_rhsl_atnds = [[actr_rhsl_atnds.get((actor.id, rehearsal.id), [])
+            for rehearsal in snapshot.rehearsals] for actor in snapshot.actors]
         
         context['actr_atnds'] = json.dumps(actrs_rhsl_atnds)
         
         # 登場人物のリスト
-        characters = Character.objects.filter(production__pk=prod_id)
         chrs = []
-        for character in characters:
-            # 配役が actr_list の何番目かを取得
-            if character.cast in actr_list:
-                actr_idx = actr_list.index(character.cast)
-            else:
-                # 配役がなければ -1
-                actr_idx = -1
+        for chr_idx, character in enumerate(snapshot.characters):
             chrs.append({
                 'name': character.name,
                 'short_name': character.short_name,
-                'cast_idx': actr_idx
+                # 配役が役者リストの何番目か (配役がなければ -1)
+                'cast_idx': int(snapshot.chr_cast[chr_idx])
             })
         
         context['chrs'] = json.dumps(chrs)
         
         # シーン名リスト
-        scenes = Scene.objects.filter(production__pk=prod_id)
-        context['scenes'] = json.dumps([scn.name for scn in scenes])
-
-        # シーンごとの登場人物とセリフ数のリスト
-        appearances = Appearance.objects.filter(scene__production__pk=prod_id)
-        scenes_chr_apprs = []
-        for scene in scenes:
-            # シーン単品での出番のリスト
-            scene_apprs = [appr for appr in appearances if appr.scene == scene]
-            # 有効なセリフ数の平均値
-            avrg_lines_mun = Appearance.average_lines_num(scene_apprs)
-            # そのシーンに出ている人物のセリフ数のリスト
-            chr_apprs = []
-            for chr_idx, character in enumerate(characters):
-                apprs = [appr for appr in scene_apprs if appr.character == character]
-                if len(apprs) > 0:
-                    # セリフ数 (自動なら平均値)
-                    lines_num = avrg_lines_mun if apprs[0].lines_auto else apprs[0].lines_num
-                    chr_apprs.append({
-                        'chr_idx': chr_idx,
-                        'lines_num': lines_num
-                    })
-            scenes_chr_apprs.append(chr_apprs)
+        context['scenes'] = json.dumps([scn.name for scn in snapshot.scenes])
+        
+        # シーンごとの、出ている登場人物とセリフ数 (自動なら平均値) のリスト
+        # (登場人物の順)
+        scenes_chr_apprs = [[{
+            'chr_idx': int(chr_idx),
+            'lines_num': float(snapshot.lines[scn_idx, chr_idx])
+        } for chr_idx in np.flatnonzero(snapshot.appr[scn_idx])]
+            for scn_idx in range(len(snapshot.scenes))]
         
         context['scenes_chr_apprs'] = json.dumps(scenes_chr_apprs)
         
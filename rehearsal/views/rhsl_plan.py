@@ -0,0 +1,54 @@
+import math
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils import timezone
+from django.views.generic import TemplateView
+from django.core.exceptions import PermissionDenied
+from rehearsal.plan_func import plan_for_production
+from rehearsal.cache_func import versioned_payload, conditional_get
+from production.view_func import *
+
+
+class RhslPlan(LoginRequiredMixin, TemplateView):
+    '''稽古プラン提案のビュー
+    '''
+    template_name = 'rehearsal/rehearsal_plan.html'
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けたハンドラ
+        '''
+        # アクセス情報から公演ユーザを取得しアクセス権を検査する
+        prod_user = accessing_prod_user(self)
+        if not prod_user:
+            raise PermissionDenied
+        
+        # 公演のデータが変わっていなければ 304 を返す
+        return conditional_get(self, self.kwargs['prod_id'], super().get,
+            *args, **kwargs)
+    
+    def get_context_data(self, **kwargs):
+        '''テンプレートに渡すパラメタを改変する
+        '''
+        context = super().get_context_data(**kwargs)
+        
+        # 戻るボタン用に、prod_id を渡す
+        prod_id = self.kwargs['prod_id']
+        context['prod_id'] = prod_id
+        
+        # シーンの長さ 1 あたりの稽古時間 (分)
+        try:
+            unit_minutes = float(self.request.GET.get('unit', 1))
+        except ValueError:
+            unit_minutes = 1
+        # nan や inf は float() で読めてしまうので、既定値にする
+        if not math.isfinite(unit_minutes):
+            unit_minutes = 1
+        unit_minutes = min(max(unit_minutes, 0.1), 60)
+        context['unit_minutes'] = unit_minutes
+        
+        # 今日以降の稽古について、プランを提案する
+        # (公演のデータの版と、パラメタ、今日の日付ごとにキャッシュする)
+        name = 'rhsl_plan:{}:{}'.format(unit_minutes, timezone.localdate())
+        context['rhsl_plans'] = versioned_payload(name, prod_id,
+            lambda: plan_for_production(prod_id, unit_minutes=unit_minutes))
+        
+        return context
@@ -1,14 +1,24 @@
-import json
+import datetime
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import TemplateView
+from django.views.generic import TemplateView, View
 from django.core.exceptions import PermissionDenied
-from rehearsal.models import Rehearsal, Actor, Attendance, Character, Scene, Appearance
-from rehearsal.model_func import *
+from django.http import JsonResponse
+from django.utils.dateparse import parse_date
+from rehearsal.psblty_func import stored_possibility
+from rehearsal.snapshot_func import production_snapshot
+from rehearsal.cache_func import versioned_payload, conditional_get
 from production.view_func import *
 
 
+# 稽古可能性データを一度に返す期間の既定値と上限 (日)
+PSBLTY_WINDOW_DAYS = 14
+PSBLTY_MAX_DAYS = 92
+
+
 class RhslPossibility(LoginRequiredMixin, TemplateView):
     '''稽古可能性のビュー
+    
+    データは RhslPossibilityData から期間ごとに読み込む
     '''
     template_name = 'rehearsal/rehearsal_possibility.html'
     
@@ -20,7 +30,9 @@ class RhslPossibility(LoginRequiredMixin, TemplateView):
         if not prod_user:
             raise PermissionDenied
         
-        return super().get(request, *args, **kwargs)
+        # 公演のデータが変わっていなければ 304 を返す
+        return conditional_get(self, self.kwargs['prod_id'], super().get,
+            *args, **kwargs)
     
     def get_context_data(self, **kwargs):
         '''テンプレートに渡すパラメタを改変する
@@ -31,171 +43,136 @@ class RhslPossibility(LoginRequiredMixin, TemplateView):
         prod_id = self.kwargs['prod_id']
         context['prod_id'] = prod_id
         
-        # 稽古リストを渡す
-        rehearsals = Rehearsal.objects.filter(production__pk=prod_id)
-        rhsl_list = [{
-            'id': rhsl.id,
-            'place': str(rhsl.place),
-            'date': rhsl.date.strftime('%Y-%m-%d'),
-            'start_time': rhsl.start_time.strftime('%H:%M'),
-            'end_time': rhsl.end_time.strftime('%H:%M')
-        } for rhsl in rehearsals]
-        context['rhsls'] = json.dumps(rhsl_list)
+        # 一度に読み込む期間
+        context['window_days'] = PSBLTY_WINDOW_DAYS
+        
+        return context
+
+
+class RhslPossibilityData(LoginRequiredMixin, View):
+    '''期間を指定して稽古可能性のデータを返す JSON のビュー
+    
+    GET パラメタ
+    ----------
+    from, to : YYYY-MM-DD
+        稽古の期間 (片方だけなら days 日分、両方省略なら今日から)
+    days : int
+        期間の日数 (既定値 PSBLTY_WINDOW_DAYS)
+    scns : カンマ区切りの id
+        対象のシーン (省略時は全シーン)
+    '''
+    
+    def get(self, request, *args, **kwargs):
+        '''表示時のリクエストを受けたハンドラ
+        '''
+        # アクセス情報から公演ユーザを取得しアクセス権を検査する
+        prod_user = accessing_prod_user(self)
+        if not prod_user:
+            raise PermissionDenied
+        
+        # 公演のデータが変わっていなければ 304 を返す
+        return conditional_get(self, self.kwargs['prod_id'], self.get_data,
+            *args, **kwargs)
+    
+    def get_data(self, request, *args, **kwargs):
+        '''稽古可能性のデータの JSON を返す
+        '''
+        prod_id = self.kwargs['prod_id']
         
-        # シーンリストを渡す
-        scenes = Scene.objects.filter(production__pk=prod_id)
-        scn_list = [{
-            'id': scn.id,
-            'name': scn.name,
-            'length': scn.length
-        } for scn in scenes]
-        context['scns'] = json.dumps(scn_list)
+        # 期間と対象のシーンを決める
+        try:
+            date_from, date_to = self.get_period()
+            scn_ids = [int(scn_id) for scn_id
+                in request.GET.get('scns', '').split(',') if scn_id]
+        except ValueError:
+            return JsonResponse({'error': 'invalid parameter'}, status=400)
         
-        # 役者
-        actors = Actor.objects.filter(production__pk=prod_id)
+        # データは期間と対象のシーンごとに、公演のデータの版ごとにキャッシュする
+        name = 'psblty_data:{}:{}:{}'.format(date_from, date_to,
+            ','.join(str(scn_id) for scn_id in sorted(set(scn_ids))))
+        return JsonResponse(versioned_payload(name, prod_id,
+            lambda: self.build_data(prod_id, date_from, date_to, scn_ids)))
+    
+    def build_data(self, prod_id, date_from, date_to, scn_ids):
+        '''期間と対象のシーンを指定して、稽古可能性のデータを作る
+        '''
+        # 公演のデータをまとめて読み込んだもの
+        snapshot = production_snapshot(self.request, prod_id)
         
-        # 時間スロットを得る
-        rhsls_scns_slots = []
-        for rhsl in rehearsals:
-            scns_slots = time_slots_for_rehearsal(rhsl, actors=actors, scenes=scenes)
-            rhsls_scns_slots.append({
-                'rehearsal': rhsl,
-                'scns_slots': scns_slots
-            })
+        # 期間内の稽古と、対象のシーン
+        rehearsals = [rhsl for rhsl in snapshot.rehearsals
+            if date_from <= rhsl.date <= date_to]
+        scenes = snapshot.scenes
+        if scn_ids:
+            scn_ids = set(scn_ids)
+            scenes = [scn for scn in scenes if scn.id in scn_ids]
         
-        # トータルの稽古時間（未使用）
-        # total_rhsl_time = 0
-        # for rhsl in rehearsals:
-        #     start_time = rhsl.start_time.hour * 60 + rhsl.start_time.minute
-        #     end_time = rhsl.end_time.hour * 60 + rhsl.end_time.minute
-        #     total_rhsl_time += end_time - start_time
+        # 前後の期間に稽古があれば、その日付を渡す (空いた期間は飛ばす)
+        prev_dates = [rhsl.date for rhsl in snapshot.rehearsals
+            if rhsl.date < date_from]
+        next_dates = [rhsl.date for rhsl in snapshot.rehearsals
+            if rhsl.date > date_to]
         
-        # 登場人物ベースの稽古可能性データ
-        psblty_in_chrs = []
-        # 稽古ごと
-        for rhsl_slots in rhsls_scns_slots:
-            rhsl = rhsl_slots['rehearsal']
-            
-            scn_psblty = []
-            # シーンごと
-            for slots in rhsl_slots['scns_slots']:
-                
-                # シーンの登場人物数 (= 出番データの数)
-                chrs_num = Appearance.objects.filter(scene=slots['scene']).count()
-                
-                # シーンの長さ
-                # TODO: length_auto に対応すること
-                scn_len = slots['scene'].length
-                
-                psblty = 0
-                # スロットごとの「可能性の指標」を加算していく
-                for slot in slots['time_slots']:
-                    # 時間
-                    from_time = slot['from_time'].hour * 60 + slot['from_time'].minute
-                    to_time = slot['to_time'].hour * 60 + slot['to_time'].minute
-                    slot_time = to_time - from_time
-                    # 出席者の役数の合計
-                    atnd_chrs_lists = [atnd['appearances'] for atnd in slot['attendee']]
-                    atnd_chrs_num = 0
-                    for chrs_list in atnd_chrs_lists:
-                        atnd_chrs_num += len(chrs_list)
-                    
-                    # 可能性の指標 = 時間 * 出席する役者の役の数 / シーンの登場人物数 / シーンの長さ
-                    psblty += slot_time * atnd_chrs_num / chrs_num / scn_len
-                    
-                    # print('possibility: {} x {} / {} = {}'.format(
-                    #     slot_time, atnd_chrs_num, chrs_num,
-                    #     slot_time * atnd_chrs_num / chrs_num))
-                
-                scn_psblty.append(psblty)
-            psblty_in_chrs.append(scn_psblty)
-        context['psblty_in_chrs'] = json.dumps(psblty_in_chrs)
+        # 稽古×シーンの稽古可能性を、3つの指標について読み込む
+        # (保存済みでなければ、この範囲だけ計算して保存する)
+        psblty = stored_possibility(prod_id, rehearsals=rehearsals,
+            scenes=scenes, snapshot=snapshot)
         
-        # 役者ベースの稽古可能性データ
-        psblty_in_actrs = []
-        # 稽古ごと
-        for rhsl_slots in rhsls_scns_slots:
-            rhsl = rhsl_slots['rehearsal']
-            
-            scn_psblty = []
-            # シーンごと
-            for slots in rhsl_slots['scns_slots']:
-                
-                # シーンの役者数
-                scn_apprs = Appearance.objects.filter(scene=slots['scene'])
-                scn_actrs = [appr.character.cast for appr in scn_apprs]
-                actrs_num = len(list(set(scn_actrs)))
-                
-                # シーンの長さ
-                # TODO: length_auto に対応すること
-                scn_len = slots['scene'].length
-                
-                psblty = 0
-                # スロットごとの「可能性の指標」を加算していく
-                for slot in slots['time_slots']:
-                    # 時間
-                    from_time = slot['from_time'].hour * 60 + slot['from_time'].minute
-                    to_time = slot['to_time'].hour * 60 + slot['to_time'].minute
-                    slot_time = to_time - from_time
-                    
-                    # 可能性の指標 = 時間 * 出席する役者の役の数 / シーンに出ている役者の数 / シーンの長さ
-                    psblty += slot_time * len(slot['attendee']) / actrs_num / scn_len
-                    
-                    # print('possibility: {} x {} / {} = {}'.format(
-                    #     slot_time, len(slot['attendee']), actrs_num,
-                    #     slot_time * len(slot['attendee']) / actrs_num))
-                
-                scn_psblty.append(psblty)
-            psblty_in_actrs.append(scn_psblty)
-        context['psblty_in_actrs'] = json.dumps(psblty_in_actrs)
+        return {
+            'from': date_from.strftime('%Y-%m-%d'),
+            'to': date_to.strftime('%Y-%m-%d'),
+            'prev_to': max(prev_dates).strftime('%Y-%m-%d')
+                if prev_dates else None,
+            'next_from': min(next_dates).strftime('%Y-%m-%d')
+                if next_dates else None,
+            'rhsls': [{
+                'id': rhsl.id,
+                'place': str(rhsl.place),
+                'date': rhsl.date.strftime('%Y-%m-%d'),
+                'start_time': rhsl.start_time.strftime('%H:%M'),
+                'end_time': rhsl.end_time.strftime('%H:%M')
+            } for rhsl in rehearsals],
+            'scns': [{
+                'id': scn.id,
+                'name': scn.name,
+                'length': scn.length
+            } for scn in scenes],
+            # 表示は小数点以下2桁なので、3桁に丸めてデータ量を減らす
+            'psblty_in_chrs': psblty['chrs'].round(3).tolist(),
+            'psblty_in_actrs': psblty['actrs'].round(3).tolist(),
+            'psblty_in_lines': psblty['lines'].round(3).tolist(),
+        }
+    
+    def get_period(self):
+        '''GET パラメタから期間 (date_from, date_to) を決める
+        '''
+        days = int(self.request.GET.get('days', PSBLTY_WINDOW_DAYS))
+        days = min(max(days, 1), PSBLTY_MAX_DAYS)
         
-        # セリフ数ベースの稽古可能性データ
-        psblty_in_lines = []
-        # 稽古ごと
-        for rhsl_slots in rhsls_scns_slots:
-            rhsl = rhsl_slots['rehearsal']
-            
-            scn_psblty = []
-            # シーンごと
-            for slots in rhsl_slots['scns_slots']:
-                
-                # シーンのセリフ数
-                scn_apprs = Appearance.objects.filter(scene=slots['scene'])
-                average_lines_num = Appearance.average_lines_num(scn_apprs)
-                scn_lines = [average_lines_num if appr.lines_auto
-                                else appr.lines_num
-                    for appr in scn_apprs]
-                lines_num = sum(scn_lines)
-                
-                # シーンの長さ
-                # TODO: length_auto に対応すること
-                scn_len = slots['scene'].length
-                
-                psblty = 0
-                # スロットごとの「可能性の指標」を加算していく
-                for slot in slots['time_slots']:
-                    # 時間
-                    from_time = slot['from_time'].hour * 60 + slot['from_time'].minute
-                    to_time = slot['to_time'].hour * 60 + slot['to_time'].minute
-                    slot_time = to_time - from_time
-                    # 出席者のセリフ数の合計
-                    atnd_chrs_lists = [atnd['appearances'] for atnd in slot['attendee']]
-                    atnd_lines_num = 0
-                    for chrs_list in atnd_chrs_lists:
-                        chr_lines_num = 0
-                        for chr in chrs_list:
-                            chr_lines_num += chr['lines_num']
-                        atnd_lines_num += chr_lines_num
-                    
-                    # 可能性の指標 = 時間 * 出席する役者のセリフ数 / シーンのセリフ数 / シーンの長さ
-                    psblty += slot_time * atnd_lines_num / lines_num / scn_len
-                    
-                    # print('possibility: {} x {} / {} = {}'.format(
-                    #     slot_time, atnd_lines_num, lines_num,
-                    #     slot_time * atnd_lines_num / lines_num))
-                
-                scn_psblty.append(psblty)
-            psblty_in_lines.append(scn_psblty)
-        context['psblty_in_lines'] = json.dumps(psblty_in_lines)
+        date_from = self.parse_date_param('from')
+        date_to = self.parse_date_param('to')
+        if date_from is None and date_to is None:
+            date_from = datetime.date.today()
         
-        return context
+        span = datetime.timedelta(days=days - 1)
+        if not date_from:
+            date_from = date_to - span
+        if not date_to:
+            date_to = date_from + span
+        # 長すぎる期間は切り詰める
+        max_span = datetime.timedelta(days=PSBLTY_MAX_DAYS - 1)
+        date_to = min(date_to, date_from + max_span)
+        if date_to < date_from:
+            raise ValueError
+        return date_from, date_to
+    
+    def parse_date_param(self, name):
+        '''日付の GET パラメタを読む (省略時は None、不正なら ValueError)
+        '''
+        value = self.request.GET.get(name)
+        if not value:
+            return None
+        date = parse_date(value)
+        if date is None:
+            raise ValueError
+        return date
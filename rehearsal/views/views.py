@@ -1,23 +1,36 @@
-from operator import attrgetter
 from django.views.generic import ListView, TemplateView, DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.http import Http404
+from django.db import models
+from django.http import Http404, JsonResponse
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, BadRequest
 from django.shortcuts import get_object_or_404
 from production.models import Production
 from rehearsal.models import Rehearsal, Scene, Place, Facility, Character,\
     Actor, Appearance, ScnComment, Attendance, AtndChangeLog
 from rehearsal.forms import RhslForm, ChrForm, ActrForm, ScnApprForm,\
     ChrApprForm, AtndForm
+from rehearsal.snapshot_func import production_snapshot
+from rehearsal.cache_func import conditional_get
+from rehearsal.keyset_func import keyset_page
 from production.view_func import *
 
 
 class ProdBaseListView(LoginRequiredMixin, ListView):
     """アクセス権を検査する ListView の Base class
+    
+    keyset_ordering を指定すると、その並び順で keyset_page_size 件ずつ
+    表示する (GET パラメタ after に前のページの next_cursor を渡す)
+    GET パラメタ format=json なら、同じページを json_fields の JSON で返す
     """
+    # ページ分けする時の並び順のキー (最後のキーで一意に決まること)
+    keyset_ordering = None
+    keyset_page_size = 100
+    # JSON で返す属性
+    json_fields = ('id',)
+    
     def get(self, request, *args, **kwargs):
         """表示時のリクエストを受けるハンドラ
         """
@@ -35,12 +48,50 @@ class ProdBaseListView(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         """テンプレートに渡すパラメタを改変する
         """
+        # カーソルの次から1ページ分だけ読み込む
+        self.next_cursor = None
+        if self.keyset_ordering:
+            try:
+                kwargs['object_list'], self.next_cursor = keyset_page(
+                    self.object_list, self.keyset_ordering,
+                    self.request.GET.get('after'), self.keyset_page_size)
+            except ValueError:
+                raise BadRequest
+        
         context = super().get_context_data(**kwargs)
         
         # 戻るボタン, 追加ボタン用の prod_id をセット
         context['prod_id'] = self.kwargs['prod_id']
         
+        # 次のページと、最初のページへのリンク用
+        context['next_cursor'] = self.next_cursor
+        context['is_first_page'] = not self.request.GET.get('after')
+        
         return context
+    
+    def render_to_response(self, context, **response_kwargs):
+        """format=json なら、ページの内容を JSON で返す
+        """
+        if self.request.GET.get('format') != 'json':
+            return super().render_to_response(context, **response_kwargs)
+        
+        return JsonResponse({
+            'objects': [self.get_json_item(item)
+                for item in context['object_list']],
+            'next_cursor': self.next_cursor,
+        })
+    
+    def get_json_item(self, item):
+        """JSON で返す1件分の dict を作る
+        """
+        json_item = {}
+        for name in self.json_fields:
+            value = getattr(item, name)
+            # 関連先のオブジェクトは文字列にする
+            if isinstance(value, models.Model):
+                value = str(value)
+            json_item[name] = value
+        return json_item
 
 
 class ProdBaseCreateView(LoginRequiredMixin, CreateView):
@@ -201,12 +252,15 @@ class RhslList(ProdBaseListView):
     Template 名: rehearsal_list (default)
     """
     model = Rehearsal
+    keyset_ordering = ('date', 'start_time', 'id')
+    json_fields = ('id', 'date', 'start_time', 'end_time', 'place', 'note')
     
     def get_queryset(self):
         """リストに表示するレコードをフィルタする
         """
         prod_id=self.kwargs['prod_id']
-        return Rehearsal.objects.filter(production__pk=prod_id)
+        return Rehearsal.objects.filter(production__pk=prod_id)\
+            .select_related('place__facility')
 
 
 class RhslCreate(ProdBaseCreateView):
@@ -282,41 +336,50 @@ class RhslAbsence(ProdBaseDetailView):
     model = Rehearsal
     template_name_suffix = '_absence'
     
+    def get(self, request, *args, **kwargs):
+        """表示時のリクエストを受けるハンドラ
+        """
+        # アクセス権を検査してから、公演のデータが変わっていなければ 304 を返す
+        prod_id = self.get_object().production_id
+        if not accessing_prod_user(self, prod_id=prod_id):
+            raise PermissionDenied
+        return conditional_get(self, prod_id, super().get, *args, **kwargs)
+    
     def get_context_data(self, **kwargs):
         """テンプレートに渡すパラメタを改変する
         """
         context = super().get_context_data(**kwargs)
         
+        # この稽古の、役者ごとの出席のビット列と参加時間
+        snapshot = production_snapshot(self.request,
+            self.object.production_id)
+        presence = snapshot.presence(self.object)
+        actors = snapshot.actors
+        
         # 欠席の人のリスト
-        atnds = self.get_object().attendance_set.order_by('actor__name')
-        abs_list = [atnd.actor for atnd in atnds if atnd.is_absent]
+        abs_list = [actor for actor in actors
+            if actor.id in presence.absent_ids]
         
         context['abs_list'] = abs_list
         
         # 遅刻・早退の人のリスト
-        actors = Actor.objects.filter(production=self.get_object().production)\
-            .order_by('name')
-        atnd_actrs = [atnd.actor for atnd in atnds]
         prt_atnds = []
         for actor in actors:
             # この稽古のこの役者の、全日でも欠席でもない参加時間
-            actr_atnds = sorted(
-                [atnd for atnd in atnds if atnd.actor == actor
-                    and not atnd.is_allday and not atnd.is_absent],
-                key=attrgetter('from_time')
-            )
+            actr_times = presence.partial_times.get(actor.id)
             # 参加時間があるなら追加
-            if actr_atnds:
+            if actr_times:
                 actr_str = actor.name + " (" + ",".join(
-                    [a.from_time.strftime('%H:%M') + "-" + a.to_time.strftime('%H:%M')
-                        for a in actr_atnds]
+                    [from_time.strftime('%H:%M') + "-" + to_time.strftime('%H:%M')
+                        for from_time, to_time in actr_times]
                 ) + ")"
                 prt_atnds.append(actr_str)
         
         context['prt_atnds'] = prt_atnds
         
         # 未定の人のリスト
-        und_list = [actor for actor in actors if actor not in atnd_actrs]
+        und_list = [actor for actor in actors
+            if presence.is_undecided(actor.id)]
         
         context['und_list'] = und_list
         
@@ -550,20 +613,34 @@ class ScnList(ProdBaseListView):
     Template 名: scene_list (default)
     """
     model = Scene
+    keyset_ordering = ('sortkey', 'id')
+    json_fields = ('id', 'sortkey', 'name', 'progress', 'priority',
+        'description', 'note', 'apprs')
     
     def get_queryset(self):
         """リストに表示するレコードをフィルタする
         """
         prod_id=self.kwargs['prod_id']
-        scenes = Scene.objects.filter(production__pk=prod_id)
-            
+        return Scene.objects.filter(production__pk=prod_id)
+    
+    def get_context_data(self, **kwargs):
+        """テンプレートに渡すパラメタを改変する
+        """
+        context = super().get_context_data(**kwargs)
+        
+        # 表示するページのシーンの出番を一度に読み込む
+        scenes = context['object_list']
+        scn_apprs = {scene.id: [] for scene in scenes}
+        apprs = Appearance.objects.filter(scene__in=scenes)\
+            .select_related('character').order_by('character__sortkey')
+        for appr in apprs:
+            scn_apprs[appr.scene_id].append(str(appr.character))
+        
         # 出番リストを各シーンのプロパティとして追加
         for scene in scenes:
-            apprs = scene.appearance_set.order_by('character__sortkey')
-            scene.apprs = ', '.join(
-                [str(appr.character) for appr in apprs])
+            scene.apprs = ', '.join(scn_apprs[scene.id])
         
-        return scenes
+        return context
 
 
 class ScnCreate(ProdBaseCreateView):
@@ -639,12 +716,15 @@ class ChrList(ProdBaseListView):
     Template 名: character_list (default)
     """
     model = Character
+    keyset_ordering = ('sortkey', 'id')
+    json_fields = ('id', 'sortkey', 'name', 'short_name', 'cast')
     
     def get_queryset(self):
         """リストに表示するレコードをフィルタする
         """
         prod_id=self.kwargs['prod_id']
-        return Character.objects.filter(production__pk=prod_id)
+        return Character.objects.filter(production__pk=prod_id)\
+            .select_related('cast')
 
 
 class ChrCreate(ProdBaseCreateView):
@@ -732,13 +812,15 @@ class ActrList(ProdBaseListView):
     Template 名: actor_list (default)
     """
     model = Actor
+    keyset_ordering = ('name', 'id')
+    json_fields = ('id', 'name', 'short_name', 'prod_user')
     
     def get_queryset(self):
         """リストに表示するレコードをフィルタする
         """
         prod_id=self.kwargs['prod_id']
         return Actor.objects.filter(production__pk=prod_id)\
-            .order_by('name')
+            .select_related('prod_user__user').order_by('name')
 
 
 class ActrCreate(ProdBaseCreateView):
@@ -1615,6 +1697,10 @@ class AtndChangeList(ProdBaseListView):
     Template 名: atndchangelog_list (default)
     """
     model = AtndChangeLog
+    # 新しい順 (公演と記録日時のインデックスを使う)
+    keyset_ordering = ('-create_dt', '-id')
+    json_fields = ('id', 'create_dt', 'old_value', 'new_value', 'changed_by',
+        'changed_by_id')
     
     def get_queryset(self):
         """リストに表示するレコードをフィルタする
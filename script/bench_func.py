@@ -0,0 +1,181 @@
+import datetime
+import random
+import statistics
+import time
+import tracemalloc
+from .fountain import fountain
+
+
+# 計測する台本の規模 (synthetic_fountain の引数)
+BENCH_SIZES = {
+    'small': {'scenes': 20, 'characters': 8},
+    'medium': {'scenes': 150, 'characters': 20},
+    'large': {'scenes': 800, 'characters': 40},
+}
+
+# 合成する台本の文の材料
+FAMILY_NAMES = ['佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村',
+    '小林', '加藤']
+GIVEN_NAMES = ['太郎', '花子', '一郎', '陽子', '健太', '美咲', '翔', '結衣']
+PLACES = ['公園', '駅のホーム', '教室', '喫茶店', '屋上', '病院の廊下', '商店街',
+    '海辺']
+TIMES = ['朝', '昼', '夕方', '夜', '深夜']
+PHRASES = ['ちょっと待って', 'それはどういう意味？', 'もう遅いよ', 'ずっと探していたんだ',
+    '信じられない', 'ありがとう', '明日また来るから', '本当のことを言って',
+    'あの日のことを覚えてる？', '大丈夫、心配しないで']
+ACTIONS = ['静かに風が吹いている。', '遠くで電車の音がする。', '照明がゆっくりと変わる。',
+    '二人は黙ったまま立ち尽くす。', '扉が開き、誰かが入ってくる。', '雨が降り始める。']
+MANNERS = ['(小声で)', '(笑って)', '(振り返らずに)', '(間)', '(涙をこらえて)']
+
+
+def synthetic_fountain(scenes=20, characters=8, seed=0):
+    '''日本語の台本を模した Fountain のテキストを作る
+    
+    見出し、ト書き、台詞、ト書きの括弧、場転のほか、
+    ボーンヤードやコメントなども含む
+    '''
+    rand = random.Random(seed)
+    names = ['{}{}'.format(rand.choice(FAMILY_NAMES), rand.choice(GIVEN_NAMES))
+        for i in range(characters)]
+    # 同姓同名は区別できないので番号を付ける
+    names = ['{}{}'.format(name, i + 1) for i, name in enumerate(names)]
+    
+    lines = ['Title: 合成台本', 'Author: bench', 'Draft date: 2024-01-01', '']
+    lines += ['.登場人物', '']
+    lines += ['{}　……{}の人物'.format(name, rand.choice(PLACES))
+        for name in names]
+    lines.append('')
+    for scn_idx in range(scenes):
+        if scn_idx % 10 == 0:
+            lines += ['# 第{}幕'.format(scn_idx // 10 + 1), '']
+            lines += ['= {}で物語が動き出す'.format(rand.choice(PLACES)), '']
+        lines += ['.{}　{} #{}#'.format(rand.choice(PLACES), rand.choice(TIMES),
+            scn_idx + 1), '']
+        lines += [rand.choice(ACTIONS), rand.choice(ACTIONS), '']
+        if rand.random() < 0.2:
+            lines += ['[[ 演出メモ: {} ]]'.format(rand.choice(ACTIONS)), '']
+        if rand.random() < 0.1:
+            lines += ['/*', '削除した台詞', rand.choice(PHRASES), '*/', '']
+        speakers = rand.sample(names, min(len(names), rand.randint(2, 4)))
+        for _ in range(rand.randint(6, 16)):
+            lines.append('@' + rand.choice(speakers))
+            if rand.random() < 0.3:
+                lines.append(rand.choice(MANNERS))
+            lines += [rand.choice(PHRASES)
+                for i in range(rand.randint(1, 3))]
+            lines.append('')
+            if rand.random() < 0.05:
+                lines += ['@{} ^'.format(rand.choice(speakers)),
+                    rand.choice(PHRASES), '']
+        lines += ['> 暗転', '']
+        if rand.random() < 0.05:
+            lines += ['===', '']
+    lines += ['> 終 <', '']
+    return '\n'.join(lines)
+
+
+def elements_signature(elements):
+    '''要素のリストを、比較できるタプルのリストにする
+    '''
+    return [(e.element_type, e.element_text, e.section_depth, e.scene_number,
+        e.scene_abbreviation, e.is_centered, e.is_dual_dialogue,
+        e.original_line, e.original_content) for e in elements]
+
+
+def time_parse(parser, text, repeat):
+    '''parser(string=text) を repeat 回呼び出し、経過時間 (ms) のリストを返す
+    '''
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser(string=text)
+        runs.append((time.perf_counter() - start) * 1000)
+    return runs
+
+
+def peak_memory(parser, text):
+    '''parser(string=text) の解析結果を保持した時のメモリ使用量 (KiB) を返す
+    '''
+    tracemalloc.start()
+    try:
+        document = parser(string=text)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del document
+    return round(size / 1024, 1)
+
+
+def run_benchmarks(sizes=None, repeat=5, seed=0):
+    '''合成した台本で、Fountain の解析を新旧の実装で計測し、レポートを返す
+    
+    Parameters
+    ----------
+    sizes : {名前: synthetic_fountain の引数}
+        省略時は BENCH_SIZES
+    repeat : int
+        実装ごとの解析回数 (中央値と最小値を報告する)
+    
+    Returns
+    -------
+    {
+        created: 日時,
+        repeat: repeat,
+        sizes: [{
+            name: 名前,
+            params: 引数,
+            lines: 行数,
+            chars: 文字数,
+            elements: 要素数,
+            same: 新旧の解析結果が同じか,
+            parsers: {実装名: {
+                median_ms, min_ms, lines_per_sec, memory_kib
+            }},
+            speedup: 旧 / 新 の中央値の比
+        }]
+    }
+    '''
+    if sizes is None:
+        sizes = BENCH_SIZES
+    repeat = max(repeat, 1)
+    parsers = [('legacy', fountain.LegacyFountain),
+        ('tokenizer', fountain.Fountain)]
+    
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'repeat': repeat,
+        'sizes': [],
+    }
+    for name, params in sizes.items():
+        text = synthetic_fountain(seed=seed, **params)
+        num_lines = text.count('\n') + 1
+        legacy = fountain.LegacyFountain(string=text)
+        new = fountain.Fountain(string=text)
+        size_report = {
+            'name': name,
+            'params': params,
+            'lines': num_lines,
+            'chars': len(text),
+            'elements': len(new.elements),
+            'same': legacy.metadata == new.metadata and
+                elements_signature(legacy.elements) ==
+                elements_signature(new.elements),
+            'parsers': {},
+        }
+        for parser_name, parser in parsers:
+            runs = time_parse(parser, text, repeat)
+            median = statistics.median(runs)
+            size_report['parsers'][parser_name] = {
+                'median_ms': round(median, 2),
+                'min_ms': round(min(runs), 2),
+                'lines_per_sec': round(num_lines / median * 1000)
+                    if median else None,
+                'memory_kib': peak_memory(parser, text),
+            }
+        legacy_ms = size_report['parsers']['legacy']['median_ms']
+        new_ms = size_report['parsers']['tokenizer']['median_ms']
+        size_report['speedup'] = round(legacy_ms / new_ms, 2)\
+            if new_ms else None
+        report['sizes'].append(size_report)
+    
+    return report
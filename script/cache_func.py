@@ -0,0 +1,144 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+
+class ParsedScript:
+    '''解析済みの台本
+    
+    Attributes
+    ----------
+    key : str
+        フォーマットと台本データのハッシュ
+    document
+        解析結果 (Fountain なら fountain.Fountain、sp.yaml なら dict か
+        yaml.YAMLError)
+    size : int
+        キャッシュの大きさの見積もり (文字数)
+    '''
+    __slots__ = ('key', 'document', 'size', '_results', '_cache')
+    
+    def __init__(self, key, document, size, cache):
+        self.key = key
+        self.document = document
+        self.size = size
+        self._results = {}
+        self._cache = cache
+    
+    def result(self, name):
+        '''memo で覚えた値を得る (まだなければ None)
+        '''
+        return self._results.get(name)
+    
+    def memo(self, name, build):
+        '''解析結果から作る値 (HTML や公演のデータ) を、この台本ごとに覚えておく
+        
+        Parameters
+        ----------
+        name : str
+            値の種類 ('html' など)
+        build : callable
+            build(document) で値を作る関数
+        '''
+        if name not in self._results:
+            result = build(self.document)
+            self._results[name] = result
+            # 文字列はキャッシュの大きさに加える
+            if isinstance(result, str):
+                self._cache.grow(self, len(result))
+        return self._results[name]
+
+
+class ParsedScriptCache:
+    '''台本の解析結果の、プロセス内の LRU キャッシュ
+    
+    キーは台本データとフォーマットのハッシュなので、台本が変わると
+    古い解析結果は使われない (ScriptUpdate で明示的にも消す)
+    大きさの見積もりの合計が max_size を超えたら、最も長く使われていない
+    ものから消す
+    '''
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(text, format):
+        return hashlib.sha256('{}:{}'.format(format, text).encode())\
+            .hexdigest()
+    
+    def get(self, text, format, parse):
+        '''台本の解析結果を得る (なければ parse(text) で解析してキャッシュする)
+        '''
+        entry = self.peek(text, format)
+        if entry is not None:
+            return entry
+        
+        # 解析はロックの外で行う (同時に解析されたら後のもので置き換える)
+        # 解析結果は台本データの数倍の大きさになるとみなす
+        return self.put(text, format, parse(text), len(text) * 4)
+    
+    def peek(self, text, format):
+        '''キャッシュにある解析結果を得る (なければ None)
+        '''
+        key = self.key(text, format)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+    
+    def put(self, text, format, document, size):
+        '''解析結果をキャッシュに加える
+        
+        Parameters
+        ----------
+        size : int
+            解析結果の大きさの見積もり (文字数)
+        '''
+        key = self.key(text, format)
+        entry = ParsedScript(key, document, size, self)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            self._evict()
+        return entry
+    
+    def grow(self, entry, size):
+        '''キャッシュにある解析結果の大きさを増やす
+        '''
+        with self._lock:
+            entry.size += size
+            if self._entries.get(entry.key) is entry:
+                self.size += size
+                self._evict()
+    
+    def discard(self, text, format):
+        '''台本の解析結果をキャッシュから消す
+        '''
+        with self._lock:
+            entry = self._entries.pop(self.key(text, format), None)
+            if entry is not None:
+                self.size -= entry.size
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+    
+    def _evict(self):
+        # 最後に使ったものは大きくても残す
+        while self.size > self.max_size and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+
+
+# プロセスごとに1つ持つ
+parsed_script_cache = ParsedScriptCache(
+    getattr(settings, 'SCRIPT_CACHE_MAX_SIZE', 16 * 1024 * 1024))
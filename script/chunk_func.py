@@ -0,0 +1,406 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import django
+import yaml
+from django.conf import settings
+from .fountain import tokenizer
+from .cache_func import parsed_script_cache
+
+
+# この大きさ (文字数) 以上の台本は、シーンごとのチャンクに分けて解析する
+CHUNK_MIN_SIZE = getattr(settings, 'SCRIPT_CHUNK_MIN_SIZE', 1024 * 1024)
+
+# チャンクを解析するプロセスの数 (1 ならプロセスプールを使わない)
+CHUNK_WORKERS = getattr(settings, 'SCRIPT_CHUNK_WORKERS', None)\
+    or os.cpu_count() or 1
+
+# sp.yaml のトップレベルの scenes: の行
+SP_YAML_SCENES = re.compile(r'^scenes:[ \t]*(?:#.*)?$', re.MULTILINE)
+
+# 空行とコメントの行以外の行 (インデント)
+SP_YAML_CONTENT = re.compile(r'^(?! *(?:#.*)?$)( *)', re.MULTILINE)
+
+# リストの項目の始まり (行頭からインデントの後に)
+SP_YAML_ITEM = re.compile(r'-(?:[ \t]|$)', re.MULTILINE)
+
+# インデントのない行 (空行・コメントを除く)
+SP_YAML_TOP = re.compile(r'^[^ \n#]', re.MULTILINE)
+
+# ドキュメントの区切り
+SP_YAML_DOCUMENT = re.compile(r'^(?:---|\.\.\.)', re.MULTILINE)
+
+# チャンクに分けると結果が変わりうるもの
+# (YAML では改行でなく str.splitlines では改行になる文字と、チャンクを
+# またがって参照されうるアンカー・エイリアス)
+SP_YAML_BREAKS = re.compile('[\x0b\x0c\x1c-\x1e\x85\u2028\u2029]')
+SP_YAML_ANCHOR = re.compile(r'(?:^|[\s\[{,])[&*]\S', re.MULTILINE)
+
+
+def fountain_scene_data(elements):
+    '''Fountain の要素のリストから、登場人物・シーン・出番のデータを得る
+    
+    最初の見出しより前の登場人物は数えない
+    
+    Returns
+    -------
+    (characters, scenes, appearance)
+    '''
+    characters = []
+    scenes = []
+    appearance = []
+    scn_apprs = {}
+    
+    for e in elements:
+        if e.element_type == 'Character':
+            if scenes:
+                char_name = e.element_text
+                current_count = scn_apprs.get(char_name, 0)
+                scn_apprs[char_name] = current_count + 1
+                if char_name not in characters:
+                    characters.append(char_name)
+            continue
+        if e.element_type in ('Scene Heading', 'Section Heading'):
+            if scenes:
+                if scenes[-1] == '登場人物':
+                    scenes.pop()
+                else:
+                    appearance.append(scn_apprs)
+                scn_apprs = {}
+            scenes.append(e.element_text)
+    
+    if scenes:
+        if scenes[-1] == '登場人物':
+            scenes.pop()
+        else:
+            appearance.append(scn_apprs)
+    
+    return characters, scenes, appearance
+
+
+def sp_yaml_alias_map(data):
+    '''sp.yaml の登場人物の、別名 (と本名) から本名へのマップを得る
+    '''
+    alias_to_main_name_map = {}
+    if 'characters' in data and isinstance(data.get('characters'), list):
+        for char_data in data.get('characters', []):
+            main_name = char_data.get('name')
+            if not main_name:
+                continue
+            # 本名自身もマップに追加
+            alias_to_main_name_map[main_name] = main_name
+            # 別名をマップに追加
+            for alias in char_data.get('alias', []):
+                alias_to_main_name_map[alias] = main_name
+    return alias_to_main_name_map
+
+
+def sp_yaml_scene_lines(scene_data):
+    '''sp.yaml のシーン1つの、名前と話者ごとのセリフ数を得る
+    
+    話者は台本に書かれたまま (別名は本名にしない)、登場順
+    
+    Returns
+    -------
+    (シーン名, {話者: セリフ数})
+    '''
+    scene_name = scene_data.get('name', '無題のシーン')
+    speakers = {}
+    body = scene_data.get('body', '')
+    if body:
+        for line in body.splitlines():
+            if ':' in line:
+                speaker, _ = line.split(':', 1)
+                speaker = speaker.strip()
+                speakers[speaker] = speakers.get(speaker, 0) + 1
+    return scene_name, speakers
+
+
+def sp_yaml_scene_data(alias_map, scene_lines):
+    '''sp.yaml のシーンごとのセリフ数から、登場人物・シーン・出番のデータを得る
+    
+    Parameters
+    ----------
+    alias_map : dict
+        sp_yaml_alias_map の結果
+    scene_lines : list
+        シーンごとの sp_yaml_scene_lines の結果
+    
+    Returns
+    -------
+    (characters, scenes, appearance)
+    '''
+    characters = []
+    scenes = []
+    appearance = []
+    for scene_name, speakers in scene_lines:
+        scenes.append(scene_name)
+        scn_apprs = {}
+        for speaker, count in speakers.items():
+            # 別名マップを使って本名に正規化。マップにない場合は speaker 自身を本名とみなす
+            main_name = alias_map.get(speaker, speaker)
+            # 登場人物リストに登場順で追加 (重複は避ける)
+            if main_name not in characters:
+                characters.append(main_name)
+            scn_apprs[main_name] = scn_apprs.get(main_name, 0) + count
+        appearance.append(scn_apprs)
+    return characters, scenes, appearance
+
+
+def split_fountain(text):
+    '''Fountain の台本を、空行の次の見出しの行で区切る
+    
+    空行の後は前の行の影響を受けないので、チャンクごとに解析できる
+    (ふつうは見出しの前に空行があるので、シーンごとのチャンクになる)
+    
+    Returns
+    -------
+    (metadata, チャンクのリスト)
+        チャンクは本文の始まりか区切りの見出しから、次の区切りの前までの
+        行を改行でつないだもので、続きがあるものは末尾に改行を付ける
+        (本文は前後の空白を除いてあるので、最後のチャンクは改行で終わらない)
+    '''
+    script_head, script_body = tokenizer.split(text)
+    starts = tokenizer.chunk_starts(script_body)
+    ends = starts[1:] + [len(script_body)]
+    chunks = []
+    for start, end in zip(starts, ends):
+        chunk = '\n'.join(script_body[start:end])
+        if end < len(script_body):
+            chunk += '\n'
+        chunks.append(chunk)
+    return tokenizer.parse_head(script_head), chunks
+
+
+def fountain_chunk_data(chunk):
+    '''Fountain の台本のチャンク1つを解析し、(characters, scenes, appearance) を返す
+    '''
+    lines = chunk.split('\n')
+    more = chunk.endswith('\n')
+    if more:
+        lines.pop()
+    return fountain_scene_data(tokenizer.parse_body(lines, more=more))
+
+
+def iter_fountain_elements(text):
+    '''Fountain の台本を、split_fountain と同じ区切りごとに少しずつ解析する
+    
+    Returns
+    -------
+    (metadata, 要素のイテレータ)
+        区切りを探しながら、区切りまでを解析して要素を返す
+        (最初の要素は、全体を解析する前に返す)
+    '''
+    script_head, script_body = tokenizer.split(text)
+    return tokenizer.parse_head(script_head),\
+        _iter_fountain_body_elements(script_body)
+
+
+def _iter_fountain_body_elements(script_body):
+    starts = tokenizer.iter_chunk_starts(script_body)
+    start = next(starts, None)
+    while start is not None:
+        end = next(starts, None)
+        yield from tokenizer.parse_body(script_body[start:end],
+            more=end is not None)
+        start = end
+
+
+def split_sp_yaml(text):
+    '''sp.yaml の台本を、トップレベルの scenes のリストの項目で区切る
+    
+    Returns
+    -------
+    (scenes 以外の部分, チャンクのリスト)
+        チャンクは 'scenes:' の行と項目1つを合わせた YAML
+        区切れない書き方 (フロー形式、アンカー、複数のドキュメントなど)
+        なら None
+    '''
+    if SP_YAML_BREAKS.search(text):
+        return None
+    if ('&' in text or '*' in text) and SP_YAML_ANCHOR.search(text):
+        return None
+    # 改行は YAML の解析でも '\n' になるので、先にそろえておく
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    scenes_lines = list(SP_YAML_SCENES.finditer(text))
+    if len(scenes_lines) != 1:
+        return None
+    header = scenes_lines[0].group() + '\n'
+    head_end = scenes_lines[0].start()
+    pos = scenes_lines[0].end()
+    
+    # 最初の項目のインデントで、項目の始まりを見分ける
+    first = SP_YAML_CONTENT.search(text, pos)
+    if first is None or not SP_YAML_ITEM.match(text, first.end()):
+        return None
+    indent = first.group(1)
+    
+    # インデントのない行 (インデントのない項目を除く) の前までが scenes
+    end = len(text)
+    for top in SP_YAML_TOP.finditer(text, pos):
+        if indent or not SP_YAML_ITEM.match(text, top.start()):
+            end = top.start()
+            break
+    
+    item_starts = [match.start() for match
+        in re.finditer('^' + indent + SP_YAML_ITEM.pattern, text[:end],
+            re.MULTILINE)
+        if match.start() >= first.start()]
+    
+    rest = text[:head_end] + text[end:]
+    if SP_YAML_DOCUMENT.search(rest):
+        return None
+    
+    chunks = [header + text[start:stop]
+        for start, stop in zip(item_starts, item_starts[1:] + [end])]
+    return rest, chunks
+
+
+def sp_yaml_chunk_scene(chunk):
+    '''sp.yaml の台本のチャンク1つを解析し、シーンの dict を返す
+    
+    Raises
+    ------
+    ValueError
+        チャンクが項目1つの scenes でない (YAML のエラーも含む)
+    '''
+    try:
+        data = yaml.safe_load(chunk)
+    except yaml.YAMLError:
+        raise ValueError('invalid chunk')
+    if not isinstance(data, dict) or list(data) != ['scenes']\
+            or not isinstance(data['scenes'], list)\
+            or len(data['scenes']) != 1\
+            or not isinstance(data['scenes'][0], dict):
+        raise ValueError('invalid chunk')
+    return data['scenes'][0]
+
+
+def sp_yaml_chunk_data(chunk):
+    '''sp.yaml の台本のチャンク1つを解析し、sp_yaml_scene_lines の結果を返す
+    
+    Raises
+    ------
+    ValueError
+        チャンクが項目1つの scenes でない (YAML のエラーも含む)
+    '''
+    return sp_yaml_scene_lines(sp_yaml_chunk_scene(chunk))
+
+
+def map_chunks(func, chunks, format, workers=None):
+    '''チャンクごとに func(chunk) を計算する
+    
+    結果はチャンクごとにキャッシュし、キャッシュにないものだけを計算する
+    (台本の一部を変えても、そのチャンクだけを解析し直す)
+    キャッシュにないものが複数あれば、プロセスプールで並列に計算する
+    
+    Parameters
+    ----------
+    func : callable
+        モジュールのトップレベルの関数 (プロセスに渡すため)
+    format : str
+        キャッシュのキーに使う、チャンクの種類
+    workers : int
+        プロセスの数 (省略時は CHUNK_WORKERS)
+    
+    Returns
+    -------
+    チャンクごとの結果のリスト
+    '''
+    if workers is None:
+        workers = CHUNK_WORKERS
+    
+    results = [None] * len(chunks)
+    missing = []
+    for idx, chunk in enumerate(chunks):
+        entry = parsed_script_cache.peek(chunk, format)
+        if entry is None:
+            missing.append(idx)
+        else:
+            results[idx] = entry.document
+    
+    texts = [chunks[idx] for idx in missing]
+    workers = min(workers, len(texts))
+    if workers > 1:
+        # spawn で起動したプロセスでもモデルを読み込めるように、初めに
+        # django.setup() を呼ぶ
+        with ProcessPoolExecutor(max_workers=workers,
+                initializer=django.setup) as executor:
+            computed = list(executor.map(func, texts,
+                chunksize=max(1, len(texts) // (workers * 4))))
+    else:
+        computed = [func(text) for text in texts]
+    
+    for idx, result in zip(missing, computed):
+        # 結果は小さいので、大きさはチャンクの数分の1とみなす
+        parsed_script_cache.put(chunks[idx], format, result,
+            len(chunks[idx]) // 4)
+        results[idx] = result
+    return results
+
+
+def chunked_data_from_fountain(text, workers=None):
+    '''Fountain の台本を見出しごとのチャンクに分けて解析し、データを得る
+    
+    Returns
+    -------
+    data_from_fountain と同じ (meta, characters, scenes, appearance)
+    '''
+    metadata, chunks = split_fountain(text)
+    meta = {key: value[0] for key, value in metadata.items() if value}
+    
+    characters = []
+    scenes = []
+    appearance = []
+    for chunk_chars, chunk_scenes, chunk_apprs in map_chunks(
+            fountain_chunk_data, chunks, 'fountain-chunk', workers):
+        for char_name in chunk_chars:
+            if char_name not in characters:
+                characters.append(char_name)
+        scenes.extend(chunk_scenes)
+        appearance.extend(chunk_apprs)
+    return meta, characters, scenes, appearance
+
+
+def chunked_data_from_sp_yaml(text, workers=None):
+    '''sp.yaml の台本をシーンごとのチャンクに分けて解析し、データを得る
+    
+    Returns
+    -------
+    data_from_sp_yaml と同じ (meta, characters, scenes, appearance)
+    チャンクに分けられない台本なら None (全体を解析すること)
+    '''
+    split = split_sp_yaml(text)
+    if split is None:
+        return None
+    head, chunks = split
+    
+    try:
+        data = yaml.safe_load(head) if head.strip() else {}
+        if not isinstance(data, dict) or 'scenes' in data:
+            return None
+        scene_lines = map_chunks(sp_yaml_chunk_data, chunks, 'sp.yaml-chunk',
+            workers)
+    except (ValueError, yaml.YAMLError):
+        return None
+    
+    return (data.get('meta', {}),
+        *sp_yaml_scene_data(sp_yaml_alias_map(data), scene_lines))
+
+
+def chunked_data(text, format, workers=None):
+    '''大きな台本を、チャンクに分けて並列に解析し、データを得る
+    
+    Returns
+    -------
+    (meta, characters, scenes, appearance)
+    チャンクに分けないなら None (data_from_fountain などで全体を解析すること)
+    '''
+    if len(text) < CHUNK_MIN_SIZE:
+        return None
+    if format == 1:  # Fountain
+        return chunked_data_from_fountain(text, workers)
+    if format == 2:  # sp.yaml
+        return chunked_data_from_sp_yaml(text, workers)
+    return None
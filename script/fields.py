@@ -0,0 +1,97 @@
+import zlib
+from django import forms
+from django.db import models
+
+
+# 保存するデータの先頭1バイトの、形式のマーカー
+RAW = b'\x00'   # 圧縮なしの UTF-8
+ZLIB = b'\x01'  # zlib で圧縮した UTF-8
+
+# これより短い (バイト数) ものは、圧縮しても小さくならないので圧縮しない
+MIN_COMPRESS_SIZE = 256
+
+
+def compress_text(text):
+    '''テキストを、形式のマーカーを付けた bytes にする
+    '''
+    data = text.encode('utf-8')
+    if len(data) >= MIN_COMPRESS_SIZE:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return ZLIB + compressed
+    return RAW + data
+
+
+def decompress_text(data):
+    '''compress_text で作った bytes を、テキストに戻す
+    
+    Raises
+    ------
+    ValueError
+        形式のマーカーが不明
+    '''
+    data = bytes(data)
+    if not data:
+        return ''
+    marker, body = data[:1], data[1:]
+    if marker == RAW:
+        return body.decode('utf-8')
+    if marker == ZLIB:
+        return zlib.decompress(body).decode('utf-8')
+    raise ValueError('unknown format marker: {!r}'.format(marker))
+
+
+class CompressedTextField(models.BinaryField):
+    '''圧縮してデータベースに保存するテキストのフィールド
+    
+    Python では str として扱い、データベースには compress_text で作った
+    bytes を保存する (フォームでは TextField と同じく Textarea で編集する)
+    '''
+    
+    def __init__(self, *args, **kwargs):
+        # BinaryField と違って、既定で編集できる
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+    
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.editable:
+            kwargs.pop('editable', None)
+        else:
+            kwargs['editable'] = False
+        return name, path, args, kwargs
+    
+    def _check_str_default_value(self):
+        # 値は str なので、既定値も str で良い
+        return []
+    
+    def get_default(self):
+        # BinaryField は '' を b'' にするので、Field の既定値をそのまま使う
+        return models.Field.get_default(self)
+    
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return decompress_text(value)
+    
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return value
+    
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return value
+        return compress_text(value)
+    
+    def value_to_string(self, obj):
+        # シリアライズ (dumpdata) ではテキストのまま書き出す
+        return self.value_from_object(obj)
+    
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'max_length': self.max_length,
+            'widget': forms.Textarea,
+            **kwargs,
+        })
@@ -0,0 +1,16 @@
+from django import forms
+from django.db.models import Q
+from production.models import Production
+
+
+class ProdUpdateFromScriptForm(forms.Form):
+    """台本のデータで更新する公演を選ぶフォーム"""
+    production = forms.ModelChoiceField(Production.objects.none(),
+        label='公演')
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 所有権か編集権を持つ公演だけを選べる
+        self.fields['production'].queryset = Production.objects.filter(
+            Q(produser__is_owner=True) | Q(produser__is_editor=True),
+            produser__user=user).distinct()
@@ -5,7 +5,11 @@ Original Python code at https://gist.github.com/ColtonProvias/8232624
 Based on Fountain by Nima Yousefi & John August
 Original code for Objective-C at https://github.com/nyousefi/Fountain
 Further Edited by Manuel Senfft
+
+Fountain parses with the single-pass tokenizer in tokenizer.py.
+LegacyFountain keeps the original line-by-line parser for comparison.
 """
+from . import tokenizer
 
 
 COMMON_TRANSITIONS = {'FADE OUT.', 'CUT TO BLACK.', 'FADE TO BLACK.'}
@@ -39,7 +43,7 @@ class FountainElement:
         return self.element_type + ': ' + self.element_text
 
 
-class Fountain:
+class LegacyFountain:
     def __init__(self, string=None, path=None):
         self.metadata = dict()
         self.elements = list()
@@ -377,3 +381,15 @@ class Fountain:
                     )
                 )
                 newlines_before = 0
+
+
+class Fountain(LegacyFountain):
+    """Compatibility wrapper of the tokenizer
+
+    Has the same metadata, elements and contents as LegacyFountain.
+    Elements are tokenizer.Element (__slots__) and all the empty lines
+    share one element, which must not be modified.
+    """
+
+    def parse(self):
+        self.metadata, self.elements = tokenizer.parse(self.contents)
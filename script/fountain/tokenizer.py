@@ -0,0 +1,337 @@
+"""
+tokenizer.py
+Single-pass Fountain tokenizer for pscweb2
+
+Produces the same elements as the original Fountain._parse_body, but
+classifies each line with precompiled regular expressions and emits
+compact __slots__ elements (empty lines share a single instance).
+"""
+import re
+
+
+COMMON_TRANSITIONS = frozenset({'FADE OUT.', 'CUT TO BLACK.', 'FADE TO BLACK.'})
+
+# Elements decided by the start of a (left-stripped) line.
+# The alternatives are in the order of the checks in the original parser.
+# The scene prefixes match what line[0:4].upper() matched there,
+# including 'ı' and 'ſ' (upper-cased to 'I' and 'S').
+LEADING = re.compile(r'''
+    (?P<page_break>===)
+    | (?P<synopsis>=)
+    | (?P<comment>\[\[)
+    | (?P<section>\#)
+    | (?P<scene_dot>\.[^.])
+    | (?P<scene_int>(?:[Iiı][Nn][Tt]/[Ee][Xx][Tt]
+        | [Iiı][Nn][Tt] | [Ee][Xx][Tt] | [Ee][Ssſ][Tt] | [Iiı]/[Ee])[ .])
+''', re.VERBOSE)
+
+# Character names written in upper case alphabets
+UPPER_NAME = re.compile('[A-Z]+')
+
+# Kinds of LEADING that start a scene of the script
+HEADINGS = frozenset({'section', 'scene_dot', 'scene_int'})
+
+# Characters that can not start a character name
+NOT_CHARACTER_START = frozenset('[],()')
+
+
+class Element:
+    """A Fountain element (same attributes as FountainElement)"""
+    __slots__ = (
+        'element_type',
+        'element_text',
+        'section_depth',
+        'scene_number',
+        'scene_abbreviation',
+        'is_centered',
+        'is_dual_dialogue',
+        'original_line',
+        'original_content',
+    )
+
+    def __init__(
+        self,
+        element_type,
+        element_text='',
+        section_depth=0,
+        scene_number='',
+        is_centered=False,
+        is_dual_dialogue=False,
+        original_line=0,
+        scene_abbreviation='.',
+        original_content=''
+    ):
+        self.element_type = element_type
+        self.element_text = element_text
+        self.section_depth = section_depth
+        self.scene_number = scene_number
+        self.scene_abbreviation = scene_abbreviation
+        self.is_centered = is_centered
+        self.is_dual_dialogue = is_dual_dialogue
+        self.original_line = original_line
+        self.original_content = original_content
+
+    def __repr__(self):
+        return self.element_type + ': ' + self.element_text
+
+
+# Empty lines carry no data and are never modified, so they share one element
+EMPTY_LINE = Element('Empty Line')
+
+
+def parse(contents):
+    """Parse a Fountain script
+
+    Returns
+    -------
+    (metadata, elements)
+    """
+    script_head, script_body = split(contents)
+    return parse_head(script_head), parse_body(script_body)
+
+
+def split(contents):
+    """Split a Fountain script into the title page lines and the body lines"""
+    contents = contents.strip().replace('\r', '')
+    if not contents:
+        return [], []
+
+    contents_has_metadata = ':' in contents.splitlines()[0]
+    contents_has_body = '\n\n' in contents
+
+    if contents_has_metadata and contents_has_body:
+        script_head, script_body = contents.split('\n\n', 1)
+        return script_head.splitlines(), script_body.splitlines()
+    if contents_has_metadata:
+        return contents.splitlines(), []
+    return [], contents.splitlines()
+
+
+def parse_head(script_head):
+    """Parse the title page into {key: [values]}"""
+    metadata = {}
+    open_key = None
+    for line in script_head:
+        line = line.rstrip()
+        if line[0].isspace():
+            metadata[open_key].append(line.strip())
+        elif line[-1] == ':':
+            open_key = line[0:-1].lower()
+            metadata[open_key] = list()
+        else:
+            key, value = line.split(':', 1)
+            metadata[key.strip().lower()] = [value.strip()]
+    return metadata
+
+
+def _split_scene_number(full_strip, name_start):
+    """Split '.NAME #1#' into ('NAME', '1')"""
+    if full_strip[-1] == '#' and full_strip.count('#') > 1:
+        number_start = len(full_strip) - full_strip[::-1].find('#', 1) - 1
+        return (full_strip[name_start:number_start].strip(),
+            full_strip[number_start:].strip('#').strip())
+    return full_strip[name_start:].strip(), ''
+
+
+def chunk_starts(script_body):
+    """Line numbers where the body can be split and parsed separately
+
+    These are the first line and the Scene Headings and Section Headings
+    right after an empty line, outside boneyards (/* ... */). The empty line
+    resets the state of parse_body, so the elements from there do not depend
+    on the lines before.
+    """
+    return list(iter_chunk_starts(script_body))
+
+
+def iter_chunk_starts(script_body):
+    """Generate chunk_starts(script_body) while scanning the lines"""
+    if script_body:
+        yield 0
+    match_leading = LEADING.match
+    is_comment_block = False
+    after_empty_line = False
+    for linenum, line in enumerate(script_body):
+        line = line.lstrip()
+        if not line:
+            after_empty_line = not is_comment_block
+            continue
+        is_chunk_start = after_empty_line
+        after_empty_line = False
+        if line.startswith('/*'):
+            is_comment_block = not line.rstrip().endswith('*/')
+            continue
+        if line.rstrip().endswith('*/'):
+            is_comment_block = False
+            continue
+        if is_comment_block or not is_chunk_start:
+            continue
+        leading = match_leading(line)
+        if leading and leading.lastgroup in HEADINGS and linenum > 0:
+            yield linenum
+
+
+def parse_body(script_body, more=False):
+    """Parse the body lines into a list of elements
+
+    Parameters
+    ----------
+    script_body : list of str
+    more : bool
+        The body continues after these lines (from a non-empty line).
+        Used to parse a part of the body up to the next heading.
+    """
+    elements = []
+    append = elements.append
+    match_leading = LEADING.match
+    match_upper = UPPER_NAME.fullmatch
+
+    is_comment_block = False
+    is_inside_dialogue_block = False
+    newlines_before = 0
+    comment_text = []
+    last_character = None
+    last_linenum = len(script_body) - 1
+
+    for linenum, line in enumerate(script_body):
+        line = line.lstrip()
+
+        if not line and not is_comment_block:
+            append(EMPTY_LINE)
+            is_inside_dialogue_block = False
+            newlines_before += 1
+            continue
+
+        # Boneyard (/* ... */)
+        if line.startswith('/*'):
+            line = line.rstrip()
+            if line.endswith('*/'):
+                text = line.replace('/*', '').replace('*/', '')
+                append(Element('Boneyard', text, original_line=linenum,
+                    original_content=line))
+                is_comment_block = False
+                newlines_before = 0
+            else:
+                is_comment_block = True
+                comment_text.append('')
+            continue
+
+        full_strip = line.strip()
+
+        if full_strip.endswith('*/'):
+            comment_text.append(line.replace('*/', '').strip())
+            append(Element('Boneyard', '\n'.join(comment_text),
+                original_line=linenum, original_content=line))
+            is_comment_block = False
+            comment_text = []
+            newlines_before = 0
+            continue
+
+        if is_comment_block:
+            comment_text.append(line)
+            continue
+
+        leading = match_leading(line)
+        kind = leading.lastgroup if leading else None
+
+        if kind == 'page_break':
+            append(Element('Page Break', line, original_line=linenum,
+                original_content=line))
+            newlines_before = 0
+            continue
+
+        if kind == 'synopsis':
+            append(Element('Synopsis', full_strip[1:].strip(),
+                original_line=linenum, original_content=line))
+            continue
+
+        if kind == 'comment' and newlines_before > 0\
+                and full_strip.endswith(']]'):
+            append(Element('Comment', full_strip.strip('[] \t'),
+                original_line=linenum, original_content=line))
+            continue
+
+        if kind == 'section':
+            newlines_before = 0
+            depth = full_strip.split()[0].count('#')
+            append(Element('Section Heading', full_strip[depth:].strip(),
+                section_depth=depth, original_line=linenum,
+                original_content=line))
+            continue
+
+        if kind == 'scene_dot':
+            newlines_before = 0
+            name, number = _split_scene_number(full_strip, 1)
+            append(Element('Scene Heading', name, scene_number=number,
+                original_line=linenum, original_content=line))
+            continue
+
+        if kind == 'scene_int':
+            newlines_before = 0
+            words = line.split()
+            name_start = line.find(words[1]) if len(words) > 1\
+                else len(full_strip)
+            name, number = _split_scene_number(full_strip, name_start)
+            append(Element('Scene Heading', name, scene_number=number,
+                original_line=linenum, scene_abbreviation=words[0],
+                original_content=line))
+            continue
+
+        if full_strip.endswith(' TO:') or full_strip in COMMON_TRANSITIONS:
+            newlines_before = 0
+            append(Element('Transition', full_strip, original_line=linenum,
+                original_content=line))
+            continue
+
+        first = full_strip[0]
+        if first == '>':
+            newlines_before = 0
+            if len(full_strip) > 1 and full_strip[-1] == '<':
+                append(Element('Action', full_strip[1:-1].strip(),
+                    is_centered=True, original_line=linenum,
+                    original_content=line))
+            else:
+                append(Element('Transition', full_strip[1:].strip(),
+                    original_line=linenum, original_content=line))
+            continue
+
+        if (
+            newlines_before > 0 and
+            (script_body[linenum + 1] if linenum < last_linenum else more) and
+            first not in NOT_CHARACTER_START and
+            (first == '@' or match_upper(full_strip))
+        ):
+            newlines_before = 0
+            if full_strip[-1] == '^':
+                if last_character is not None:
+                    last_character.is_dual_dialogue = True
+                last_character = Element('Character',
+                    full_strip.lstrip('@').rstrip('^').strip(),
+                    is_dual_dialogue=True, original_line=linenum,
+                    original_content=line)
+            else:
+                last_character = Element('Character', full_strip.lstrip('@'),
+                    original_line=linenum, original_content=line)
+            append(last_character)
+            is_inside_dialogue_block = True
+            continue
+
+        if is_inside_dialogue_block:
+            if newlines_before == 0 and first == '(':
+                append(Element('Parenthetical', full_strip,
+                    original_line=linenum, original_content=line))
+            elif elements[-1].element_type == 'Dialogue':
+                elements[-1].element_text += '\n' + full_strip
+            else:
+                append(Element('Dialogue', full_strip, original_line=linenum,
+                    original_content=line))
+            continue
+
+        if newlines_before == 0 and elements:
+            elements[-1].element_text += '\n' + full_strip
+        else:
+            append(Element('Action', full_strip, original_line=linenum,
+                original_content=line))
+            newlines_before = 0
+
+    return elements
@@ -0,0 +1,43 @@
+import json
+from django.core.management.base import BaseCommand
+from script.bench_func import BENCH_SIZES, run_benchmarks
+
+
+class Command(BaseCommand):
+    '''合成した日本語の台本で Fountain の解析の処理時間を新旧の実装で計測する
+    
+    ex. python manage.py bench_fountain --sizes medium large --output bench.json
+    '''
+    help = 'Fountain の解析の処理時間を新旧の実装で計測します。'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=list(BENCH_SIZES),
+            default=list(BENCH_SIZES), help='計測する台本の規模')
+        parser.add_argument('--repeat', type=int, default=5,
+            help='実装ごとの解析回数')
+        parser.add_argument('--seed', type=int, default=0,
+            help='乱数の種')
+        parser.add_argument('--output', help='JSON のレポートの出力先')
+    
+    def handle(self, *args, **options):
+        sizes = {name: BENCH_SIZES[name] for name in options['sizes']}
+        report = run_benchmarks(sizes=sizes, repeat=options['repeat'],
+            seed=options['seed'])
+        
+        for size_report in report['sizes']:
+            self.stdout.write('[{}] {} lines, {} chars, {} elements{}'.format(
+                size_report['name'], size_report['lines'],
+                size_report['chars'], size_report['elements'],
+                '' if size_report['same'] else ' (結果が異なります)'))
+            for parser_name, result in size_report['parsers'].items():
+                self.stdout.write(
+                    '  {:<10} {:>9.2f} ms (min {:>9.2f} ms)'
+                    ' {:>10} lines/s {:>10.1f} KiB'.format(parser_name,
+                        result['median_ms'], result['min_ms'],
+                        result['lines_per_sec'], result['memory_kib']))
+            self.stdout.write('  speedup    x{}'.format(size_report['speedup']))
+        
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write('{} に書き出しました。'.format(options['output']))
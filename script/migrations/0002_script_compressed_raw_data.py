@@ -0,0 +1,67 @@
+from django.db import migrations, models
+import script.fields
+
+
+def compress_raw_data(apps, schema_editor):
+    '''台本データを圧縮した列に移し、文字数と行数を数える
+    '''
+    Script = apps.get_model('script', 'Script')
+    for script in Script.objects.only('id', 'raw_data').iterator(
+            chunk_size=100):
+        script.compressed_data = script.raw_data
+        script.data_size = len(script.raw_data)
+        script.line_count = len(script.raw_data.splitlines())
+        script.save(update_fields=['compressed_data', 'data_size',
+            'line_count'])
+
+
+def decompress_raw_data(apps, schema_editor):
+    '''圧縮した列の台本データを、テキストの列に戻す
+    '''
+    Script = apps.get_model('script', 'Script')
+    for script in Script.objects.only('id', 'compressed_data').iterator(
+            chunk_size=100):
+        script.raw_data = script.compressed_data
+        script.save(update_fields=['raw_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='script',
+            name='format',
+            field=models.IntegerField(choices=[(1, 'Fountain JA'), (2, 'sp.yaml')], default=2, verbose_name='フォーマット'),
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='data_size',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='文字数'),
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='行数'),
+        ),
+        # text の列を bytea などに型変換はできないので、新しい列に移す
+        migrations.AddField(
+            model_name='script',
+            name='compressed_data',
+            field=script.fields.CompressedTextField(blank=True, default='', verbose_name='データ'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(compress_raw_data, decompress_raw_data),
+        migrations.RemoveField(
+            model_name='script',
+            name='raw_data',
+        ),
+        migrations.RenameField(
+            model_name='script',
+            old_name='compressed_data',
+            new_name='raw_data',
+        ),
+    ]
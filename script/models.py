@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.db import models
 from production.models import Production, ProdUser
+from .fields import CompressedTextField
 
 
 class Script(models.Model):
@@ -8,7 +9,13 @@ class Script(models.Model):
     '''
     title = models.CharField('題名', max_length=50)
     author = models.CharField('著者', max_length=50, blank=True)
-    raw_data = models.TextField('データ', blank=True)
+    # 圧縮して保存する (一覧などでは defer('raw_data') で読み込まない)
+    raw_data = CompressedTextField('データ', blank=True)
+    # raw_data を読み込まずに表示できるように、保存時に数えておく
+    data_size = models.PositiveIntegerField('文字数', default=0,
+        editable=False)
+    line_count = models.PositiveIntegerField('行数', default=0,
+        editable=False)
     FORMAT_CHOICES = (
         (1, 'Fountain JA'),
         (2, 'sp.yaml'),
@@ -31,3 +38,14 @@ class Script(models.Model):
     
     def __str__(self):
         return self.title
+    
+    def save(self, *args, **kwargs):
+        # 台本データを読み込んでいれば、文字数と行数を数え直す
+        if 'raw_data' not in self.get_deferred_fields():
+            self.data_size = len(self.raw_data)
+            self.line_count = len(self.raw_data.splitlines())
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'raw_data' in update_fields:
+                kwargs['update_fields'] = {*update_fields,
+                    'data_size', 'line_count'}
+        super().save(*args, **kwargs)
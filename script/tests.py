@@ -1,3 +1,622 @@
+from unittest import mock
+import yaml
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from accounts.models import User
+from production.models import Production, ProdUser
+from rehearsal.models import Character, Scene, Appearance, Actor, ScnComment
+from rehearsal.cache_func import flush_data_version_bumps
+from .models import Script
+from .fields import compress_text, decompress_text
+from .cache_func import ParsedScriptCache, parsed_script_cache
+from .chunk_func import split_fountain, fountain_chunk_data,\
+    chunked_data_from_fountain, chunked_data_from_sp_yaml
+from .views import view_func
+from .views.view_func import add_data_from_script, data_from_sp_yaml,\
+    update_data_from_script, html_from_sp_yaml, html_from_fountain,\
+    stream_script_html, data_from_fountain, data_from_script
+from .fountain import fountain, tokenizer
+from .bench_func import synthetic_fountain, elements_signature, run_benchmarks
 
-# Create your tests here.
+
+SP_YAML = """
+meta:
+  title: テスト
+characters:
+  - name: 太郎
+    alias: [たろう]
+  - name: 花子
+scenes:
+  - name: 1場
+    body: |
+      太郎: こんにちは
+      花子: こんにちは
+      たろう: さようなら
+  - name: 2場
+    body: |
+      花子: ひとり
+"""
+
+
+def sp_yaml_with_scenes(num_scenes, num_characters=6):
+    '''シーンごとに3人が1行ずつ話す、num_scenes 場の sp.yaml
+    '''
+    lines = ['scenes:']
+    for scn_idx in range(num_scenes):
+        lines.append('  - name: {}場'.format(scn_idx + 1))
+        lines.append('    body: |')
+        lines.extend('      人物{}: セリフ'.format(
+                (scn_idx + chr_idx) % num_characters)
+            for chr_idx in range(3))
+    return '\n'.join(lines) + '\n'
+
+
+class AddDataFromScriptTest(TestCase):
+    '''台本から公演のデータを追加するテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.script = Script.objects.create(title='テスト', format=2,
+            raw_data=SP_YAML, owner=cls.user)
+    
+    def test_import(self):
+        prod = Production.objects.create(name='公演')
+        Character.objects.create(production=prod, name='古い登場人物')
+        
+        # 版はコミット時に進める
+        with self.captureOnCommitCallbacks(execute=True):
+            result = add_data_from_script(prod.id, self.script.id)
+            self.assertEqual(Production.objects.get(pk=prod.pk)
+                .data_version, 0)
+        self.assertEqual((result['characters'], result['scenes'],
+            result['appearances']), (2, 2, 3))
+        
+        self.assertEqual(list(Character.objects.filter(production=prod)
+            .values_list('name', flat=True)), ['太郎', '花子'])
+        self.assertEqual(list(Scene.objects.filter(production=prod)
+            .values_list('name', 'length')), [('1場', 3), ('2場', 1)])
+        self.assertEqual(sorted(Appearance.objects.filter(
+                scene__production=prod).values_list(
+                'scene__name', 'character__name', 'lines_num')),
+            [('1場', '太郎', 2), ('1場', '花子', 1), ('2場', '花子', 1)])
+        self.assertGreater(Production.objects.get(pk=prod.pk).data_version,
+            0)
+    
+    def test_rollback(self):
+        # 途中で失敗したら、既存のデータの削除も含めて元に戻る
+        prod = Production.objects.create(name='公演')
+        Character.objects.create(production=prod, name='古い登場人物')
+        
+        with mock.patch.object(Appearance.objects, 'bulk_create',
+                side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                add_data_from_script(prod.id, self.script.id)
+        
+        self.assertEqual(list(Character.objects.filter(production=prod)
+            .values_list('name', flat=True)), ['古い登場人物'])
+        self.assertFalse(Scene.objects.filter(production=prod).exists())
+    
+    def test_reimport_queries(self):
+        # 出番のある公演に取り込み直しても、行数によらずクエリ数は一定
+        # (削除で行ごとに版の更新や稽古可能性の予約が走らない)
+        prod = Production.objects.create(name='公演')
+        script = Script.objects.create(title='大きな台本', format=2,
+            raw_data=sp_yaml_with_scenes(30), owner=self.user)
+        add_data_from_script(prod.id, script.id)
+        self.assertEqual(Appearance.objects.filter(
+            scene__production=prod).count(), 90)
+        # 前の処理の予約が残っていると、クエリ数が変わるので済ませておく
+        flush_data_version_bumps()
+        version = Production.objects.get(pk=prod.pk).data_version
+        
+        with self.assertNumQueries(19):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = add_data_from_script(prod.id, script.id)
+        self.assertEqual(result['appearances'], 90)
+        self.assertEqual(Production.objects.get(pk=prod.pk).data_version,
+            version + 1)
+    
+    def test_yaml_error(self):
+        self.assertEqual(data_from_sp_yaml('a: [b'), ({}, [], [], []))
+
+
+SP_YAML_UPDATED = """
+meta:
+  title: テスト
+scenes:
+  - name: 1場
+    body: |
+      太郎: こんにちは
+      太郎: さようなら
+      次郎: やあ
+  - name: 第2場
+    body: |
+      次郎: ひとり
+  - name: 3場
+    body: |
+      太郎: おわり
+"""
+
+
+class UpdateDataFromScriptTest(TestCase):
+    '''台本で既存の公演を差分で更新するテスト
+    '''
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='password')
+        cls.script = Script.objects.create(title='テスト', format=2,
+            raw_data=SP_YAML, owner=cls.user)
+    
+    def setUp(self):
+        self.prod = Production.objects.create(name='公演')
+        add_data_from_script(self.prod.id, self.script.id)
+        self.scenes = list(Scene.objects.filter(production=self.prod))
+        self.taro = Character.objects.get(production=self.prod, name='太郎')
+        
+        # 台本にない、公演で付け加えたデータ
+        actor = Actor.objects.create(production=self.prod, name='役者')
+        self.taro.cast = actor
+        self.taro.save()
+        self.scenes[0].progress = 50
+        self.scenes[0].save()
+        ScnComment.objects.create(scene=self.scenes[0], comment='コメント')
+    
+    def test_no_change(self):
+        result = update_data_from_script(self.prod.id, self.script.id)
+        for key in ('characters', 'scenes', 'appearances'):
+            self.assertEqual(result[key],
+                {'created': 0, 'updated': 0, 'deleted': 0})
+    
+    def test_update(self):
+        self.script.raw_data = SP_YAML_UPDATED
+        self.script.save()
+        result = update_data_from_script(self.prod.id, self.script.id)
+        
+        # 花子は位置で次郎に対応づく (改名)
+        self.assertEqual(result['characters'],
+            {'created': 0, 'updated': 1, 'deleted': 0})
+        self.assertEqual(result['scenes'],
+            {'created': 1, 'updated': 1, 'deleted': 0})
+        
+        # id、完成度、コメント、配役が残る
+        scenes = list(Scene.objects.filter(production=self.prod))
+        self.assertEqual([scene.name for scene in scenes],
+            ['1場', '第2場', '3場'])
+        self.assertEqual(scenes[0].id, self.scenes[0].id)
+        self.assertEqual(scenes[1].id, self.scenes[1].id)
+        self.assertEqual(scenes[0].progress, 50)
+        self.assertEqual(scenes[0].length, 3)
+        self.assertTrue(ScnComment.objects.filter(scene=scenes[0]).exists())
+        self.assertIsNotNone(Character.objects.get(pk=self.taro.pk).cast)
+        
+        self.assertEqual(sorted(Appearance.objects.filter(
+                scene__production=self.prod).values_list(
+                'scene__name', 'character__name', 'lines_num')),
+            [('1場', '太郎', 2), ('1場', '次郎', 1), ('3場', '太郎', 1),
+                ('第2場', '次郎', 1)])
+    
+    def test_remove_many_queries(self):
+        # シーンや登場人物を多く削除しても、削除した数によらずクエリ数は一定
+        script = Script.objects.create(title='大きな台本', format=2,
+            raw_data=sp_yaml_with_scenes(30), owner=self.user)
+        update_data_from_script(self.prod.id, script.id)
+        script.raw_data = sp_yaml_with_scenes(2, num_characters=3)
+        script.save()
+        # 前の処理の予約が残っていると、クエリ数が変わるので済ませておく
+        flush_data_version_bumps()
+        version = Production.objects.get(pk=self.prod.pk).data_version
+        
+        with self.assertNumQueries(20):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = update_data_from_script(self.prod.id, script.id)
+        self.assertEqual(result['scenes']['deleted'], 28)
+        self.assertEqual(result['characters']['deleted'], 3)
+        self.assertEqual(Production.objects.get(pk=self.prod.pk)
+            .data_version, version + 1)
+    
+    def test_view(self):
+        ProdUser.objects.create(production=self.prod, user=self.user,
+            is_owner=True)
+        self.client.force_login(self.user)
+        url = '/scrpt/prod_update_from_scrpt/{}/'.format(self.script.id)
+        self.assertContains(self.client.get(url), '公演')
+        
+        # 権限のない公演は選べない
+        other = Production.objects.create(name='他の公演')
+        response = self.client.post(url, {'production': other.id})
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.post(url, {'production': self.prod.id})
+        self.assertEqual(response.status_code, 302)
+    
+    def test_view_unreadable(self):
+        # フォーマットが不明で読み込めない台本は、理由と警告を表示する
+        ProdUser.objects.create(production=self.prod, user=self.user,
+            is_owner=True)
+        self.client.force_login(self.user)
+        script = Script.objects.create(title='不明', format=0,
+            raw_data=SP_YAML, owner=self.user)
+        url = '/scrpt/prod_update_from_scrpt/{}/'.format(script.id)
+        response = self.client.post(url, {'production': self.prod.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([str(message) for message
+                in response.context['messages']],
+            ['台本のデータを読み込めませんでした。', '更新できませんでした。'])
+
+
+class ParsedScriptCacheTest(TestCase):
+    '''台本の解析結果のキャッシュのテスト
+    '''
+    
+    def setUp(self):
+        parsed_script_cache.clear()
+    
+    def test_memoized(self):
+        parse = mock.Mock(side_effect=lambda text: text.upper())
+        cache = ParsedScriptCache(1000)
+        entry = cache.get('abc', 2, parse)
+        self.assertIs(cache.get('abc', 2, parse), entry)
+        self.assertEqual(parse.call_count, 1)
+        # フォーマットが違えば別のもの
+        self.assertIsNot(cache.get('abc', 1, parse), entry)
+        
+        build = mock.Mock(return_value='html')
+        self.assertEqual(entry.memo('html', build), 'html')
+        self.assertEqual(entry.memo('html', build), 'html')
+        self.assertEqual(build.call_count, 1)
+    
+    def test_lru(self):
+        cache = ParsedScriptCache(100)
+        a = cache.get('a' * 10, 2, str)
+        cache.get('b' * 10, 2, str)
+        # a を使ったので、溢れた時は b が消える
+        cache.get('a' * 10, 2, str)
+        cache.get('c' * 10, 2, str)
+        self.assertIs(cache.get('a' * 10, 2, str), a)
+        self.assertLessEqual(cache.size, 100)
+        self.assertEqual(len(cache._entries), 2)
+        
+        # HTML などの大きさも数える
+        a.memo('html', lambda document: 'x' * 50)
+        self.assertEqual(len(cache._entries), 1)
+    
+    def test_html(self):
+        with mock.patch('yaml.safe_load', wraps=yaml.safe_load) as safe_load:
+            html = html_from_sp_yaml(SP_YAML)
+            self.assertIn('1場', html)
+            self.assertEqual(html_from_sp_yaml(SP_YAML), html)
+            data_from_sp_yaml(SP_YAML)
+            self.assertEqual(safe_load.call_count, 1)
+        self.assertIn('YAML Parse Error', html_from_sp_yaml('a: [b'))
+        self.assertIn('<h2>', html_from_fountain('Title: T\n\n.SCENE\n\nAction.'))
+    
+    def test_invalidated_on_update(self):
+        user = User.objects.create_user('owner', password='password')
+        script = Script.objects.create(title='テスト', format=2,
+            raw_data=SP_YAML, owner=user)
+        html_from_sp_yaml(SP_YAML)
+        self.assertEqual(len(parsed_script_cache._entries), 1)
+        
+        self.client.force_login(user)
+        response = self.client.post(
+            '/scrpt/scrpt_update/{}/'.format(script.id),
+            {'title': 'テスト', 'author': '', 'public_level': 1, 'format': 2,
+                'raw_data': SP_YAML_UPDATED})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(parsed_script_cache._entries), 0)
+
+
+class ScriptViewerTest(TestCase):
+    '''台本のビューアの HTML のテスト
+    '''
+    
+    def setUp(self):
+        parsed_script_cache.clear()
+    
+    def test_escape(self):
+        text = SP_YAML.replace('こんにちは', '<script>alert(1)</script>')
+        html = html_from_sp_yaml(text)
+        self.assertNotIn('<script>', html)
+        self.assertIn('&lt;script&gt;', html)
+        
+        html = html_from_fountain('Title: <b>T</b>\n\n.SCENE\n\nA & B')
+        self.assertNotIn('<b>', html)
+        self.assertIn('A &amp; B', html)
+    
+    def test_stream(self):
+        text = SP_YAML + ''.join(
+            '  - name: {}場\n    body: |\n      太郎: セリフ\n'.format(i)
+            for i in range(3, 500))
+        chunks = list(stream_script_html(text, 2, chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        html = ''.join(chunks)
+        # 最後まで返したら、キャッシュの HTML と同じものになる
+        self.assertEqual(html, html_from_sp_yaml(text))
+        self.assertEqual(''.join(stream_script_html(text, 2)), html)
+    
+    def test_stream_chunks(self):
+        # 大きな台本は、全体を解析せずにチャンクごとに解析しながら返す
+        texts = [
+            (1, FOUNTAIN_EDGES),
+            (1, synthetic_fountain(30, 5, seed=1)),
+            (2, SP_YAML),
+            # アンカーがあればチャンクに分けずに解析する
+            (2, SP_YAML.replace('- name: 花子', '- name: &h 花子')),
+        ]
+        with mock.patch.object(view_func, 'STREAM_MIN_SIZE', 0):
+            for format, text in texts:
+                with mock.patch.object(view_func, 'parse_fountain',
+                        side_effect=AssertionError) as parse_fountain:
+                    html = ''.join(stream_script_html(text, format,
+                        chunk_size=256))
+                parse_fountain.assert_not_called()
+                self.assertIsNone(parsed_script_cache.peek(text, format))
+                expected = html_from_fountain(text) if format == 1\
+                    else html_from_sp_yaml(text)
+                self.assertEqual(html, expected)
+            
+            # 途中のシーンがエラーなら、送ったシーンの後にエラーを表示する
+            text = SP_YAML + '  - name: 3場\n    body: [\n'
+            html = ''.join(stream_script_html(text, 2))
+        self.assertIn('2場', html)
+        self.assertIn('YAML Parse Error', html)
+        self.assertLess(html.index('2場'), html.index('YAML Parse Error'))
+    
+    def test_memo_max_size(self):
+        # 大きな HTML はキャッシュに入れない
+        with mock.patch.object(view_func, 'HTML_MEMO_MAX_SIZE', 100):
+            html = ''.join(stream_script_html(SP_YAML, 2, chunk_size=64))
+        entry = parsed_script_cache.peek(SP_YAML, 2)
+        self.assertIsNone(entry.result('html'))
+        
+        ''.join(stream_script_html(SP_YAML, 2, chunk_size=64))
+        self.assertEqual(entry.result('html'), html)
+    
+    def test_view(self):
+        user = User.objects.create_user('owner', password='password')
+        script = Script.objects.create(title='テスト', format=2,
+            raw_data=SP_YAML, owner=user)
+        self.client.force_login(user)
+        response = self.client.get(
+            '/scrpt/scrpt_viewer/{}/'.format(script.id))
+        self.assertTrue(response.streaming)
+        html = b''.join(response.streaming_content).decode()
+        self.assertIn('1場', html)
+
+
+# 判定の境目になる行を集めた Fountain の台本
+FOUNTAIN_EDGES = """Title: Edge
+Credit:
+    Written by
+Author: A
+
+INT. HOUSE - DAY #1A#
+
+int/ext car
+EST. CITY
+I/E. ROOM #2#
+
+.SCENE
+..not a scene
+INTERIOR is action
+continued action
+
+ALICE
+(quietly)
+Hello.
+Still talking.
+
+BOB ^
+Hi.
+
+@bob
+(beat)
+
+[[ note ]]
+   [[ not a comment
+= synopsis line
+## Section ## two
+===
+> centered <
+> TRANSITION
+CUT TO:
+FADE OUT.
+
+/* one line */
+/*
+inside
+
+  lines
+*/
+after
+
+lowercase
+NAME
+"""
+
+
+class FountainTokenizerTest(TestCase):
+    '''Fountain の新しい解析が、元の実装と同じ結果になるかのテスト
+    '''
+    
+    def assertSameParse(self, text):
+        legacy = fountain.LegacyFountain(string=text)
+        new = fountain.Fountain(string=text)
+        self.assertEqual(new.metadata, legacy.metadata)
+        self.assertEqual(elements_signature(new.elements),
+            elements_signature(legacy.elements))
+        return new
+    
+    def test_edges(self):
+        f = self.assertSameParse(FOUNTAIN_EDGES)
+        self.assertEqual(f.metadata['credit'], ['Written by'])
+        types = [e.element_type for e in f.elements]
+        for element_type in ('Scene Heading', 'Character', 'Parenthetical',
+                'Dialogue', 'Comment', 'Synopsis', 'Section Heading',
+                'Page Break', 'Transition', 'Boneyard', 'Action'):
+            self.assertIn(element_type, types)
+        self.assertEqual(f.elements[0].scene_number, '1A')
+        self.assertEqual(f.elements[0].scene_abbreviation, 'INT.')
+    
+    def test_variants(self):
+        # 改行コード、メタデータだけ、本文だけ、空
+        self.assertSameParse(FOUNTAIN_EDGES.replace('\n', '\r\n'))
+        self.assertSameParse('Title: Only')
+        self.assertSameParse(FOUNTAIN_EDGES.split('\n\n', 1)[1])
+        self.assertSameParse('')
+        self.assertEqual(fountain.Fountain(string='  \n').elements, [])
+    
+    def test_synthetic(self):
+        for seed in range(3):
+            self.assertSameParse(synthetic_fountain(scenes=30, seed=seed))
+    
+    def test_elements(self):
+        f = fountain.Fountain(string='.SCENE\n\n\nAction.')
+        # 要素は __slots__ で、空行は1つの要素を共有する
+        self.assertFalse(hasattr(f.elements[0], '__dict__'))
+        self.assertIs(f.elements[1], tokenizer.EMPTY_LINE)
+        self.assertIs(f.elements[2], f.elements[1])
+    
+    def test_benchmark(self):
+        report = run_benchmarks(sizes={'tiny': {'scenes': 3, 'characters': 3}},
+            repeat=1)
+        size_report = report['sizes'][0]
+        self.assertTrue(size_report['same'])
+        self.assertEqual(set(size_report['parsers']), {'legacy', 'tokenizer'})
+
+
+class ChunkedParseTest(TestCase):
+    '''大きな台本をチャンクに分けて解析するテスト
+    '''
+    
+    def setUp(self):
+        parsed_script_cache.clear()
+    
+    def sp_yaml(self, scenes):
+        return SP_YAML + ''.join(
+            '  - name: {}場\n    body: |\n      太郎: セリフ\n'
+            '      花子: セリフ\n'.format(i) for i in range(3, scenes))
+    
+    def test_fountain(self):
+        text = synthetic_fountain(scenes=40)
+        metadata, chunks = split_fountain(text)
+        self.assertGreater(len(chunks), 40)
+        self.assertEqual(chunked_data_from_fountain(text, workers=1),
+            data_from_fountain(text))
+    
+    def test_sp_yaml(self):
+        text = self.sp_yaml(50)
+        self.assertEqual(chunked_data_from_sp_yaml(text, workers=1),
+            data_from_sp_yaml(text))
+        self.assertEqual(chunked_data_from_sp_yaml(
+            text.replace('\n', '\r\n'), workers=1), data_from_sp_yaml(text))
+        
+        # 区切れない書き方は全体を解析する
+        self.assertIsNone(chunked_data_from_sp_yaml(
+            text.replace('- name: 1場', '- name: &s 1場'), workers=1))
+        self.assertIsNone(chunked_data_from_sp_yaml(
+            'scenes: [{name: 1場}]', workers=1))
+    
+    def test_edit_one_scene(self):
+        text = synthetic_fountain(scenes=40)
+        chunked_data_from_fountain(text, workers=1)
+        
+        # 1つのシーンを変えたら、そのチャンクだけを解析し直す
+        edited = text.replace('@', '@　', 1)
+        with mock.patch('script.chunk_func.fountain_chunk_data',
+                wraps=fountain_chunk_data) as chunk_data:
+            data = chunked_data_from_fountain(edited, workers=1)
+        self.assertEqual(chunk_data.call_count, 1)
+        self.assertEqual(data, data_from_fountain(edited))
+    
+    def test_process_pool(self):
+        text = self.sp_yaml(20)
+        self.assertEqual(chunked_data_from_sp_yaml(text, workers=2),
+            data_from_sp_yaml(text))
+    
+    def test_data_from_script(self):
+        user = User.objects.create_user('owner', password='password')
+        script = Script.objects.create(title='テスト', format=2,
+            raw_data=self.sp_yaml(10), owner=user)
+        with mock.patch('script.chunk_func.CHUNK_MIN_SIZE', 0),\
+                mock.patch('script.chunk_func.chunked_data_from_sp_yaml',
+                    wraps=chunked_data_from_sp_yaml) as chunked:
+            data = data_from_script(script)
+        self.assertEqual(chunked.call_count, 1)
+        self.assertEqual(data, data_from_sp_yaml(script.raw_data))
+
+
+class CompressedScriptTest(TestCase):
+    '''台本データを圧縮して保存するテスト
+    '''
+    
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+    
+    def stored_data(self, script):
+        '''データベースに保存された台本データの bytes
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT raw_data FROM script_script WHERE id = %s',
+                [script.id])
+            return bytes(cursor.fetchone()[0])
+    
+    def test_compress(self):
+        self.assertEqual(decompress_text(compress_text('')), '')
+        self.assertEqual(compress_text('短い'), b'\x00' + '短い'.encode())
+        text = SP_YAML * 20
+        data = compress_text(text)
+        self.assertEqual(data[:1], b'\x01')
+        self.assertLess(len(data), len(text.encode()))
+        self.assertEqual(decompress_text(data), text)
+        with self.assertRaises(ValueError):
+            decompress_text(b'\x09abc')
+    
+    def test_save(self):
+        script = Script.objects.create(title='テスト', raw_data=SP_YAML * 20,
+            owner=self.user)
+        self.assertEqual(self.stored_data(script)[:1], b'\x01')
+        self.assertEqual(Script.objects.get(pk=script.id).raw_data,
+            SP_YAML * 20)
+        self.assertEqual(script.data_size, len(SP_YAML) * 20)
+        self.assertEqual(script.line_count, len(SP_YAML.splitlines()) * 20)
+        
+        # 台本データを読み込まずに保存したら、文字数と行数は変えない
+        deferred = Script.objects.defer('raw_data').get(pk=script.id)
+        deferred.title = '変更'
+        deferred.save()
+        script.refresh_from_db()
+        self.assertEqual(script.data_size, len(SP_YAML) * 20)
+        
+        script.raw_data = 'a\nb'
+        script.save(update_fields=['raw_data'])
+        script.refresh_from_db()
+        self.assertEqual((script.data_size, script.line_count), (3, 2))
+    
+    def test_views(self):
+        script = Script.objects.create(title='テスト', raw_data=SP_YAML,
+            owner=self.user)
+        self.client.force_login(self.user)
+        
+        # 一覧では台本データを読み込まない
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/scrpt/')
+        self.assertContains(response, 'テスト')
+        self.assertFalse(any('raw_data' in query['sql']
+            for query in queries.captured_queries))
+        
+        response = self.client.post('/scrpt/scrpt_update/{}/'.format(
+            script.id), {'title': 'テスト', 'author': '', 'public_level': 1,
+            'format': 2, 'raw_data': 'meta:\n  title: x'})
+        self.assertEqual(response.status_code, 302)
+        script.refresh_from_db()
+        self.assertEqual(script.raw_data, 'meta:\n  title: x')
+        self.assertEqual(script.line_count, 2)
+        
+        response = self.client.get('/scrpt/scrpt_detail/{}/'.format(
+            script.id))
+        self.assertContains(response, 'title: x</textarea>')
@@ -22,4 +22,7 @@ urlpatterns = [
     # /scrpt/prod_from_scrpt/1/ -> Create Production from Script #1
     path('prod_from_scrpt/<int:scrpt_id>/', views.ProdFromScript.as_view(),
          name='prod_from_scrpt'),
+    # /scrpt/prod_update_from_scrpt/1/ -> Update Production from Script #1
+    path('prod_update_from_scrpt/<int:scrpt_id>/',
+         views.ProdUpdateFromScript.as_view(), name='prod_update_from_scrpt'),
 ]
\ No newline at end of file
@@ -1,177 +1,473 @@
+import time
 import yaml
+from django.conf import settings
+from django.db import transaction
+from django.utils.html import escape
 from production.models import Production
 from rehearsal.models import Character, Scene, Appearance
+from rehearsal.cache_func import schedule_data_version_bump
+from rehearsal.psblty_func import schedule_possibility_update
+from rehearsal.signals import suppress_data_signals
 from ..fountain import fountain
 from ..models import Script
+from ..cache_func import parsed_script_cache
+from ..chunk_func import chunked_data, fountain_scene_data,\
+    sp_yaml_alias_map, sp_yaml_scene_lines, sp_yaml_scene_data,\
+    iter_fountain_elements, split_sp_yaml, sp_yaml_chunk_scene
+
+
+# ビューアの HTML の前後
+HTML_HEAD = """<html lang="ja">
+        <head>
+            <meta charset="utf-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0, user-scalable=yes">
+            <style>
+                body { line-height: 1.6; font-family: sans-serif; }
+                h1, h2, h3 { margin-top: 1.5em; margin-bottom: 0.5em; }
+                p { margin: 0.5em 0; }
+            </style>
+        </head>
+        <body>"""
+HTML_TAIL = """</body>
+    </html>"""
+
+# この大きさ (文字数) 以上の台本は、ビューアでは全体を解析せずに、
+# シーンごとのチャンクを解析しながら HTML を送る (解析結果はキャッシュしない)
+STREAM_MIN_SIZE = getattr(settings, 'SCRIPT_STREAM_MIN_SIZE', 64 * 1024)
+
+# この大きさ (文字数) までのビューアの HTML を、解析結果と一緒にキャッシュする
+HTML_MEMO_MAX_SIZE = getattr(settings, 'SCRIPT_HTML_MEMO_MAX_SIZE',
+    1024 * 1024)
+
+
+def parse_sp_yaml(text):
+    """sp.yaml フォーマットの台本を解析 (エラーならその例外を返す)"""
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        return e
+
+
+def parse_fountain(text):
+    """Fountain フォーマットの台本を解析"""
+    return fountain.Fountain(string=text)
+
+
+def parsed_script(text, format):
+    """台本の解析結果 (ParsedScript) を、台本データのハッシュごとのキャッシュから得る"""
+    parse = parse_fountain if format == 1 else parse_sp_yaml
+    return parsed_script_cache.get(text, format, parse)
 
 
 def data_from_sp_yaml(text):
     """sp.yaml フォーマットの台本からデータを取得"""
-    try:
-        data = yaml.safe_load(text)
-    except yaml.YAMLError:
-        return [], [], []
+    return parsed_script(text, 2).memo('data', _data_from_sp_yaml)
+
+
+def _data_from_sp_yaml(data):
+    """解析済みの sp.yaml フォーマットの台本からデータを取得"""
+    if isinstance(data, yaml.YAMLError):
+        return {}, [], [], []
 
     # dataがNoneや辞書でない場合に対応
     if not isinstance(data, dict):
-        return [], [], []
+        return {}, [], [], []
 
     meta = data.get("meta", {})
 
     # 登場人物の別名を本名に変換するためのマップを作成
-    alias_to_main_name_map = {}
-    if 'characters' in data and isinstance(data.get('characters'), list):
-        for char_data in data.get('characters', []):
-            main_name = char_data.get('name')
-            if not main_name:
-                continue
-            # 本名自身もマップに追加
-            alias_to_main_name_map[main_name] = main_name
-            # 別名をマップに追加
-            for alias in char_data.get('alias', []):
-                alias_to_main_name_map[alias] = main_name
+    alias_to_main_name_map = sp_yaml_alias_map(data)
 
     # 実際にセリフを話した登場人物を抽出しながらデータを生成
-    characters = []
-    scenes = []
-    appearance = []
-    for scene_data in data.get('scenes', []):
-        scene_name = scene_data.get('name', '無題のシーン')
-        scenes.append(scene_name)
+    scene_lines = [sp_yaml_scene_lines(scene_data)
+        for scene_data in data.get('scenes', [])]
+    characters, scenes, appearance = sp_yaml_scene_data(
+        alias_to_main_name_map, scene_lines)
 
-        # セリフ数をカウントして出番データを作成
-        scn_apprs = {}
-        body = scene_data.get('body', '')
-        if body:
-            for line in body.splitlines():
-                if ':' in line:
-                    speaker, _ = line.split(':', 1)
-                    speaker = speaker.strip()
+    return meta, characters, scenes, appearance
 
-                    # 別名マップを使って本名に正規化。マップにない場合は speaker 自身を本名とみなす
-                    main_name = alias_to_main_name_map.get(speaker, speaker)
 
-                    # 登場人物リストに登場順で追加 (重複は避ける)
-                    if main_name not in characters:
-                        characters.append(main_name)
+def html_from_sp_yaml(text):
+    """sp.yaml フォーマットの台本から HTML を生成"""
+    return parsed_script(text, 2).memo('html',
+        lambda data: ''.join(iter_html_from_sp_yaml(data)))
+
+
+def iter_html_from_sp_yaml(data):
+    """解析済みの sp.yaml フォーマットの台本から、HTML を少しずつ生成"""
+    yield HTML_HEAD
+    yield from iter_sp_yaml_html(data)
+    yield HTML_TAIL
+
+
+def iter_html_from_sp_yaml_chunks(text):
+    """sp.yaml フォーマットの台本を、シーンごとのチャンクを解析しながら HTML にする
+
+    全体の解析を待たずに最初の部分を返す
+    チャンクに分けられなければ、全体を解析してから返す
+    """
+    yield HTML_HEAD
+    split = split_sp_yaml(text)
+    head = parse_sp_yaml(split[0]) if split is not None else None
+    if not isinstance(head, dict):
+        # 区切れないか、scenes 以外の部分がエラーなら、全体を解析する
+        yield from iter_sp_yaml_html(parse_sp_yaml(text))
+        yield HTML_TAIL
+        return
 
-                    # セリフ数をカウント
-                    scn_apprs[main_name] = scn_apprs.get(main_name, 0) + 1
-        appearance.append(scn_apprs)
+    yield from iter_sp_yaml_meta_html(head)
+    chunks = split[1]
+    for idx, chunk in enumerate(chunks):
+        try:
+            scene_data = sp_yaml_chunk_scene(chunk)
+        except ValueError:
+            # チャンクが解析できなければ、全体の解析結果の続きを返す
+            data = parse_sp_yaml(text)
+            if isinstance(data, yaml.YAMLError):
+                yield sp_yaml_error_html(data)
+            else:
+                for scene_data in data['scenes'][idx:]:
+                    yield from iter_sp_yaml_scene_html(scene_data)
+            break
+        yield from iter_sp_yaml_scene_html(scene_data)
 
-    return meta, characters, scenes, appearance
+    yield HTML_TAIL
 
 
-def html_from_sp_yaml(text):
-    """sp.yaml フォーマットの台本から HTML を生成"""
-    try:
-        data = yaml.safe_load(text)
-    except yaml.YAMLError as e:
-        return f"<h1>YAML Parse Error</h1><p>{e}</p>"
+def iter_sp_yaml_html(data):
+    """解析済みの sp.yaml フォーマットの台本から、HTML の本文を少しずつ生成"""
+    if isinstance(data, yaml.YAMLError):
+        yield sp_yaml_error_html(data)
+        return
 
     # dataがNoneや辞書でない場合に対応
     if not isinstance(data, dict):
         data = {}
 
-    # メタデータからHTMLヘッダを生成
-    meta = data.get('meta', {})
-    content = f"<h1>{meta.get('title', '無題')}</h1>"
-    content += f"<div style='text-align:right;'>{meta.get('author', '作者不明')}</div>"
-    content += "<hr>"
-
-    # シーンごとにHTMLを生成
+    yield from iter_sp_yaml_meta_html(data)
     for scene_data in data.get('scenes', []):
-        content += f"<h2>{scene_data.get('name', '無題のシーン')}</h2>"
-        body = scene_data.get('body', '')
-        if body:
-            for line in body.splitlines():
-                line = line.strip()
-                if ':' in line:
-                    char_name, dialogue = line.split(':', 1)
-                    content += f"<p><strong>{char_name.strip()}:</strong>{dialogue.strip()}</p>"
-                elif line.startswith('(') and line.endswith(')'):
-                    content += f"<p style='margin-left: 2em; color: gray;'>{line}</p>"
-                else:
-                    content += f"<p>{line}</p>"
-        content += "<br>"
-
-    # HTML全体を組み立てる
-    html = f"""<html lang="ja">
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0, user-scalable=yes">
-        </head>
-        <body>{content}</body>
-    </html>"""
-    return html
+        yield from iter_sp_yaml_scene_html(scene_data)
+
+
+def sp_yaml_error_html(error):
+    """sp.yaml の解析エラーの HTML"""
+    return f"<h1>YAML Parse Error</h1><p>{escape(error)}</p>"
+
+
+def iter_sp_yaml_meta_html(data):
+    """sp.yaml のメタデータからHTMLヘッダを生成"""
+    meta = data.get('meta') or {}
+    yield f"<h1>{escape(meta.get('title', '無題'))}</h1>"
+    yield f"<div style='text-align:right;'>{escape(meta.get('author', '作者不明'))}</div>"
+    yield "<hr>"
+
+
+def iter_sp_yaml_scene_html(scene_data):
+    """sp.yaml のシーン1つの HTML を少しずつ生成"""
+    yield f"<h2>{escape(scene_data.get('name', '無題のシーン'))}</h2>"
+    body = scene_data.get('body', '')
+    if body:
+        for line in body.splitlines():
+            line = line.strip()
+            if ':' in line:
+                char_name, dialogue = line.split(':', 1)
+                yield f"<p><strong>{escape(char_name.strip())}:</strong>{escape(dialogue.strip())}</p>"
+            elif line.startswith('(') and line.endswith(')'):
+                yield f"<p style='margin-left: 2em; color: gray;'>{escape(line)}</p>"
+            else:
+                yield f"<p>{escape(line)}</p>"
+    yield "<br>"
+
+
+def data_from_script(script):
+    '''台本のフォーマットに応じてデータを取得
+
+    大きな台本は、シーンごとのチャンクに分けて並列に解析する
+
+    Returns
+    -------
+    (meta, characters, scenes, appearance)、フォーマットが不明なら None
+    '''
+    data = chunked_data(script.raw_data, script.format)
+    if data is not None:
+        return data
+    if script.format == 1:  # Fountain
+        return data_from_fountain(script.raw_data)
+    if script.format == 2:  # sp.yaml
+        return data_from_sp_yaml(script.raw_data)
+    return None
 
 
 def add_data_from_script(prod_id, scrpt_id):
     '''台本を元に公演にシーン、登場人物、出番を追加する
+
+    モデルごとに bulk_create し、全体を1つのトランザクションで行う
+    (途中で失敗したら、既存のデータの削除も含めて元に戻る)
+
+    Returns
+    -------
+    {'characters': 登場人物数, 'scenes': シーン数, 'appearances': 出番数,
+        'parse_sec': 台本の解析の秒数, 'save_sec': 保存の秒数}
+    公演や台本がない、フォーマットが不明なら None
     '''
     # データを追加する公演
     production = Production.objects.filter(pk=prod_id).first()
     if not production:
-        return
+        return None
 
     # 台本データを取得
     script = Script.objects.filter(pk=scrpt_id).first()
     if not script:
-        return
-
-    # 既存のシーン、登場人物、出番データを削除
-    # 外部キー制約のため、関連するモデルから先に削除
-    Appearance.objects.filter(scene__production=production).delete()
-    Scene.objects.filter(production=production).delete()
-    Character.objects.filter(production=production).delete()
+        return None
 
     # 台本のフォーマットに応じてデータを取得
-    if script.format == 1:  # Fountain
-        meta, characters, scenes, appearance = data_from_fountain(script.raw_data)
-    elif script.format == 2:  # sp.yaml
-        meta, characters, scenes, appearance = data_from_sp_yaml(script.raw_data)
-    else:
-        return
-
-    # 登場人物を追加しながらインスタンスを記録する
-    char_instances = {}
-    for idx, char_name in enumerate(characters):
-        character = Character(production=production,
-                              name=char_name, sortkey=idx)
-        character.save()
-        char_instances[char_name] = character
-
-    # シーンと出番を追加 (★バグ修正：ループのネストを解消)
-    for idx, scene_name in enumerate(scenes):
-        # 出番のセリフ数の合計を出しておく
-        scn_appr = appearance[idx]
-        scn_lines_num = sum(scn_appr.values())
-        # インスタンス生成、保存
-        scene = Scene(
-            production=production,
-            name=scene_name,
-            sortkey=idx,
-            length=scn_lines_num,
-            length_auto=True,
-        )
-        scene.save()
-        # 出番の追加
-        for char_name, lines_num in scn_appr.items():
-            # 登場人物が char_instances に存在する場合のみ出番を作成
-            if char_name in char_instances:
-                appr = Appearance(
-                    scene=scene,
-                    character=char_instances[char_name],
-                    lines_num=lines_num,
-                    lines_auto=True,
-                )
-                appr.save()
+    # (解析はトランザクションの外で行う)
+    start = time.perf_counter()
+    data = data_from_script(script)
+    if data is None:
+        return None
+    meta, characters, scenes, appearance = data
+    parsed = time.perf_counter()
+
+    # 削除で行ごとに signals が動かないようにし、版などは最後に1回だけ更新する
+    with transaction.atomic(), suppress_data_signals():
+        # 既存のシーン、登場人物、出番データを削除
+        # 外部キー制約のため、関連するモデルから先に削除
+        Appearance.objects.filter(scene__production=production).delete()
+        Scene.objects.filter(production=production).delete()
+        Character.objects.filter(production=production).delete()
+
+        # 登場人物を追加し、名前からインスタンスを引けるようにする
+        # (bulk_create が返すインスタンスには id がセットされている)
+        char_instances = {character.name: character
+            for character in Character.objects.bulk_create([
+                Character(production=production, name=char_name, sortkey=idx)
+                for idx, char_name in enumerate(characters)])}
+
+        # シーンを追加 (長さは出番のセリフ数の合計)
+        scene_instances = Scene.objects.bulk_create([
+            Scene(
+                production=production,
+                name=scene_name,
+                sortkey=idx,
+                length=sum(appearance[idx].values()),
+                length_auto=True,
+            ) for idx, scene_name in enumerate(scenes)])
+
+        # 出番を追加 (登場人物が char_instances に存在する場合のみ)
+        apprs = Appearance.objects.bulk_create([
+            Appearance(
+                scene=scene,
+                character=char_instances[char_name],
+                lines_num=lines_num,
+                lines_auto=True,
+            )
+            for scene, scn_appr in zip(scene_instances, appearance)
+            for char_name, lines_num in scn_appr.items()
+            if char_name in char_instances])
+
+        # signals の代わりに、公演のデータの版と稽古可能性の更新を
+        # ここで1回だけ予約する
+        # (版はコミット時に、稽古可能性を更新してから進める)
+        schedule_data_version_bump(pk=production.id)
+        schedule_possibility_update(prod_id=production.id)
+
+    return {
+        'characters': len(char_instances),
+        'scenes': len(scene_instances),
+        'appearances': len(apprs),
+        'parse_sec': parsed - start,
+        'save_sec': time.perf_counter() - parsed,
+    }
+
+
+def match_by_name_and_order(names, instances):
+    '''台本の名前のリストに、既存のインスタンスを対応づける
+
+    まず名前が同じもの (同名が複数あれば順番通り) を対応づけ、
+    残りは同じ位置 (sortkey の順での位置) にあるものを対応づける (改名とみなす)
+
+    Parameters
+    ----------
+    names : list of str
+        台本の名前 (台本の順)
+    instances : list
+        既存のインスタンス (sortkey の順)
+
+    Returns
+    -------
+    (names に対応するインスタンスか None のリスト, 対応しなかったインスタンスのリスト)
+    '''
+    by_name = {}
+    for instance in instances:
+        by_name.setdefault(instance.name, []).append(instance)
+
+    matched = [by_name[name].pop(0) if by_name.get(name) else None
+        for name in names]
+    used = {id(instance) for instance in matched if instance is not None}
+
+    # 名前で対応しなかったものは、同じ位置のものが残っていれば対応づける
+    for idx, instance in enumerate(matched):
+        if instance is None and idx < len(instances)\
+                and id(instances[idx]) not in used\
+                and instances[idx].name not in names:
+            matched[idx] = instances[idx]
+            used.add(id(instances[idx]))
+
+    return matched, [instance for instance in instances
+        if id(instance) not in used]
+
+
+def update_data_from_script(prod_id, scrpt_id):
+    '''台本を元に、既存の公演のシーン、登場人物、出番を差分で更新する
+
+    シーンと登場人物は名前と順番で既存のものに対応づけ、変わったものだけ
+    bulk_create / bulk_update / 削除する
+    対応づいたものは id が変わらないので、シーンのコメントや完成度、
+    配役はそのまま残る (台本からなくなったものは削除する)
+
+    Returns
+    -------
+    {'characters': {'created': 追加数, 'updated': 更新数, 'deleted': 削除数},
+        'scenes': {...}, 'appearances': {...}, 'parse_sec': 台本の解析の秒数,
+        'save_sec': 保存の秒数}
+    公演や台本がない、フォーマットが不明なら None
+    '''
+    production = Production.objects.filter(pk=prod_id).first()
+    if not production:
+        return None
+    script = Script.objects.filter(pk=scrpt_id).first()
+    if not script:
+        return None
+
+    start = time.perf_counter()
+    data = data_from_script(script)
+    if data is None:
+        return None
+    meta, characters, scenes, appearance = data
+    parsed = time.perf_counter()
+
+    # 削除で行ごとに signals が動かないようにし、版などは最後に1回だけ更新する
+    with transaction.atomic(), suppress_data_signals():
+        # 登場人物の差分
+        old_chars = list(Character.objects.filter(production=production)
+            .order_by('sortkey', 'id'))
+        matched, chars_to_delete = match_by_name_and_order(characters,
+            old_chars)
+        chars_to_create = []
+        chars_to_update = []
+        char_instances = {}
+        for idx, (char_name, character) in enumerate(zip(characters, matched)):
+            if character is None:
+                character = Character(production=production, name=char_name,
+                    sortkey=idx)
+                chars_to_create.append(character)
+            elif (character.name, character.sortkey) != (char_name, idx):
+                character.name = char_name
+                character.sortkey = idx
+                chars_to_update.append(character)
+            char_instances[char_name] = character
+
+        # シーンの差分 (長さは「適当」のものだけ、セリフ数の合計で更新する)
+        old_scenes = list(Scene.objects.filter(production=production)
+            .order_by('sortkey', 'id'))
+        matched, scenes_to_delete = match_by_name_and_order(scenes,
+            old_scenes)
+        scenes_to_create = []
+        scenes_to_update = []
+        scene_instances = []
+        for idx, (scene_name, scene) in enumerate(zip(scenes, matched)):
+            length = sum(appearance[idx].values())
+            if scene is None:
+                scene = Scene(production=production, name=scene_name,
+                    sortkey=idx, length=length, length_auto=True)
+                scenes_to_create.append(scene)
+            else:
+                if not scene.length_auto:
+                    length = scene.length
+                if (scene.name, scene.sortkey, scene.length)\
+                        != (scene_name, idx, length):
+                    scene.name = scene_name
+                    scene.sortkey = idx
+                    scene.length = length
+                    scenes_to_update.append(scene)
+            scene_instances.append(scene)
+
+        # 台本からなくなったものを削除し (出番・コメントもカスケードで削除)、
+        # 変わったものを更新、新しいものを追加する
+        Character.objects.filter(
+            pk__in=[character.id for character in chars_to_delete]).delete()
+        Scene.objects.filter(
+            pk__in=[scene.id for scene in scenes_to_delete]).delete()
+        Character.objects.bulk_update(chars_to_update, ['name', 'sortkey'])
+        Character.objects.bulk_create(chars_to_create)
+        Scene.objects.bulk_update(scenes_to_update,
+            ['name', 'sortkey', 'length'])
+        Scene.objects.bulk_create(scenes_to_create)
+
+        # 出番の差分 ((シーン id, 登場人物 id) ごと、同じ組が複数あれば最初のもの)
+        old_apprs = {}
+        apprs_to_delete = []
+        for appr in Appearance.objects.filter(
+                scene__production=production).order_by('id'):
+            key = (appr.scene_id, appr.character_id)
+            if key in old_apprs:
+                apprs_to_delete.append(appr)
+            else:
+                old_apprs[key] = appr
+        apprs_to_create = []
+        apprs_to_update = []
+        for scene, scn_appr in zip(scene_instances, appearance):
+            for char_name, lines_num in scn_appr.items():
+                character = char_instances.get(char_name)
+                if character is None:
+                    continue
+                appr = old_apprs.pop((scene.id, character.id), None)
+                if appr is None:
+                    apprs_to_create.append(Appearance(scene=scene,
+                        character=character, lines_num=lines_num,
+                        lines_auto=True))
+                elif appr.lines_num != lines_num:
+                    appr.lines_num = lines_num
+                    apprs_to_update.append(appr)
+        apprs_to_delete.extend(old_apprs.values())
+
+        Appearance.objects.filter(
+            pk__in=[appr.id for appr in apprs_to_delete]).delete()
+        Appearance.objects.bulk_update(apprs_to_update, ['lines_num'])
+        Appearance.objects.bulk_create(apprs_to_create)
+
+        # signals の代わりに、公演のデータの版と稽古可能性の更新を
+        # ここで1回だけ予約する
+        # (版はコミット時に、稽古可能性を更新してから進める)
+        schedule_data_version_bump(pk=production.id)
+        schedule_possibility_update(prod_id=production.id)
+
+    def counts(created, updated, deleted):
+        return {'created': len(created), 'updated': len(updated),
+            'deleted': len(deleted)}
+
+    return {
+        'characters': counts(chars_to_create, chars_to_update,
+            chars_to_delete),
+        'scenes': counts(scenes_to_create, scenes_to_update,
+            scenes_to_delete),
+        'appearances': counts(apprs_to_create, apprs_to_update,
+            apprs_to_delete),
+        'parse_sec': parsed - start,
+        'save_sec': time.perf_counter() - parsed,
+    }
 
 
 def data_from_fountain(text):
     '''Fountain フォーマットの台本からデータを取得
     '''
-    f = fountain.Fountain(string=text)
+    return parsed_script(text, 1).memo('data', _data_from_fountain)
+
+
+def _data_from_fountain(f):
+    '''解析済みの Fountain フォーマットの台本からデータを取得
+    '''
 
     # ★修正: メタデータを取得し、sp.yamlの形式に合わせる
     meta = {}
@@ -179,34 +475,7 @@ def data_from_fountain(text):
         if value:
             meta[key] = value[0]
 
-    characters = []
-    scenes = []
-    appearance = []
-    scn_apprs = {}
-
-    for e in f.elements:
-        if e.element_type == 'Character':
-            if scenes:
-                char_name = e.element_text
-                current_count = scn_apprs.get(char_name, 0)
-                scn_apprs[char_name] = current_count + 1
-                if char_name not in characters:
-                    characters.append(char_name)
-            continue
-        if e.element_type in ('Scene Heading', 'Section Heading'):
-            if scenes:
-                if scenes[-1] == '登場人物':
-                    scenes.pop()
-                else:
-                    appearance.append(scn_apprs)
-                scn_apprs = {}
-            scenes.append(e.element_text)
-
-    if scenes:
-        if scenes[-1] == '登場人物':
-            scenes.pop()
-        else:
-            appearance.append(scn_apprs)
+    characters, scenes, appearance = fountain_scene_data(f.elements)
 
     # ★修正: metaを戻り値に追加
     return meta, characters, scenes, appearance
@@ -215,51 +484,120 @@ def data_from_fountain(text):
 def html_from_fountain(text):
     '''Fountain フォーマットの台本から HTML を生成
     '''
-    f = fountain.Fountain(string=text)
-    content = ''
-    if 'title' in f.metadata:
-        for title in f.metadata['title']:
-            content += f'<h1>{title}</h1>'
-    if 'author' in f.metadata:
-        for author in f.metadata['author']:
-            content += f'<div style="text-align:right;">{author}</div>'
-    content += '<hr>'
-
-    for e in f.elements:
+    return parsed_script(text, 1).memo('html',
+        lambda f: ''.join(iter_html_from_fountain(f)))
+
+
+def iter_html_from_fountain(f):
+    '''解析済みの Fountain フォーマットの台本から、HTML を少しずつ生成
+    '''
+    yield HTML_HEAD
+    yield from iter_fountain_html(f.metadata, f.elements)
+    yield HTML_TAIL
+
+
+def iter_html_from_fountain_chunks(text):
+    '''Fountain フォーマットの台本を、シーンごとのチャンクを解析しながら HTML にする
+
+    全体の解析を待たずに最初の部分を返す
+    '''
+    yield HTML_HEAD
+    yield from iter_fountain_html(*iter_fountain_elements(text))
+    yield HTML_TAIL
+
+
+def iter_fountain_html(metadata, elements):
+    '''Fountain の台本のメタデータと要素から、HTML の本文を少しずつ生成
+    '''
+    if 'title' in metadata:
+        for title in metadata['title']:
+            yield f'<h1>{escape(title)}</h1>'
+    if 'author' in metadata:
+        for author in metadata['author']:
+            yield f'<div style="text-align:right;">{escape(author)}</div>'
+    yield '<hr>'
+
+    for e in elements:
         if e.element_type == 'Scene Heading':
-            content += f'<h2>{e.element_text}</h2>'
+            yield f'<h2>{escape(e.element_text)}</h2>'
         elif e.element_type == 'Action':
             if e.is_centered:
-                content += f'<p style="text-align:center;">{e.element_text}</p>'
+                yield f'<p style="text-align:center;">{escape(e.element_text)}</p>'
             else:
-                content += f'<p>{e.element_text}</p>'
+                yield f'<p>{escape(e.element_text)}</p>'
         elif e.element_type == 'Character':
-            content += f'<p><strong>{e.element_text}</strong></p>'
+            yield f'<p><strong>{escape(e.element_text)}</strong></p>'
         elif e.element_type == 'Dialogue':
-            dialogue_html = e.element_text.replace('\n', '<br>')
-            content += f'<div style="margin-left: 2em;">{dialogue_html}</div>'
+            dialogue_html = escape(e.element_text).replace('\n', '<br>')
+            yield f'<div style="margin-left: 2em;">{dialogue_html}</div>'
         elif e.element_type == 'Parenthetical':
-            content += f'<div style="margin-left: 2em; color: gray;">{e.element_text}</div>'
+            yield f'<div style="margin-left: 2em; color: gray;">{escape(e.element_text)}</div>'
         elif e.element_type == 'Transition':
-            content += f'<p style="text-align: right;"><em>{e.element_text.upper()}</em></p>'
+            yield f'<p style="text-align: right;"><em>{escape(e.element_text.upper())}</em></p>'
         elif e.element_type == 'Section Heading':
-            content += f'<h3 style="margin-top: 2em;">{e.element_text}</h3>'
+            yield f'<h3 style="margin-top: 2em;">{escape(e.element_text)}</h3>'
         elif e.element_type == 'Page Break':
-            content += '<hr style="margin: 2em 0;">'
+            yield '<hr style="margin: 2em 0;">'
         elif e.element_type == 'Empty Line':
-            content += '<br>'
+            yield '<br>'
         # Synopsis, Comment, Boneyard はビューアでは無視
 
-    html = f"""<html lang="ja">
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0, user-scalable=yes">
-            <style>
-                body {{ line-height: 1.6; font-family: sans-serif; }}
-                h1, h2, h3 {{ margin-top: 1.5em; margin-bottom: 0.5em; }}
-                p {{ margin: 0.5em 0; }}
-            </style>
-        </head>
-        <body>{content}</body>
-    </html>"""
-    return html
+
+def stream_script_html(text, format, chunk_size=8192):
+    '''台本の HTML を、StreamingHttpResponse 用に chunk_size 文字程度ずつ返す
+
+    生成済みの HTML がキャッシュにあればそれを分けて返す
+    なければ HTML を生成しながら返し、HTML_MEMO_MAX_SIZE までの大きさなら
+    最後まで返した後にキャッシュに入れる
+    STREAM_MIN_SIZE 以上の未解析の台本は、全体の解析を待たずに
+    チャンクごとに解析しながら返す (解析結果も HTML もキャッシュしない)
+    '''
+    entry = parsed_script_cache.peek(text, format)
+    if entry is None and len(text) < STREAM_MIN_SIZE:
+        entry = parsed_script(text, format)
+
+    html = entry.result('html') if entry is not None else None
+    if html is not None:
+        for start in range(0, len(html), chunk_size):
+            yield html[start:start + chunk_size]
+        return
+
+    if entry is None:
+        chunks = iter_html_from_fountain_chunks(text) if format == 1\
+            else iter_html_from_sp_yaml_chunks(text)
+    elif format == 1:
+        chunks = iter_html_from_fountain(entry.document)
+    else:
+        chunks = iter_html_from_sp_yaml(entry.document)
+
+    # 小さい断片をまとめて返しながら、キャッシュに入れる分だけ覚えておく
+    # (大きすぎたら手放して、HTML 全体を持たないようにする)
+    parts = [] if entry is not None else None
+    size = 0
+    for part in join_html_chunks(chunks, chunk_size):
+        if parts is not None:
+            size += len(part)
+            if size <= HTML_MEMO_MAX_SIZE:
+                parts.append(part)
+            else:
+                parts = None
+        yield part
+
+    if parts is not None:
+        entry.memo('html', lambda document: ''.join(parts))
+
+
+def join_html_chunks(chunks, chunk_size):
+    '''HTML の小さい断片を、chunk_size 文字程度ずつにまとめて返す
+    '''
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
@@ -1,17 +1,22 @@
 from typing import Any
 from django.views.generic import ListView, DetailView
-from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.views.generic.edit import CreateView, UpdateView, DeleteView,\
+    FormView
 from django.urls import reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 
 from production.models import Production, ProdUser
 from ..models import Script
-from .view_func import html_from_fountain, html_from_sp_yaml, add_data_from_script
+from ..cache_func import parsed_script_cache
+from ..forms import ProdUpdateFromScriptForm
+from .view_func import stream_script_html, add_data_from_script,\
+    update_data_from_script
 
 
 class ScriptList(LoginRequiredMixin, ListView):
@@ -20,7 +25,8 @@ class ScriptList(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         # 公開されている台本と、自分が所有者の台本のみ表示
-        return Script.objects.select_related('owner').filter(
+        # (一覧では台本データを表示しないので読み込まない)
+        return Script.objects.select_related('owner').defer('raw_data').filter(
             Q(public_level=2) | Q(owner=self.request.user)
         )
 
@@ -56,6 +62,9 @@ class ScriptUpdate(LoginRequiredMixin, UpdateView):
         return obj
 
     def form_valid(self, form):
+        # 更新前の台本の解析結果は使われなくなるので、キャッシュから消す
+        parsed_script_cache.discard(form.initial.get('raw_data', ''),
+            form.initial.get('format'))
         messages.success(self.request, f"'{form.instance.title}' を更新しました。")
         return super().form_valid(form)
 
@@ -84,12 +93,12 @@ class ScriptViewer(LoginRequiredMixin, DetailView):
         if request.user != script_obj.owner and script_obj.public_level != 2:
             raise PermissionDenied
 
-        if script_obj.format == 1:  # Fountain
-            html = html_from_fountain(script_obj.raw_data)
-        elif script_obj.format == 2:  # sp.yaml
-            html = html_from_sp_yaml(script_obj.raw_data)
-        else:
-            html = "<h1>Unsupported Format</h1><p>この台本形式はプレビューに対応していません。</p>"
+        if script_obj.format in (1, 2):  # Fountain, sp.yaml
+            # 生成した部分から順にブラウザに送る
+            return StreamingHttpResponse(
+                stream_script_html(script_obj.raw_data, script_obj.format),
+                content_type='text/html; charset=utf-8')
+        html = "<h1>Unsupported Format</h1><p>この台本形式はプレビューに対応していません。</p>"
         return HttpResponse(html)
 
 
@@ -101,7 +110,9 @@ class ProdFromScript(LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('production:prod_list')
 
     def dispatch(self, request, *args, **kwargs):
-        self.script = get_object_or_404(Script, pk=self.kwargs['scrpt_id'])
+        # 台本データは add_data_from_script などで読み込む
+        self.script = get_object_or_404(Script.objects.defer('raw_data'),
+            pk=self.kwargs['scrpt_id'])
         if request.user != self.script.owner and self.script.public_level != 2:
             raise PermissionDenied
         return super().dispatch(request, *args, **kwargs)
@@ -112,16 +123,70 @@ class ProdFromScript(LoginRequiredMixin, CreateView):
         return initial
 
     def form_valid(self, form):
-        new_prod = form.save()
-        ProdUser.objects.create(
-            production=new_prod,
-            user=self.request.user,
-            is_owner=True
-        )
-        add_data_from_script(new_prod.id, self.script.id)
+        # 公演の作成から台本のデータの追加までを1つのトランザクションで行う
+        with transaction.atomic():
+            new_prod = form.save()
+            ProdUser.objects.create(
+                production=new_prod,
+                user=self.request.user,
+                is_owner=True
+            )
+            result = add_data_from_script(new_prod.id, self.script.id)
         messages.success(self.request, f"'{new_prod.name}' を作成しました。")
+        if result:
+            messages.info(self.request,
+                f"登場人物 {result['characters']} 人、"
+                f"シーン {result['scenes']} 件、"
+                f"出番 {result['appearances']} 件を追加しました。"
+                f"(解析 {result['parse_sec']:.2f} 秒、"
+                f"保存 {result['save_sec']:.2f} 秒)")
         return super().form_valid(form)
 
     def form_invalid(self, form):
         messages.warning(self.request, "作成できませんでした。")
         return super().form_invalid(form)
+
+
+class ProdUpdateFromScript(LoginRequiredMixin, FormView):
+    """台本のデータで既存の公演を更新するビュー
+
+    シーンと登場人物は名前と順番で既存のものに対応づけて差分で更新するので、
+    コメントや完成度、配役は残る
+    """
+    form_class = ProdUpdateFromScriptForm
+    template_name = 'script/production_update_from_script.html'
+    success_url = reverse_lazy('production:prod_list')
+
+    def dispatch(self, request, *args, **kwargs):
+        # 台本データは add_data_from_script などで読み込む
+        self.script = get_object_or_404(Script.objects.defer('raw_data'),
+            pk=self.kwargs['scrpt_id'])
+        if request.user != self.script.owner and self.script.public_level != 2:
+            raise PermissionDenied
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        production = form.cleaned_data['production']
+        result = update_data_from_script(production.id, self.script.id)
+        if result is None:
+            messages.error(self.request, "台本のデータを読み込めませんでした。")
+            return self.form_invalid(form)
+
+        messages.success(self.request, f"'{production.name}' を更新しました。")
+        summary = "、".join(
+            f"{label} 追加 {result[key]['created']} "
+            f"変更 {result[key]['updated']} 削除 {result[key]['deleted']}"
+            for key, label in (('characters', '登場人物'), ('scenes', 'シーン'),
+                ('appearances', '出番')))
+        messages.info(self.request, f"{summary} "
+            f"(解析 {result['parse_sec']:.2f} 秒、保存 {result['save_sec']:.2f} 秒)")
+        return super().form_valid(form)
+
+    def form_invalid(self, form):
+        messages.warning(self.request, "更新できませんでした。")
+        return super().form_invalid(form)